@@ -9,13 +9,67 @@ import numpy
 # installed as a dependency on python-scientific
 from Scientific.IO.NetCDF import NetCDFFile
 
-from safe.storage.raster import Raster
+from safe.common.utilities import unique_filename
+from safe.storage.block_writer import BlockWriter
+from safe.storage.projection import Projection
 from safe.storage.utilities import raster_geometry2geotransform
+from safe.storage.utilities import write_keywords
+
+# Maximal number of bytes of each grid aggregated at a time
+BLOCK_SIZE = 2 ** 24
+
+
+def max_over_time(variable, n, block_size=BLOCK_SIZE):
+    """Compute maximum of first n timesteps one block of rows at a time
+
+    Args:
+        * variable: Variable of dimensions time x rows x columns, e.g. a
+            NetCDF variable. Only one timestep of one block of rows is
+            read at a time.
+        * n: Positive integer determining how many timesteps to use
+        * block_size: Maximal number of bytes of the aggregated grids
+            held in memory for each block
+
+    Returns:
+        * Generator of tuples (start, stop, maximum, peak) for consecutive
+          blocks of rows start:stop. Maximum is the maximum of each
+          grid point in the first n timesteps and peak is the index
+          of the first timestep where it was attained.
+
+    Note:
+        As for numpy.maximum, the maximum of a grid point with missing
+        values (NaN) is NaN. Grid points never exceeding zero have
+        maximum zero and peak zero.
+    """
+
+    _, M, N = variable.shape
+    rows = max(1, block_size // (2 * 8 * N))
+    for start in range(0, M, rows):
+        stop = min(start + rows, M)
+        maximum = numpy.zeros((stop - start, N), dtype=numpy.float)
+        peak = numpy.zeros((stop - start, N), dtype=numpy.int)
+        for i in range(n):
+            B = variable[i, start:stop, :]
+            peak[B > maximum] = i
+            maximum = numpy.maximum(maximum, B)
+
+        yield start, stop, maximum, peak
+
+
+def _move_tif(source, target):
+    """Rename GeoTIFF file replacing any existing one
+    """
+
+    if os.path.exists(target):
+        # Rename does not overwrite on Windows
+        os.remove(target)
+    os.rename(source, target)
 
 
 # FIXME (Ole): Write test using
 # inasafe_data/test/201211120500_Jakarta_200m_Sobek_Forecast_CCAM.nc
-def convert_netcdf2tif(filename, n, verbose=False, output_dir=None):
+def convert_netcdf2tif(filename, n, verbose=False, output_dir=None,
+                       time_of_peak=False, block_size=BLOCK_SIZE):
 
     """Convert netcdf to tif aggregating first n bands
 
@@ -25,11 +79,26 @@ def convert_netcdf2tif(filename, n, verbose=False, output_dir=None):
         * verbose: Boolean flag controlling whether diagnostics
           will be printed to screen. This is useful when run from
           a command line script.
+        * output_dir: Optional directory in which a subdirectory for
+          the result is created. Default is the directory of filename.
+        * time_of_peak: If True, also write the hour at which each
+          pixel reaches its maximum.
+        * block_size: Maximal number of bytes of the aggregated grids
+          held in memory at a time. See max_over_time.
 
     Returns
         * Raster file in tif format. Each pixel will be the maximum
           of that pixel in the first n bands in the input file.
-
+        * If time_of_peak is True, a tuple with that raster file and
+          a raster file in tif format with the hour (1 to n) of the
+          first band where each pixel reached its maximum. Pixels
+          that were never flooded have time of peak 0.
+
+    Note:
+        The forecast is read one band of a block of rows at a time
+        and the rasters are written block by block so memory use
+        does not depend on the number of bands or the size of the
+        grid.
     """
 
     if not isinstance(filename, basestring):
@@ -81,7 +150,9 @@ def convert_netcdf2tif(filename, n, verbose=False, output_dir=None):
     x = fid.variables['x'][:]
     y = fid.variables['y'][:]
     # t = fid.variables['time'][:]
-    inundation_depth = fid.variables['Inundation_Depth'][:]
+
+    # Data is read block by block from the variable
+    inundation_depth = fid.variables['Inundation_Depth']
 
     T = inundation_depth.shape[0]  # Number of time steps
     M = inundation_depth.shape[1]  # Steps in the y direction
@@ -92,20 +163,52 @@ def convert_netcdf2tif(filename, n, verbose=False, output_dir=None):
                'forecast only contains %i hours' % (n, T))
         raise RuntimeError(msg)
 
-    # Compute the max of the first n timesteps
-    A = numpy.zeros((M, N), dtype='float')
-    for i in range(n):
-        B = inundation_depth[i, :, :]
-        A = numpy.maximum(A, B)
-
-        # Calculate overall maximal value
-        total_max = numpy.max(A[:])
-        #print i, numpy.max(B[:]), total_max
-
     geotransform = raster_geometry2geotransform(x, y)
 
-    # Write result to tif file
+    # Write result to tif files under temporary names as the name
+    # depends on the overall maximal value.
     # NOTE: This assumes a default projection (WGS 84, geographic)
+    if output_dir is None:
+        dirname = os.path.dirname(os.path.abspath(filename))
+    else:
+        dirname = output_dir
+    projection = Projection(None)
+    writers = []
+    try:
+        max_tmp_filename = unique_filename(suffix='.tif', dir=dirname)
+        max_writer = BlockWriter(max_tmp_filename, M, N, projection,
+                                 geotransform)
+        writers.append(max_writer)
+        if time_of_peak:
+            peak_tmp_filename = unique_filename(suffix='.tif', dir=dirname)
+            peak_writer = BlockWriter(peak_tmp_filename, M, N, projection,
+                                      geotransform)
+            writers.append(peak_writer)
+
+        # Compute the max of the first n timesteps
+        total_max = 0.0
+        for start, stop, A, peak in max_over_time(inundation_depth, n,
+                                                  block_size=block_size):
+            # Calculate overall maximal value
+            total_max = max(total_max, numpy.max(A))
+
+            # Flip blocks upside down as rows are ordered from south
+            # to north
+            max_writer.write(numpy.flipud(A), M - stop)
+            if time_of_peak:
+                hours = numpy.where(A > 0, peak + 1, 0)
+                peak_writer.write(numpy.flipud(hours), M - stop)
+    except:
+        # Do not leave partially written files behind
+        for writer in writers:
+            writer.close()
+            if os.path.exists(writer.filename):
+                os.remove(writer.filename)
+        raise
+
+    for writer in writers:
+        writer.close()
+
     date = os.path.split(basename)[-1].split('_')[0]
 
     if verbose:
@@ -113,17 +216,6 @@ def convert_netcdf2tif(filename, n, verbose=False, output_dir=None):
         print 'Geotransform', geotransform
         print 'date', date
 
-    # Flip array upside down as it comes with rows ordered from south to north
-    A = numpy.flipud(A)
-
-    R = Raster(data=A,
-               geotransform=geotransform,
-               keywords={'category': 'hazard',
-                         'subcategory': 'flood',
-                         'unit': 'm',
-                         'title': ('%d hour flood forecast grid '
-                                   'in Jakarta at %s' % (n, date))})
-
     tif_filename = '%s_%d_hours_max_%.2f.tif' % (basename, n, total_max)
     if output_dir is not None:
         subdir_name = os.path.splitext(os.path.basename(tif_filename))[0]
@@ -132,9 +224,30 @@ def convert_netcdf2tif(filename, n, verbose=False, output_dir=None):
             os.mkdir(shapefile_dir)
         tif_filename = os.path.join(shapefile_dir, subdir_name + '.tif')
 
-    R.write_to_file(tif_filename)
+    _move_tif(max_tmp_filename, tif_filename)
+    write_keywords({'category': 'hazard',
+                    'subcategory': 'flood',
+                    'unit': 'm',
+                    'title': ('%d hour flood forecast grid '
+                              'in Jakarta at %s' % (n, date))},
+                   os.path.splitext(tif_filename)[0] + '.keywords')
+
+    if verbose:
+        print 'Success: %d hour forecast written to %s' % (n, tif_filename)
+
+    if not time_of_peak:
+        return tif_filename
+
+    peak_filename = os.path.splitext(tif_filename)[0] + '_time_of_peak.tif'
+    _move_tif(peak_tmp_filename, peak_filename)
+    write_keywords({'category': 'hazard',
+                    'subcategory': 'flood',
+                    'unit': 'hours',
+                    'title': ('%d hour flood forecast time of peak '
+                              'in Jakarta at %s' % (n, date))},
+                   os.path.splitext(peak_filename)[0] + '.keywords')
 
     if verbose:
-        print 'Success: %d hour forecast written to %s' % (n, R.filename)
+        print 'Time of peak written to %s' % peak_filename
 
-    return tif_filename
+    return tif_filename, peak_filename
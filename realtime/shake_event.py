@@ -21,8 +21,8 @@ __copyright__ = ('Copyright 2012, Australia Indonesia Facility for '
 import os
 import sys
 import shutil
-from xml.dom import minidom
 import math
+from cStringIO import StringIO
 from subprocess import call, CalledProcessError
 import logging
 from datetime import datetime
@@ -79,6 +79,7 @@ from qgis.core import (
 from safe_qgis.utilities.utilities_for_testing import get_qgis_app
 from safe_qgis.exceptions import TranslationLoadError
 from safe.common.version import get_version
+from safe.common.converter import read_grid_xml
 from safe.api import get_plugins as safe_get_plugins
 from safe.api import read_layer as safe_read_layer
 from safe.api import calculate_impact as safe_calculate_impact
@@ -173,6 +174,9 @@ class ShakeEvent(QObject):
         self.rows = None
         self.columns = None
         self.mmiData = None
+        # All fields of grid data (one column per field)
+        self.gridFields = None
+        self.gridData = None
         self.populationRasterPath = thePopulationRasterPath
         # Path to tif of impact result - probably we wont even use it
         self.impactFile = None
@@ -325,61 +329,36 @@ class ShakeEvent(QObject):
         LOGGER.debug('ParseGridXml requested.')
         myPath = self.gridFilePath()
         try:
-            myDocument = minidom.parse(myPath)
-            myEventElement = myDocument.getElementsByTagName('event')
-            myEventElement = myEventElement[0]
-            self.magnitude = float(myEventElement.attributes[
-                                   'magnitude'].nodeValue)
-            self.longitude = float(myEventElement.attributes[
-                                   'lon'].nodeValue)
-            self.latitude = float(myEventElement.attributes[
-                                  'lat'].nodeValue)
-            self.location = myEventElement.attributes[
-                'event_description'].nodeValue.strip()
-            self.depth = float(myEventElement.attributes['depth'].nodeValue)
+            myHeader, myFields, myData = read_grid_xml(myPath)
+            myEventElement = myHeader['event']
+            self.magnitude = float(myEventElement['magnitude'])
+            self.longitude = float(myEventElement['lon'])
+            self.latitude = float(myEventElement['lat'])
+            self.location = myEventElement['event_description'].strip()
+            self.depth = float(myEventElement['depth'])
             # Get the date - its going to look something like this:
             # 2012-08-07T01:55:12WIB
-            myTimeStamp = myEventElement.attributes[
-                'event_timestamp'].nodeValue
+            myTimeStamp = myEventElement['event_timestamp']
             self.extractDateTime(myTimeStamp)
             # Note the timezone here is inconsistent with YZ from grid.xml
             # use the latter
             self.timeZone = myTimeStamp[-3:]
 
-            mySpecificationElement = myDocument.getElementsByTagName(
-                'grid_specification')
-            mySpecificationElement = mySpecificationElement[0]
-            self.xMinimum = float(mySpecificationElement.attributes[
-                                  'lon_min'].nodeValue)
-            self.xMaximum = float(mySpecificationElement.attributes[
-                                  'lon_max'].nodeValue)
-            self.yMinimum = float(mySpecificationElement.attributes[
-                                  'lat_min'].nodeValue)
-            self.yMaximum = float(mySpecificationElement.attributes[
-                                  'lat_max'].nodeValue)
-            self.rows = float(mySpecificationElement.attributes[
-                              'nlat'].nodeValue)
-            self.columns = float(mySpecificationElement.attributes[
-                                 'nlon'].nodeValue)
-            myDataElement = myDocument.getElementsByTagName(
-                'grid_data')
-            myDataElement = myDataElement[0]
-            myData = myDataElement.firstChild.nodeValue
-
-            # Extract the 1,2 and 5th (MMI) columns and populate mmiData
-            myLonColumn = 0
-            myLatColumn = 1
-            myMMIColumn = 4
-            self.mmiData = []
-            for myLine in myData.split('\n'):
-                if not myLine:
-                    continue
-                myTokens = myLine.split(' ')
-                myLon = myTokens[myLonColumn]
-                myLat = myTokens[myLatColumn]
-                myMMI = myTokens[myMMIColumn]
-                myTuple = (myLon, myLat, myMMI)
-                self.mmiData.append(myTuple)
+            mySpecificationElement = myHeader['grid_specification']
+            self.xMinimum = float(mySpecificationElement['lon_min'])
+            self.xMaximum = float(mySpecificationElement['lon_max'])
+            self.yMinimum = float(mySpecificationElement['lat_min'])
+            self.yMaximum = float(mySpecificationElement['lat_max'])
+            self.rows = float(mySpecificationElement['nlat'])
+            self.columns = float(mySpecificationElement['nlon'])
+
+            # Keep all fields and extract the LON, LAT and MMI columns
+            # as mmiData
+            self.gridFields = myFields
+            self.gridData = myData
+            myColumns = [myFields.index(myName)
+                         for myName in ['LON', 'LAT', 'MMI']]
+            self.mmiData = myData[:, myColumns]
 
         except Exception, e:
             LOGGER.exception('Event parse failed')
@@ -392,10 +371,10 @@ class ShakeEvent(QObject):
 
         The returned string will look like this::
 
-           123.0750,01.7900,1
-           123.1000,01.7900,1.14
-           123.1250,01.7900,1.15
-           123.1500,01.7900,1.16
+           123.075,1.79,1
+           123.1,1.79,1.14
+           123.125,1.79,1.15
+           123.15,1.79,1.16
            etc...
 
         Args: None
@@ -406,10 +385,10 @@ class ShakeEvent(QObject):
         Raises: None
 
         """
-        myString = 'lon,lat,mmi\n'
-        for myRow in self.mmiData:
-            myString += '%s,%s,%s\n' % (myRow[0], myRow[1], myRow[2])
-        return myString
+        myFile = StringIO()
+        myFile.write('lon,lat,mmi\n')
+        numpy.savetxt(myFile, self.mmiData, fmt='%.10g', delimiter=',')
+        return myFile.getvalue()
 
     def mmiDataToDelimitedFile(self, theForceFlag=True):
         """Save the mmiData to a delimited text file suitable for processing
@@ -2342,7 +2321,7 @@ class ShakeEvent(QObject):
         else:
             myExtentWithCities = 'Not set'
 
-        if self.mmiData:
+        if self.mmiData is not None and len(self.mmiData) > 0:
             mmiData = 'Populated'
         else:
             mmiData = 'Not populated'
@@ -4,7 +4,7 @@ import unittest
 import numpy
 import os
 
-from netcdf_utilities import convert_netcdf2tif
+from netcdf_utilities import convert_netcdf2tif, max_over_time
 from safe.storage.core import read_layer
 from safe.storage.vector import Vector
 from safe.engine.interpolation import tag_polygons_by_grid
@@ -84,6 +84,75 @@ class Test_flood_forecasting_functionality(unittest.TestCase):
 
         return
 
+    def test_max_over_time(self):
+        """Maximum over time is computed one block of rows at a time
+        """
+
+        A = numpy.zeros((4, 5, 3))
+        A[0, :, :] = 1
+        A[2, 1, :] = 3
+        A[3, 4, 2] = 7
+        A[1, 2, 0] = -2
+
+        for block_size in [1, 100, 10000]:
+            D = numpy.zeros((5, 3))
+            P = numpy.zeros((5, 3), dtype=int)
+            rows = []
+            for start, stop, maximum, peak in max_over_time(A, 3,
+                                                            block_size):
+                D[start:stop] = maximum
+                P[start:stop] = peak
+                rows.append((start, stop))
+
+            # Blocks cover all rows
+            assert rows[0][0] == 0
+            assert rows[-1][1] == 5
+            for i in range(len(rows) - 1):
+                assert rows[i][1] == rows[i + 1][0]
+
+            # Only the first three timesteps are used
+            assert numpy.allclose(D, numpy.max(A[:3], axis=0))
+            assert P[1, 0] == 2
+            assert P[4, 2] == 0
+            assert P.sum() == 6
+
+        # Small blocks hold one row
+        assert len(list(max_over_time(A, 3, 1))) == 5
+        assert len(list(max_over_time(A, 3, 10000))) == 1
+
+    def test_convert_netcdf2tif_by_blocks(self):
+        """NetCDF flood forecasts can be converted block by block
+        """
+
+        from Scientific.IO.NetCDF import NetCDFFile
+        fid = NetCDFFile(self.nc_filename)
+        inundation_depth = fid.variables['Inundation_Depth'][:]
+        expected_max = numpy.flipud(numpy.max(inundation_depth[:24],
+                                              axis=0))
+        fid.close()
+
+        tif_filename, peak_filename = convert_netcdf2tif(self.nc_filename,
+                                                         24,
+                                                         time_of_peak=True,
+                                                         block_size=10000)
+
+        # Same result as for all data at once
+        D = read_layer(tif_filename).get_data()
+        assert numpy.allclose(D, numpy.maximum(expected_max, 0))
+
+        # Time of peak is when maximum is first attained
+        H = read_layer(peak_filename).get_data()
+        assert numpy.all(H[D == 0] == 0)
+        for i, j in zip(*numpy.where(D > 0)):
+            hour = int(H[i, j])
+            assert 1 <= hour <= 24
+            depth = inundation_depth[hour - 1, -i - 1, j]
+            assert numpy.allclose(depth, D[i, j])
+
+        for filename in [tif_filename, peak_filename]:
+            os.remove(filename)
+            os.remove(os.path.splitext(filename)[0] + '.keywords')
+
     def test_tag_regions_by_flood(self):
         """Regions can be tagged correctly with data from flood forecasts
         """
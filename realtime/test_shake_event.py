@@ -92,7 +92,10 @@ class TestShakeEvent(unittest.TestCase):
         self.assertEquals(25921, len(myGridXmlData))
 
         myDelimitedString = myShakeEvent.mmiDataToDelimitedText()
-        self.assertEqual(578234, len(myDelimitedString))
+        myLines = myDelimitedString.splitlines()
+        self.assertEqual(25922, len(myLines))
+        self.assertEqual('lon,lat,mmi', myLines[0])
+        self.assertEqual(myShakeEvent.mmiData.shape, (25921, 3))
 
     def test_eventGridToCsv(self):
         """Test grid data can be written to csv"""
@@ -21,7 +21,9 @@ __copyright__ = ('Copyright 2012, Australia Indonesia Facility for '
                  'Disaster Reduction')
 
 # pylint: disable=W0611
-from safe.storage.vector import Vector
+from safe.storage.vector import (Vector,
+                                 calculate_polygon_centroids,
+                                 calculate_polygon_areas)
 from safe.storage.raster import Raster
 from safe.defaults import DEFAULTS
 from safe.storage.utilities import (
@@ -65,7 +67,9 @@ from safe.common.utilities import (
     format_int)
 from safe.common.converter import convert_mmi_data
 from safe.common.version import get_version
-from safe.common.polygon import in_and_outside_polygon
+from safe.common.polygon import (in_and_outside_polygon,
+                                 label_points_by_polygons,
+                                 labels_to_indices)
 from safe.common.tables import Table, TableCell, TableRow
 from safe.postprocessors import (
     get_postprocessors,
@@ -21,10 +21,11 @@ __copyright__ = ('Copyright 2012, Australia Indonesia Facility for '
 import os
 import sys
 import shutil
-from xml.dom import minidom
+from xml.parsers import expat
 from subprocess import call, CalledProcessError
+from cStringIO import StringIO
 import logging
-
+import numpy
 
 from safe.common.exceptions import (GridXmlFileNotFoundError,
                                     GridXmlParseError)
@@ -40,6 +41,115 @@ def dataDir():
     return myDir
 
 
+# Number of bytes of grid.xml files read at a time
+GRID_XML_BLOCK_SIZE = 2 ** 20
+
+
+def read_grid_xml(path, block_size=GRID_XML_BLOCK_SIZE):
+    """Read header and data of a shakemap grid.xml file
+
+    Args:
+        * path: Path to grid.xml file
+        * block_size: Number of bytes read from the file at a time
+
+    Returns:
+        * header: Dictionary mapping names of elements before grid_data
+          (e.g. event and grid_specification) to dictionaries of their
+          attributes
+        * fields: List of names of grid fields ordered by their index
+          (e.g. ['LON', 'LAT', 'PGA', 'PGV', 'MMI', ...])
+        * data: Array of floats with one row per grid point and one
+          column per field
+
+    Raises: GridXmlParseError
+
+    Note:
+        Elements before grid_data are read with an incremental XML
+        parser. The text of grid_data is neither parsed as XML nor split
+        into lines but converted to numbers one block at a time with
+        numpy.fromstring, so the whole file is never held in memory.
+    """
+
+    header = {}
+    fields = {}
+
+    def start_element(name, attributes):
+        """Record attributes of header elements
+        """
+        if name == 'grid_field':
+            fields[int(attributes['index'])] = str(attributes['name'])
+        else:
+            header[name] = attributes
+
+    parser = expat.ParserCreate()
+    parser.StartElementHandler = start_element
+
+    fid = open(path)
+    try:
+        # Read until the start tag of grid_data and parse header
+        text = ''
+        end = -1
+        while end < 0:
+            block = fid.read(block_size)
+            if not block:
+                msg = 'Could not find element grid_data in %s' % path
+                raise GridXmlParseError(msg)
+            text += block
+            start = text.find('<grid_data')
+            if start >= 0:
+                end = text.find('>', start)
+        parser.Parse(text[:end + 1], False)
+        text = text[end + 1:]
+
+        # Convert grid data to numbers block by block
+        values = []
+        while True:
+            stop = text.find('</grid_data')
+            if stop >= 0:
+                values.append(_parse_numbers(text[:stop]))
+                break
+
+            block = fid.read(block_size)
+            if not block:
+                msg = 'Element grid_data in %s is not terminated' % path
+                raise GridXmlParseError(msg)
+
+            # The last number may continue in the next block
+            cut = max([text.rfind(c) for c in ' \t\r\n'])
+            values.append(_parse_numbers(text[:cut + 1]))
+            text = text[cut + 1:] + block
+    finally:
+        fid.close()
+
+    fields = [fields[i] for i in sorted(fields)]
+    values = numpy.concatenate(values)
+
+    msg = ('Grid data in %s has %i values which is not a multiple of '
+           'the number of fields %i' % (path, len(values), len(fields)))
+    if len(fields) == 0 or len(values) % len(fields) != 0:
+        raise GridXmlParseError(msg)
+    data = values.reshape((-1, len(fields)))
+
+    if 'grid_specification' in header:
+        specification = header['grid_specification']
+        points = int(specification['nlon']) * int(specification['nlat'])
+        msg = ('Grid data in %s has %i points but grid specification '
+               'has %i' % (path, len(data), points))
+        if len(data) != points:
+            raise GridXmlParseError(msg)
+
+    return header, fields, data
+
+
+def _parse_numbers(text):
+    """Convert text of whitespace separated numbers to array of floats
+    """
+
+    if text.strip() == '':
+        return numpy.zeros(0, dtype=numpy.float)
+    return numpy.fromstring(text, sep=' ')
+
+
 class ShakeEvent():
     """The ShakeEvent class encapsulates behaviour and data relating to an
     earthquake, including epicenter, magnitude etc."""
@@ -74,6 +184,9 @@ class ShakeEvent():
         self.rows = None
         self.columns = None
         self.mmiData = None
+        # All fields of grid data (one column per field)
+        self.gridFields = None
+        self.gridData = None
         # Path to tif of impact result - probably we wont even use it
         self.impactFile = None
         # Path to impact keywords file - this is GOLD here!
@@ -203,60 +316,36 @@ class ShakeEvent():
         LOGGER.debug('ParseGridXml requested.')
         myPath = self.gridFilePath()
         try:
-            myDocument = minidom.parse(myPath)
-            myEventElement = myDocument.getElementsByTagName('event')
-            myEventElement = myEventElement[0]
-            self.magnitude = float(myEventElement.attributes[
-                'magnitude'].nodeValue)
-            self.longitude = float(myEventElement.attributes[
-                'lon'].nodeValue)
-            self.latitude = float(myEventElement.attributes[
-                'lat'].nodeValue)
-            self.location = myEventElement.attributes[
-                'event_description'].nodeValue.strip()
-            self.depth = float(myEventElement.attributes['depth'].nodeValue)
+            myHeader, myFields, myData = read_grid_xml(myPath)
+            myEventElement = myHeader['event']
+            self.magnitude = float(myEventElement['magnitude'])
+            self.longitude = float(myEventElement['lon'])
+            self.latitude = float(myEventElement['lat'])
+            self.location = myEventElement['event_description'].strip()
+            self.depth = float(myEventElement['depth'])
             # Get the date - its going to look something like this:
             # 2012-08-07T01:55:12WIB
-            myTimeStamp = myEventElement.attributes[
-                'event_timestamp'].nodeValue
+            myTimeStamp = myEventElement['event_timestamp']
             self.extractDateTime(myTimeStamp)
             # Note the timezone here is inconsistent with YZ from grid.xml
             # use the latter
             self.timeZone = myTimeStamp[-3:]
 
-            mySpecificationElement = myDocument.getElementsByTagName(
-                'grid_specification')
-            mySpecificationElement = mySpecificationElement[0]
-            self.xMinimum = float(mySpecificationElement.attributes[
-                'lon_min'].nodeValue)
-            self.xMaximum = float(mySpecificationElement.attributes[
-                'lon_max'].nodeValue)
-            self.yMinimum = float(mySpecificationElement.attributes[
-                'lat_min'].nodeValue)
-            self.yMaximum = float(mySpecificationElement.attributes[
-                'lat_max'].nodeValue)
-            self.rows = float(mySpecificationElement.attributes[
-                'nlat'].nodeValue)
-            self.columns = float(mySpecificationElement.attributes[
-                'nlon'].nodeValue)
-            myDataElement = myDocument.getElementsByTagName(
-                'grid_data')
-            myDataElement = myDataElement[0]
-            myData = myDataElement.firstChild.nodeValue
-            # Extract the 1,2 and 5th (MMI) columns and populate mmiData
-            myLonColumn = 0
-            myLatColumn = 1
-            myMMIColumn = 4
-            self.mmiData = []
-            for myLine in myData.split('\n'):
-                if not myLine:
-                    continue
-                myTokens = myLine.split(' ')
-                myLon = myTokens[myLonColumn]
-                myLat = myTokens[myLatColumn]
-                myMMI = myTokens[myMMIColumn]
-                myTuple = (myLon, myLat, myMMI)
-                self.mmiData.append(myTuple)
+            mySpecificationElement = myHeader['grid_specification']
+            self.xMinimum = float(mySpecificationElement['lon_min'])
+            self.xMaximum = float(mySpecificationElement['lon_max'])
+            self.yMinimum = float(mySpecificationElement['lat_min'])
+            self.yMaximum = float(mySpecificationElement['lat_max'])
+            self.rows = float(mySpecificationElement['nlat'])
+            self.columns = float(mySpecificationElement['nlon'])
+
+            # Keep all fields and extract the LON, LAT and MMI columns
+            # as mmiData
+            self.gridFields = myFields
+            self.gridData = myData
+            myColumns = [myFields.index(myName)
+                         for myName in ['LON', 'LAT', 'MMI']]
+            self.mmiData = myData[:, myColumns]
 
         except Exception, e:
             LOGGER.exception('Event parse failed')
@@ -274,10 +363,10 @@ class ShakeEvent():
 
         The returned string will look like this::
 
-           123.0750,01.7900,1
-           123.1000,01.7900,1.14
-           123.1250,01.7900,1.15
-           123.1500,01.7900,1.16
+           123.075,1.79,1
+           123.1,1.79,1.14
+           123.125,1.79,1.15
+           123.15,1.79,1.16
            etc...
 
         Args: None
@@ -288,10 +377,10 @@ class ShakeEvent():
         Raises: None
 
         """
-        myString = 'lon,lat,mmi\n'
-        for myRow in self.mmiData:
-            myString += '%s,%s,%s\n' % (myRow[0], myRow[1], myRow[2])
-        return myString
+        myFile = StringIO()
+        myFile.write('lon,lat,mmi\n')
+        numpy.savetxt(myFile, self.mmiData, fmt='%.10g', delimiter=',')
+        return myFile.getvalue()
 
     def mmiDataToDelimitedFile(self, theForceFlag=True):
         """Save the mmiData to a delimited text file suitable for processing
@@ -4,6 +4,17 @@
 import numpy
 from utilities import verify
 
+# Number of histogram bins of each interval in each pass of
+# order_statistics
+HISTOGRAM_BINS = 4096
+
+# Maximal number of values collected and sorted by order_statistics
+SORTED_VALUES_LIMIT = 2 ** 20
+
+# Number of passes of order_statistics after which values are sorted
+# regardless of their number
+MAXIMAL_PASSES = 16
+
 
 def ensure_numeric(A, typecode=None):
     """Ensure that sequence is a numeric array.
@@ -257,6 +268,30 @@ def grid2points(A, x, y):
     return points, values
 
 
+def grid_indices2points(indices, x, y):
+    """Get coordinates of selected grid points
+
+    Args:
+        * indices: Array of indices into the flattened grid (row * nx + col)
+        * x: Longitudes corresponding to columns (west->east)
+        * y: Latitudes corresponding to rows (south->north)
+
+    Returns:
+        * P: Nx2 array of point coordinates. These are the same as the
+             rows of the points returned by grid2points for those indices.
+    """
+
+    indices = numpy.array(indices, dtype=numpy.int, copy=False)
+    nx = len(x)
+    ny = len(y)
+
+    P = numpy.zeros((len(indices), 2), dtype=numpy.float)
+    P[:, 0] = x[indices % nx]
+    P[:, 1] = y[ny - 1 - indices // nx]
+
+    return P
+
+
 def geotransform2axes(G, nx, ny):
     """Convert geotransform to coordinate axes
 
@@ -312,3 +347,129 @@ def geotransform2axes(G, nx, ny):
 
     # Return
     return x, y
+
+
+def order_statistics(blocks, ranks, vmin, vmax, bins=HISTOGRAM_BINS,
+                     limit=SORTED_VALUES_LIMIT):
+    """Find values of given ranks in data too large to sort
+
+    Args:
+        * blocks: Function returning an iterator over 1D arrays of data
+            values without NaN's. It is called once for each pass over
+            the data.
+        * ranks: List of ranks where 0 is the rank of the smallest value
+        * vmin, vmax: Minimum and maximum of the data
+        * bins: Number of histogram bins of each interval in each pass
+        * limit: Maximal number of values collected and sorted
+
+    Returns:
+        * List of values of given ranks. This is the same as indexing
+          the sorted data by ranks.
+
+    Note:
+        Each pass counts the values in histograms of intervals known to
+        hold the ranks. The intervals are then narrowed to the bins
+        holding the ranks until all intervals hold at most limit values
+        together. Those values are sorted in the last pass. Usually
+        two or three passes are needed.
+    """
+
+    values = [None] * len(ranks)
+
+    if not numpy.isfinite(vmax - vmin):
+        # Histograms need finite intervals so sort all values
+        limit = None
+
+    # Intervals [lo, hi] holding ranks and indices of those ranks
+    intervals = [(vmin, vmax, range(len(ranks)))]
+    passes = 0
+    while intervals:
+        passes += 1
+        if passes > MAXIMAL_PASSES:
+            limit = None
+
+        # Merge overlapping intervals
+        intervals.sort()
+        merged = [intervals[0]]
+        for lo, hi, indices in intervals[1:]:
+            if lo <= merged[-1][1]:
+                merged[-1] = (merged[-1][0], max(hi, merged[-1][1]),
+                              merged[-1][2] + indices)
+            else:
+                merged.append((lo, hi, indices))
+        intervals = merged
+
+        K = len(intervals)
+        lower = numpy.array([lo for lo, _, _ in intervals])
+        upper = numpy.array([hi for _, hi, _ in intervals])
+        width = upper - lower
+        scale = numpy.zeros(K)
+        scale[width > 0] = bins / width[width > 0]
+
+        # Value v is in interval k if bounds[2k] <= v < bounds[2k + 1]
+        bounds = numpy.zeros(2 * K)
+        bounds[0::2] = lower
+        bounds[1::2] = numpy.nextafter(upper, numpy.inf)
+
+        # Count values between bounds and in histogram bins of intervals
+        # and collect values in intervals while there are few
+        positions = numpy.zeros(2 * K + 1, dtype=numpy.int)
+        counts = numpy.zeros(K * bins, dtype=numpy.int)
+        collected = []
+        total = 0
+        for A in blocks():
+            position = numpy.searchsorted(bounds, A, side='right')
+            positions += numpy.bincount(position, minlength=2 * K + 1)
+
+            inside = position % 2 == 1
+            B = A[inside]
+            k = position[inside] // 2
+            index = ((B - lower[k]) * scale[k]).astype(numpy.int)
+            numpy.minimum(index, bins - 1, index)
+            counts += numpy.bincount(k * bins + index, minlength=K * bins)
+
+            if collected is not None:
+                total += len(B)
+                if limit is None or total <= limit:
+                    collected.append(B)
+                else:
+                    collected = None
+
+        # Number of values below each interval and in intervals before it
+        below = numpy.cumsum(positions)[0::2]
+        before = numpy.cumsum(positions[1::2]) - positions[1::2]
+
+        if collected is not None:
+            if len(collected) > 0:
+                C = numpy.sort(numpy.concatenate(collected))
+            for k, (lo, hi, indices) in enumerate(intervals):
+                for i in indices:
+                    rank = ranks[i] - below[k]
+                    msg = 'Rank %i is not in data' % ranks[i]
+                    verify(0 <= rank < positions[2 * k + 1], msg)
+                    values[i] = C[before[k] + rank]
+            break
+
+        # Narrow intervals to bins holding ranks and their neighbours
+        # as bins of values may be off by one due to rounding
+        narrowed = []
+        for k, (lo, hi, indices) in enumerate(intervals):
+            cumulative = numpy.cumsum(counts[k * bins:(k + 1) * bins])
+            for i in indices:
+                rank = ranks[i] - below[k]
+                msg = 'Rank %i is not in data' % ranks[i]
+                verify(0 <= rank < positions[2 * k + 1], msg)
+
+                if hi <= lo:
+                    # All values in interval are the same
+                    values[i] = lo
+                    continue
+
+                b = numpy.searchsorted(cumulative, rank, side='right')
+                d = (hi - lo) / bins
+                narrowed.append((max(lo, lo + (b - 1) * d),
+                                 min(hi, lo + (b + 2) * d),
+                                 [i]))
+        intervals = narrowed
+
+    return values
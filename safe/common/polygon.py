@@ -7,6 +7,9 @@
 
    Some more specific or helper functions include:
      inside_polygon
+     inside_polygons
+     label_points_by_polygons
+     label_grid_by_polygons
      is_inside_polygon
      outside_polygon
      is_outside_polygon
@@ -27,16 +30,31 @@ from random import uniform, seed as seed_function
 
 from safe.common.numerics import ensure_numeric
 from safe.common.numerics import grid2points, geotransform2axes
+from safe.common.numerics import grid_indices2points
 from safe.common.exceptions import PolygonInputError, InaSAFEError
 
 LOGGER = logging.getLogger('InaSAFE')
 
+# Number of points and point-edge pairs processed at a time by the blocked
+# polygon clipping kernel. A tile of 2**14 doubles (128 kB) fits in cache.
+POINT_BLOCK_SIZE = 256
+TILE_SIZE = 2 ** 14
+
+# Distance, relative to the length of a boundary piece, at which the sides
+# of the piece are probed when intersecting polygons
+SIDE_OFFSET = 1.0e-6
+
+# Polygons with at most this many edges are tested against many points at
+# once when intersecting polygons
+SMALL_POLYGON_SIZE = 32
+
 
 def separate_points_by_polygon(points, polygon,
                                polygon_bbox=None,
                                closed=True,
                                check_input=True,
-                               use_numpy=True):
+                               use_numpy=True,
+                               method=None):
     """Determine whether points are inside or outside a polygon.
 
     Args:
@@ -51,6 +69,19 @@ def separate_points_by_polygon(points, polygon,
               the code faster.
         * check_input: Allows faster execution if set to False
         * use_numpy: Use the fast numpy implementation
+        * method: (optional) underlying algorithm. Admissible values are
+
+              'numpy': Loop over polygon edges with numpy operations on
+                  all points. This is the reference implementation.
+
+              'blocked': Process points and polygon edges in cache sized
+                  tiles with preallocated buffers, fusing the edge crossing
+                  and boundary tests. This is faster and uses much less
+                  memory for polygons with many vertices.
+
+              'python': Pure python loops. Very slow - for testing only.
+
+              If None (default), 'numpy' is used unless use_numpy is False.
 
     Returns:
         * indices_inside_polygon: array of indices of points
@@ -109,9 +140,9 @@ def separate_points_by_polygon(points, polygon,
         if polygon.shape[1] != 2:
             raise PolygonInputError(msg)
 
-        msg = ('Points array must be 1 or 2 dimensional. '
-               'I got %d dimensions: %s' % (len(points.shape), points))
         if not 0 < len(points.shape) < 3:
+            msg = ('Points array must be 1 or 2 dimensional. '
+                   'I got %d dimensions: %s' % (len(points.shape), points))
             raise PolygonInputError(msg)
 
         if len(points.shape) == 1:
@@ -123,9 +154,9 @@ def separate_points_by_polygon(points, polygon,
         if points.shape[1] != 2:
             raise PolygonInputError(msg)
 
-        msg = ('Points array must be a 2d array. I got %s...'
-               % str(points[:30]))
         if len(points.shape) != 2:
+            msg = ('Points array must be a 2d array. I got %s...'
+                   % str(points[:30]))
             raise PolygonInputError(msg)
 
         msg = 'Points array must have two columns'
@@ -159,10 +190,22 @@ def separate_points_by_polygon(points, polygon,
     inside_box = -outside_box
     candidate_points = points[inside_box]
 
-    if use_numpy:
+    if method is None:
+        if use_numpy:
+            method = 'numpy'
+        else:
+            method = 'python'
+
+    if method == 'numpy':
         func = _separate_points_by_polygon
-    else:
+    elif method == 'blocked':
+        func = _separate_points_by_polygon_blocked
+    elif method == 'python':
         func = _separate_points_by_polygon_python
+    else:
+        msg = ('Argument method must be either "numpy", "blocked" or '
+               '"python". I got "%s"' % method)
+        raise PolygonInputError(msg)
 
     local_indices_inside, local_indices_outside = func(candidate_points,
                                                        polygon,
@@ -270,6 +313,168 @@ def _separate_points_by_polygon(points, polygon,
     return indices[:inside_index], indices[inside_index:]
 
 
+def _separate_points_by_polygon_blocked(points, polygon,
+                                        closed, rtol=0.0, atol=0.0,
+                                        tile_size=TILE_SIZE):
+    """Underlying blocked algorithm to partition point according to polygon
+
+    Input:
+       points - Mx2 array of point coordinates
+       polygon - Nx2 array of polygon vertices
+       closed - (optional) determine whether points on boundary should be
+       regarded as belonging to the polygon (closed = True)
+       or not (closed = False). Close can also be None.
+       rtol, atol: Tolerances for when a point is considered to coincide with
+       a line. Default 0.0.
+       tile_size: Number of point-edge pairs evaluated at a time
+
+    Output:
+       indices_inside, indices_outside: as for _separate_points_by_polygon
+
+    Note:
+       Points are processed in blocks of increasing latitude so that each
+       block only needs to be tested against polygon edges in its own
+       latitude band. Edge crossings and boundary coincidence are evaluated
+       in the same pass over tiles of points x edges using buffers that
+       are allocated once. The floating point operations are the same as
+       in _separate_points_by_polygon and point_on_line so the results
+       are identical.
+    """
+
+    M = points.shape[0]
+    N = polygon.shape[0]
+
+    if M == 0:
+        # If no points return two 0-vectors
+        return numpy.arange(0), numpy.arange(0)
+
+    # Suppress numpy warnings (as we'll be dividing by zero)
+    original_numpy_settings = numpy.seterr(invalid='ignore', divide='ignore')
+
+    # Polygon edges from vertex i to vertex j = i + 1
+    px_i = polygon[:, 0]
+    py_i = polygon[:, 1]
+    px_j = numpy.roll(px_i, -1)
+    py_j = numpy.roll(py_i, -1)
+
+    b0 = px_j - px_i
+    b1 = py_j - py_i
+    denominator = b0 * b0 + b1 * b1
+    tolerance = atol + rtol * denominator
+    len_b = numpy.sqrt(b0 * b0 + b1 * b1)
+
+    edge_miny = numpy.minimum(py_i, py_j)
+    edge_maxy = numpy.maximum(py_i, py_j)
+
+    # Sort points by latitude. NaN's go last and are never inside
+    # so they are left out.
+    order = numpy.argsort(points[:, 1], kind='mergesort')
+    x = points[order, 0]
+    y = points[order, 1]
+    number_of_valid_points = numpy.sum(numpy.logical_not(numpy.isnan(y)))
+
+    # Preallocate buffers for one tile of points x edges
+    P = min(M, POINT_BLOCK_SIZE)
+    E = max(1, min(N, tile_size // P))
+    buffer0 = numpy.empty((P, E), dtype=numpy.float)
+    buffer1 = numpy.empty((P, E), dtype=numpy.float)
+    buffer2 = numpy.empty((P, E), dtype=numpy.float)
+    buffer3 = numpy.empty((P, E), dtype=numpy.float)
+    mask0 = numpy.empty((P, E), dtype=numpy.bool)
+    mask1 = numpy.empty((P, E), dtype=numpy.bool)
+    mask2 = numpy.empty((P, E), dtype=numpy.bool)
+    mask3 = numpy.empty((P, E), dtype=numpy.bool)
+
+    inside = numpy.zeros(M, dtype=numpy.bool)
+    for p0 in range(0, number_of_valid_points, P):
+        p1 = min(p0 + P, number_of_valid_points)
+        n = p1 - p0
+        xb = x[p0:p1, numpy.newaxis]
+        yb = y[p0:p1, numpy.newaxis]
+
+        # Only edges in latitude band of this block can be crossed
+        # by or contain any of its points
+        ymin = y[p0]
+        ymax = y[p1 - 1]
+        edges = numpy.where((edge_maxy >= ymin) * (edge_miny <= ymax))[0]
+
+        crossings = numpy.zeros(n, dtype=numpy.int)
+        on_boundary = numpy.zeros(n, dtype=numpy.bool)
+        for e0 in range(0, len(edges), E):
+            e = edges[e0:e0 + E]
+            m = len(e)
+
+            a0 = buffer0[:n, :m]
+            a1 = buffer1[:n, :m]
+            nominator = buffer2[:n, :m]
+            work_float = buffer3[:n, :m]
+            crossing = mask0[:n, :m]
+            segment = mask1[:n, :m]
+            work = mask2[:n, :m]
+            work2 = mask3[:n, :m]
+
+            # Edge crossing formula
+            # sigma = (y - py_i) / (py_j - py_i) * (px_j - px_i)
+            numpy.subtract(yb, py_i[e], out=a1)
+            numpy.divide(a1, b1[e], out=a0)
+            numpy.multiply(a0, b0[e], out=a0)
+            numpy.add(a0, px_i[e], out=a0)
+            numpy.less(a0, xb, out=crossing)
+
+            # Edge must straddle the latitude of the point
+            numpy.less(py_i[e], yb, out=segment)
+            numpy.greater_equal(py_j[e], yb, out=work)
+            numpy.logical_and(segment, work, out=segment)
+            numpy.less(py_j[e], yb, out=work)
+            numpy.greater_equal(py_i[e], yb, out=work2)
+            numpy.logical_and(work, work2, out=work)
+            numpy.logical_or(segment, work, out=segment)
+            numpy.logical_and(crossing, segment, out=crossing)
+
+            crossings += numpy.sum(crossing, axis=1)
+
+            if closed is not None:
+                # Fused boundary test as in point_on_line:
+                # Point is on edge if its vector from the first vertex
+                # is parallel to the edge and within its end points.
+                # a1 already holds y - py_i
+                numpy.subtract(xb, px_i[e], out=a0)
+
+                # nominator = abs(a1 * b0 + (-a0) * b1)
+                numpy.multiply(a1, b0[e], out=nominator)
+                numpy.negative(a0, out=work_float)
+                numpy.multiply(work_float, b1[e], out=work_float)
+                numpy.add(nominator, work_float, out=nominator)
+                numpy.absolute(nominator, out=nominator)
+                numpy.less_equal(nominator, tolerance[e], out=work)
+
+                rows, cols = numpy.nonzero(work)
+                if len(rows) > 0:
+                    a0p = a0[rows, cols]
+                    a1p = a1[rows, cols]
+                    ep = e[cols]
+
+                    len_a = numpy.sqrt(a0p * a0p + a1p * a1p)
+                    cross = a0p * b0[ep] + a1p * b1[ep]
+                    hit = (cross >= 0) * (len_a <= len_b[ep])
+                    on_boundary[rows[hit]] = True
+
+        block_inside = (crossings % 2 == 1)
+        if closed is not None:
+            block_inside[on_boundary] = bool(closed)
+
+        inside[p0:p1] = block_inside
+
+    # Restore numpy warnings
+    numpy.seterr(**original_numpy_settings)
+
+    # Map back to original order of points
+    result = numpy.zeros(M, dtype=numpy.bool)
+    result[order] = inside
+
+    return numpy.where(result)[0], numpy.where(numpy.logical_not(result))[0]
+
+
 def _separate_points_by_polygon_python(points, polygon,
                                        closed, rtol=0.0, atol=0.0):
     """Underlying algorithm to partition point according to polygon
@@ -469,7 +674,8 @@ def point_on_line(points, line, rtol=1.0e-5, atol=1.0e-8,
 def in_and_outside_polygon(points, polygon,
                            closed=True,
                            holes=None,
-                           check_input=True):
+                           check_input=True,
+                           method=None):
     """Separate a list of points into two sets inside and outside a polygon
 
     Input:
@@ -483,6 +689,8 @@ def in_and_outside_polygon(points, polygon,
       holes: list of polygons representing holes. Points inside either of
       these are considered outside polygon
 
+      method: underlying algorithm passed on to separate_points_by_polygon
+
     Output:
       inside: Indices of points inside the polygon
 
@@ -494,20 +702,22 @@ def in_and_outside_polygon(points, polygon,
     # Get separation by outer_ring
     inside, outside = separate_points_by_polygon(points, polygon,
                                                  closed=closed,
-                                                 check_input=check_input)
+                                                 check_input=check_input,
+                                                 method=method)
 
     # Take care of holes
     if holes is not None:
-        msg = ('Argument holes must be a list of polygons, '
-               'I got %s' % holes)
         if not isinstance(holes, list):
+            msg = ('Argument holes must be a list of polygons, '
+                   'I got %s' % holes)
             raise InaSAFEError(msg)
 
         for hole in holes:
             in_hole, out_hole = separate_points_by_polygon(points[inside],
                                                            hole,
                                                            closed=not closed,
-                                                           check_input=True)
+                                                           check_input=True,
+                                                           method=method)
 
             in_hole = inside[in_hole]  # Inside hole
             inside = inside[out_hole]  # Inside outer_ring but outside hole
@@ -1268,7 +1478,7 @@ def intersection(line0, line1):
 # Main functions for polygon clipping
 # FIXME (Ole): Both can be rigged to return points or lines
 # outside any polygon by adding that as the entry in the list returned
-def clip_grid_by_polygons(A, geotransform, polygons):
+def clip_grid_by_polygons(A, geotransform, polygons, method='points'):
     """Clip raster grid by polygon.
 
     Args:
@@ -1277,6 +1487,16 @@ def clip_grid_by_polygons(A, geotransform, polygons):
             (top left x, w-e pixel resolution, rotation,
             top left y, rotation, n-s pixel resolution)
         * polygons: list of polygon geometry objects or list of polygon arrays
+        * method: (optional) underlying algorithm. Admissible values are
+
+              'points': Convert the entire grid to points and label them
+                  by polygon. This is the reference implementation.
+
+              'scanline': Fill each polygon row by row directly on the grid
+                  (see :func:`grid_indices_by_polygons`) so that coordinates
+                  are only generated for grid points covered by polygons.
+                  The result is the same as for 'points' but memory and
+                  time no longer grow with the size of the entire grid.
 
     Returns:
         points_covered: List of (points, values) - one per input polygon.
@@ -1293,44 +1513,40 @@ def clip_grid_by_polygons(A, geotransform, polygons):
 
     """
 
+    if method == 'scanline':
+        ny, nx = A.shape
+        x, y = geotransform2axes(geotransform, nx, ny)
+        values = A.reshape(-1)
+
+        points_covered = []
+        for indices in grid_indices_by_polygons(A.shape, geotransform,
+                                                polygons, closed=True):
+            points_covered.append((grid_indices2points(indices, x, y),
+                                   values[indices]))
+        return points_covered
+    elif method != 'points':
+        msg = ('Argument method must be either "points" or "scanline". '
+               'I got %s' % method)
+        raise PolygonInputError(msg)
+
     # Convert raster grid to Nx2 array of points and an N array of pixel values
     ny, nx = A.shape
     x, y = geotransform2axes(geotransform, nx, ny)
     points, values = grid2points(A, x, y)
 
+    # Label each point by the first polygon it falls into
+    labels = label_points_by_polygons(points, polygons, closed=True)
+
     # Generate list of points and values that fall inside each polygon
     points_covered = []
-    remaining_points = points
-    remaining_values = values
-
-    for polygon in polygons:
-        #print 'Remaining points', len(remaining_points)
-
-        if hasattr(polygon, 'outer_ring'):
-            outer_ring = polygon.outer_ring
-            inner_rings = polygon.inner_rings
-        else:
-            # Assume it is an array
-            outer_ring = polygon
-            inner_rings = None
-
-        inside, outside = in_and_outside_polygon(remaining_points,
-                                                 outer_ring,
-                                                 holes=inner_rings,
-                                                 closed=True,
-                                                 check_input=False)
-        # Add features inside this polygon
-        points_covered.append((remaining_points[inside],
-                               remaining_values[inside]))
-
-        # Select remaining points to clip
-        remaining_points = remaining_points[outside]
-        remaining_values = remaining_values[outside]
+    for indices in labels_to_indices(labels, len(polygons)):
+        points_covered.append((points[indices], values[indices]))
 
     return points_covered
 
 
-def clip_lines_by_polygons(lines, polygons, check_input=True, closed=True):
+def clip_lines_by_polygons(lines, polygons, check_input=True, closed=True,
+                           method='indexed'):
     """Clip multiple lines by multiple polygons
 
     Args:
@@ -1344,6 +1560,9 @@ def clip_lines_by_polygons(lines, polygons, check_input=True, closed=True):
             algorithm up but lines on boundaries may or may not be
             deemed to fall inside the polygon and so will be
             indeterministic.
+        * method: Either 'indexed' (default) to clip all lines at once
+            using spatial indices (see intersect_lines_with_polygons)
+            or 'loop' to clip them by one polygon at a time.
 
     Returns:
         lines_covered: List of polylines inside a polygon -o ne per input
@@ -1375,6 +1594,23 @@ def clip_lines_by_polygons(lines, polygons, check_input=True, closed=True):
                        % str(e))
                 raise Exception(msg)
 
+    if method == 'indexed':
+        polygon_ids, line_ids, clipped_lines = \
+            intersect_lines_with_polygons(lines, polygons, closed=closed)
+
+        # One dictionary of clipped lines for each polygon
+        lines_covered = []
+        for _ in range(len(polygons)):
+            lines_covered.append(dict((j, []) for j in range(len(lines))))
+        for i, j, line in zip(polygon_ids, line_ids, clipped_lines):
+            lines_covered[i][j].append(line)
+        return lines_covered
+
+    elif method != 'loop':
+        msg = ('Argument method must be either "indexed" or "loop". '
+               'I got %s' % method)
+        raise PolygonInputError(msg)
+
     # Initialise structures
     lines_covered = []
     remaining_lines = lines
@@ -1448,3 +1684,1422 @@ def polygon2segments(polygon):
     segments[1, 1, :] = y3
 
     return segments
+
+
+#------------------------------------------------
+# Spatial indexing of polygons by bounding boxes
+#------------------------------------------------
+def polygons2bboxes(polygons):
+    """Compute bounding boxes for a list of polygons
+
+    Args:
+        * polygons: list of polygon geometry objects or list of polygon arrays
+
+    Returns:
+        * bboxes: Mx4 array with one row [minx, maxx, miny, maxy] per polygon
+            (same format as argument polygon_bbox used in this module)
+
+    Note:
+        Only the outer ring is used as inner rings are contained in it.
+        Packed polygons (see safe.storage.geometry.PolygonArray) already
+        know their bounding boxes.
+    """
+
+    if hasattr(polygons, 'bboxes'):
+        return polygons.bboxes.copy()
+
+    M = len(polygons)
+    bboxes = numpy.zeros((M, 4), dtype=numpy.float)
+    for i, polygon in enumerate(polygons):
+        outer_ring, _ = _get_polygon_rings(polygon)
+        outer_ring = ensure_numeric(outer_ring, numpy.float)
+        bboxes[i, 0] = numpy.min(outer_ring[:, 0])
+        bboxes[i, 1] = numpy.max(outer_ring[:, 0])
+        bboxes[i, 2] = numpy.min(outer_ring[:, 1])
+        bboxes[i, 3] = numpy.max(outer_ring[:, 1])
+
+    return bboxes
+
+
+def _get_polygon_rings(polygon):
+    """Get outer ring and inner rings from polygon object or array
+
+    Args:
+        * polygon: Polygon geometry object or array of polygon vertices
+
+    Returns:
+        * outer_ring, inner_rings. inner_rings is None for plain arrays
+    """
+
+    if hasattr(polygon, 'outer_ring'):
+        return polygon.outer_ring, polygon.inner_rings
+    else:
+        # Assume it is an array
+        return polygon, None
+
+
+def _expand_ranges(counts):
+    """Enumerate the members of consecutive ranges of given lengths
+
+    Args:
+        * counts: Array of non-negative range lengths
+
+    Returns:
+        * owners: For each member, the index of the range it belongs to
+        * positions: For each member, its position within its range
+
+    Example:
+        counts = [2, 0, 3] gives owners = [0, 0, 2, 2, 2] and
+        positions = [0, 1, 0, 1, 2]
+    """
+
+    counts = numpy.array(counts, dtype=numpy.int)
+    total = numpy.sum(counts)
+
+    owners = numpy.repeat(numpy.arange(len(counts)), counts)
+    offsets = numpy.cumsum(counts) - counts
+    positions = numpy.arange(total) - numpy.repeat(offsets, counts)
+
+    return owners, positions
+
+
+class BoundingBoxIndex:
+    """Uniform grid index over axis aligned bounding boxes
+
+    Each bounding box is registered in every grid cell it overlaps so that
+    candidate boxes for a point can be found by looking up the one cell
+    containing it. The index is built once with vectorised operations and
+    can then be queried for any number of points.
+
+    Args:
+        * bboxes: Mx4 array with one row [minx, maxx, miny, maxy] per box
+            e.g. as produced by polygons2bboxes
+        * cellsize: Optional size of grid cells. If None (default) it is
+            chosen to be comparable to a typical box while keeping the
+            number of cells proportional to the number of boxes.
+
+    Note:
+        Boxes are closed, i.e. points on their boundary are deemed inside
+        in keeping with the default closed=True used for polygons.
+    """
+
+    def __init__(self, bboxes, cellsize=None):
+        bboxes = ensure_numeric(bboxes, numpy.float)
+        if len(bboxes.shape) == 1:
+            bboxes = numpy.reshape(bboxes, (-1, 4))
+
+        msg = ('Bounding boxes must be given as an Mx4 array of '
+               '[minx, maxx, miny, maxy]. I got shape %s'
+               % str(bboxes.shape))
+        if len(bboxes.shape) != 2 or bboxes.shape[1] != 4:
+            raise PolygonInputError(msg)
+
+        self.bboxes = bboxes
+        M = bboxes.shape[0]
+
+        if M == 0:
+            # Degenerate index without any cells
+            self.origin = (0.0, 0.0)
+            self.cellsize = 1.0
+            self.nx = self.ny = 0
+            self.extent = [0.0, 0.0, 0.0, 0.0]
+            self.pointer = numpy.zeros(1, dtype=numpy.int)
+            self.box_ids = numpy.zeros(0, dtype=numpy.int)
+            return
+
+        minx = numpy.min(bboxes[:, 0])
+        maxx = numpy.max(bboxes[:, 1])
+        miny = numpy.min(bboxes[:, 2])
+        maxy = numpy.max(bboxes[:, 3])
+        self.extent = [minx, maxx, miny, maxy]
+
+        width = maxx - minx
+        height = maxy - miny
+
+        if cellsize is None:
+            # Typical box size, but no more than about four cells per box
+            typical = max(numpy.median(bboxes[:, 1] - bboxes[:, 0]),
+                          numpy.median(bboxes[:, 3] - bboxes[:, 2]))
+            smallest = numpy.sqrt(width * height / (4.0 * M))
+            cellsize = max(typical, smallest)
+
+            if not cellsize > 0:
+                # All boxes are degenerate (e.g. collinear)
+                cellsize = max(width, height) / M
+                if not cellsize > 0:
+                    cellsize = 1.0
+
+        self.origin = (minx, miny)
+        self.cellsize = float(cellsize)
+        self.nx = int(width / self.cellsize) + 1
+        self.ny = int(height / self.cellsize) + 1
+
+        # Range of cells covered by each box
+        ix0, iy0 = self._cell_coordinates(bboxes[:, 0], bboxes[:, 2])
+        ix1, iy1 = self._cell_coordinates(bboxes[:, 1], bboxes[:, 3])
+        w = ix1 - ix0 + 1
+        h = iy1 - iy0 + 1
+
+        # Register each box in all cells it covers
+        owners, positions = _expand_ranges(w * h)
+        ix = ix0[owners] + positions % w[owners]
+        iy = iy0[owners] + positions // w[owners]
+        cells = iy * self.nx + ix
+
+        # Sort by cell (stable so boxes keep their order within each cell)
+        order = numpy.argsort(cells, kind='mergesort')
+        self.box_ids = owners[order]
+
+        counts = numpy.bincount(cells, minlength=self.nx * self.ny)
+        self.pointer = numpy.zeros(self.nx * self.ny + 1, dtype=numpy.int)
+        self.pointer[1:] = numpy.cumsum(counts)
+
+    def __len__(self):
+        """Number of boxes in index
+        """
+        return self.bboxes.shape[0]
+
+    def _cell_coordinates(self, x, y):
+        """Get grid cell coordinates for arrays of x and y values
+        """
+
+        ix = numpy.floor((x - self.origin[0]) / self.cellsize)
+        iy = numpy.floor((y - self.origin[1]) / self.cellsize)
+        ix = numpy.clip(ix, 0, self.nx - 1).astype(numpy.int)
+        iy = numpy.clip(iy, 0, self.ny - 1).astype(numpy.int)
+
+        return ix, iy
+
+    def query_points(self, points):
+        """Find all boxes containing each of the given points
+
+        Args:
+            * points: Nx2 array of point coordinates
+
+        Returns:
+            * point_ids: Indices of points
+            * box_ids: Indices of boxes containing the corresponding point
+
+            The pairs are sorted by point index and then by box index.
+        """
+
+        points = ensure_numeric(points, numpy.float)
+        if len(points.shape) == 1:
+            # One point or no points
+            points = numpy.reshape(points, (-1, 2))
+
+        empty = numpy.zeros(0, dtype=numpy.int)
+        if points.shape[0] == 0 or len(self) == 0:
+            return empty, empty
+
+        x = points[:, 0]
+        y = points[:, 1]
+
+        # Only look up points within the extent of the index.
+        # This also rules out NaN coordinates.
+        minx, maxx, miny, maxy = self.extent
+        in_extent = ((x >= minx) * (x <= maxx) * (y >= miny) * (y <= maxy))
+        candidates = numpy.where(in_extent)[0]
+
+        # Enumerate boxes registered in the cell of each candidate point
+        ix, iy = self._cell_coordinates(x[candidates], y[candidates])
+        cells = iy * self.nx + ix
+        starts = self.pointer[cells]
+        owners, positions = _expand_ranges(self.pointer[cells + 1] - starts)
+
+        point_ids = candidates[owners]
+        box_ids = self.box_ids[starts[owners] + positions]
+
+        # Keep pairs where point is truly inside box
+        px = x[point_ids]
+        py = y[point_ids]
+        b = self.bboxes
+        mask = ((px >= b[box_ids, 0]) * (px <= b[box_ids, 1]) *
+                (py >= b[box_ids, 2]) * (py <= b[box_ids, 3]))
+
+        return point_ids[mask], box_ids[mask]
+
+    def query_bboxes(self, bboxes):
+        """Find all boxes overlapping each of the given bounding boxes
+
+        Args:
+            * bboxes: Kx4 array with one row [minx, maxx, miny, maxy] per
+                query box
+
+        Returns:
+            * query_ids: Indices of query boxes
+            * box_ids: Indices of boxes overlapping the corresponding
+              query box
+
+            The pairs are sorted by query index and then by box index.
+        """
+
+        bboxes = ensure_numeric(bboxes, numpy.float)
+        if len(bboxes.shape) == 1:
+            # One box or no boxes
+            bboxes = numpy.reshape(bboxes, (-1, 4))
+
+        empty = numpy.zeros(0, dtype=numpy.int)
+        if bboxes.shape[0] == 0 or len(self) == 0:
+            return empty, empty
+
+        # Only look up boxes overlapping the extent of the index.
+        # This also rules out NaN coordinates.
+        minx, maxx, miny, maxy = self.extent
+        overlaps = ((bboxes[:, 0] <= maxx) * (bboxes[:, 1] >= minx) *
+                    (bboxes[:, 2] <= maxy) * (bboxes[:, 3] >= miny))
+        candidates = numpy.where(overlaps)[0]
+
+        # Enumerate cells covered by each candidate box
+        ix0, iy0 = self._cell_coordinates(bboxes[candidates, 0],
+                                          bboxes[candidates, 2])
+        ix1, iy1 = self._cell_coordinates(bboxes[candidates, 1],
+                                          bboxes[candidates, 3])
+        w = ix1 - ix0 + 1
+        h = iy1 - iy0 + 1
+        owners, positions = _expand_ranges(w * h)
+        ix = ix0[owners] + positions % w[owners]
+        iy = iy0[owners] + positions // w[owners]
+        cells = iy * self.nx + ix
+
+        # Enumerate boxes registered in those cells
+        starts = self.pointer[cells]
+        members, offsets = _expand_ranges(self.pointer[cells + 1] - starts)
+        query_ids = candidates[owners[members]]
+        box_ids = self.box_ids[starts[members] + offsets]
+
+        # Keep pairs of truly overlapping boxes. Boxes spanning several
+        # cells are found more than once so remove duplicates too.
+        q = bboxes[query_ids]
+        b = self.bboxes[box_ids]
+        mask = ((q[:, 0] <= b[:, 1]) * (q[:, 1] >= b[:, 0]) *
+                (q[:, 2] <= b[:, 3]) * (q[:, 3] >= b[:, 2]))
+
+        M = len(self)
+        keys = numpy.unique(query_ids[mask] * M + box_ids[mask])
+
+        return keys // M, keys % M
+
+
+def inside_polygons(points, polygons, closed=True, index=None):
+    """Determine points inside each of multiple polygons
+
+    Args:
+        * points: Nx2 array of point coordinates
+        * polygons: list of polygon geometry objects or list of polygon arrays
+        * closed: Set to True if points on boundary are considered
+            to be 'inside' polygon
+        * index: Optional BoundingBoxIndex built from the bounding boxes
+            of polygons. If None (default) it will be built here.
+
+    Returns:
+        * List of arrays of indices of points inside each polygon
+          - one per input polygon. Points may appear in more than one
+          array if polygons overlap.
+
+    Note:
+        The result is identical to calling inside_polygon for each polygon
+        but each point is only tested against the polygons whose bounding
+        box contains it. This makes the cost proportional to the number of
+        points rather than the number of points times polygons.
+    """
+
+    points, candidates = _candidate_points_by_polygon(points, polygons,
+                                                      index)
+
+    result = []
+    for i, polygon in enumerate(polygons):
+        if len(candidates[i]) == 0:
+            result.append(candidates[i])
+            continue
+
+        outer_ring, inner_rings = _get_polygon_rings(polygon)
+        inside, _ = in_and_outside_polygon(points[candidates[i]],
+                                           outer_ring,
+                                           holes=inner_rings,
+                                           closed=closed)
+        result.append(candidates[i][inside])
+
+    return result
+
+
+def label_points_by_polygons(points, polygons, closed=True, index=None):
+    """Label points by the polygon they fall into
+
+    Args:
+        * points: Nx2 array of point coordinates
+        * polygons: list of polygon geometry objects or list of polygon arrays.
+            Inner rings (holes) of geometry objects are respected.
+        * closed: Set to True if points on boundary are considered
+            to be 'inside' polygon
+        * index: Optional BoundingBoxIndex built from the bounding boxes
+            of polygons. If None (default) it will be built here.
+
+    Returns:
+        * labels: Integer array of length N with the index of the polygon
+          each point falls into or -1 if it is not inside any polygon.
+
+    Note:
+        If multiple polygons overlap, the one first encountered will be used.
+
+        Points are first matched to candidate polygons through a spatial
+        index over polygon bounding boxes and each point is only tested
+        against candidates until it has been found inside one.
+    """
+
+    points, candidates = _candidate_points_by_polygon(points, polygons,
+                                                      index)
+
+    labels = -numpy.ones(points.shape[0], dtype=numpy.int)
+    for i, polygon in enumerate(polygons):
+        # Skip points already claimed by a previous polygon
+        remaining = candidates[i][labels[candidates[i]] < 0]
+        if len(remaining) == 0:
+            continue
+
+        outer_ring, inner_rings = _get_polygon_rings(polygon)
+        inside, _ = in_and_outside_polygon(points[remaining],
+                                           outer_ring,
+                                           holes=inner_rings,
+                                           closed=closed)
+        labels[remaining[inside]] = i
+
+    return labels
+
+
+def labels_to_indices(labels, number_of_labels):
+    """Convert labels to lists of indices for each label
+
+    Args:
+        * labels: Integer array of labels e.g. as returned by
+            label_points_by_polygons. Negative labels are ignored.
+        * number_of_labels: Number of distinct labels
+
+    Returns:
+        * List of arrays of indices into labels - one per label. Each array
+          is sorted in increasing order.
+    """
+
+    labels = ensure_numeric(labels, numpy.int)
+    if number_of_labels == 0:
+        # Older numpy does not allow minlength 0 in bincount
+        return []
+
+    order = numpy.argsort(labels, kind='mergesort')
+    counts = numpy.bincount(labels[labels >= 0], minlength=number_of_labels)
+
+    # Labelled entries come after the unlabelled ones in sorted order
+    start = len(labels) - numpy.sum(counts)
+
+    result = []
+    for count in counts:
+        result.append(order[start:start + count])
+        start += count
+
+    return result
+
+
+def _candidate_points_by_polygon(points, polygons, index=None):
+    """Find points inside the bounding box of each polygon
+
+    Args:
+        * points: Nx2 array of point coordinates
+        * polygons: list of polygon geometry objects or list of polygon arrays
+        * index: Optional BoundingBoxIndex for polygons
+
+    Returns:
+        * points: Points as Nx2 numeric array
+        * candidates: List of arrays of indices of points inside
+          bounding box of each polygon sorted in increasing order
+    """
+
+    points = ensure_numeric(points, numpy.float)
+    if len(points.shape) == 1:
+        # One point or no points
+        points = numpy.reshape(points, (-1, 2))
+
+    if index is None:
+        index = BoundingBoxIndex(polygons2bboxes(polygons))
+
+    msg = ('Spatial index has %i boxes but there are %i polygons'
+           % (len(index), len(polygons)))
+    if len(index) != len(polygons):
+        raise PolygonInputError(msg)
+
+    if len(polygons) == 0:
+        # Older numpy does not allow minlength 0 in bincount
+        return points, []
+
+    # Group candidate points by polygon keeping them in increasing order
+    point_ids, polygon_ids = index.query_points(points)
+    order = numpy.argsort(polygon_ids, kind='mergesort')
+    point_ids = point_ids[order]
+    counts = numpy.bincount(polygon_ids, minlength=len(polygons))
+
+    candidates = []
+    start = 0
+    for count in counts:
+        candidates.append(point_ids[start:start + count])
+        start += count
+
+    return points, candidates
+
+
+#-------------------------------
+# Overlay of polygons by polygons
+#-------------------------------
+def polygon_intersection_areas(polygons, clip_polygons, index=None):
+    """Calculate areas of intersection between two sets of polygons
+
+    Args:
+        * polygons: list of polygon geometry objects or list of polygon arrays
+        * clip_polygons: list of polygon geometry objects or list of
+            polygon arrays. Inner rings (holes) of geometry objects are
+            respected in both sets.
+        * index: Optional BoundingBoxIndex built from the bounding boxes
+            of clip_polygons. If None (default) it will be built here.
+
+    Returns:
+        * ids: Indices of polygons
+        * clip_ids: Indices of clip polygons
+        * areas: Area of the intersection of the corresponding polygons
+
+        Only pairs with a positive area of intersection are returned.
+        They are sorted by polygon index and then by clip polygon index.
+
+    Note:
+        Areas are computed from the boundary of each intersection by
+        Green's theorem, i.e. as the sum of the signed areas spanned by
+        the edge pieces of one polygon inside the other. No intersection
+        polygons are constructed.
+
+        Candidate pairs are found through a spatial index over bounding
+        boxes. Pairs whose boundaries do not come near each other are
+        either disjoint or one contains the other and are settled by
+        testing a single vertex. Only for the remaining pairs are edges
+        split at their crossings, using a second index over the edges
+        of clip polygons, and the pieces tested. All steps are vectorised
+        over pairs except point in polygon tests against polygons with
+        many edges, which are done in one call per polygon.
+
+        Shared boundaries are counted once if the polygons are on the same
+        side of them and not at all otherwise, so polygons tiling the plane
+        have intersection areas adding up to their own areas.
+    """
+
+    empty = numpy.zeros(0, dtype=numpy.int)
+    if len(polygons) == 0 or len(clip_polygons) == 0:
+        return empty, empty, numpy.zeros(0, dtype=numpy.float)
+
+    if index is None:
+        index = BoundingBoxIndex(polygons2bboxes(clip_polygons))
+
+    msg = ('Spatial index has %i boxes but there are %i clip polygons'
+           % (len(index), len(clip_polygons)))
+    if len(index) != len(clip_polygons):
+        raise PolygonInputError(msg)
+
+    N = len(polygons)
+    M = len(clip_polygons)
+
+    # Candidate pairs with overlapping bounding boxes
+    bboxes = polygons2bboxes(polygons)
+    ids, clip_ids = index.query_bboxes(bboxes)
+    if len(ids) == 0:
+        return empty, empty, numpy.zeros(0, dtype=numpy.float)
+    keys = ids * M + clip_ids
+
+    # Oriented edges of both sets of polygons. Areas are accumulated
+    # relative to the lower left corner of each polygon to retain
+    # precision for small polygons far from the origin.
+    edges, owners = _polygon_edges(polygons)
+    clip_edges, clip_owners = _polygon_edges(clip_polygons)
+    origins = bboxes[:, [0, 2]]
+    areas = numpy.bincount(owners,
+                           weights=_edge_moments(edges, origins[owners]),
+                           minlength=N)
+
+    # Edges of clip polygons inside the bounding box of each polygon
+    edge_index = BoundingBoxIndex(_edge_bboxes(clip_edges))
+    local_ids, local_edges = edge_index.query_bboxes(bboxes)
+    local_keys = local_ids * M + clip_owners[local_edges]
+    local_pairs = numpy.minimum(numpy.searchsorted(keys, local_keys),
+                                len(keys) - 1)
+
+    # Skip edges outside the outer ring of their polygon (invalid holes)
+    mask = keys[local_pairs] == local_keys
+    local_ids = local_ids[mask]
+    local_edges = local_edges[mask]
+    local_pairs = local_pairs[mask]
+
+    straddling = numpy.zeros(len(ids), dtype=numpy.bool)
+    straddling[local_pairs] = True
+
+    result = numpy.zeros(len(ids), dtype=numpy.float)
+
+    # Pairs without clip polygon edges near the polygon: It is either
+    # inside the clip polygon or disjoint from it.
+    clean = numpy.where(~straddling * (areas[ids] > 0))[0]
+    first_edges = numpy.searchsorted(owners, ids[clean])
+    inside = _points_inside_polygon_pairs(edges[first_edges, :2],
+                                          clip_ids[clean], clip_polygons,
+                                          clip_edges, clip_owners)
+    result[clean[inside]] = areas[ids[clean[inside]]]
+
+    if len(local_pairs) > 0:
+        # Find crossings between edges and split them there
+        edge_ids, clip_edge_ids, t, u = _edge_crossings(edges, clip_edges,
+                                                        edge_index)
+
+        # Pieces of polygon boundaries inside clip polygons. Pieces on the
+        # boundary of a clip polygon count if the polygons are on the same
+        # side of it, i.e. if the point just left of the piece is inside.
+        pairs = numpy.where(straddling)[0]
+        selected = numpy.in1d(owners, ids[pairs])
+        pieces, piece_edges = _split_edges(edges, selected, edge_ids, t)
+        counts = numpy.bincount(owners[piece_edges], minlength=N)
+        starts = numpy.cumsum(counts) - counts
+
+        members, positions = _expand_ranges(counts[ids[pairs]])
+        piece_ids = starts[ids[pairs]][members] + positions
+        piece_pairs = pairs[members]
+
+        P = pieces[piece_ids]
+        inside = _points_inside_polygon_pairs(_side_points(P, 1),
+                                              clip_ids[piece_pairs],
+                                              clip_polygons,
+                                              clip_edges, clip_owners)
+        moments = _edge_moments(P[inside], origins[ids[piece_pairs[inside]]])
+        result += numpy.bincount(piece_pairs[inside], weights=moments,
+                                 minlength=len(ids))
+
+        # Pieces of clip polygon boundaries strictly inside polygons
+        selected = numpy.zeros(len(clip_edges), dtype=numpy.bool)
+        selected[local_edges] = True
+        pieces, piece_edges = _split_edges(clip_edges, selected,
+                                           clip_edge_ids, u)
+        counts = numpy.bincount(piece_edges, minlength=len(clip_edges))
+        starts = numpy.cumsum(counts) - counts
+
+        members, positions = _expand_ranges(counts[local_edges])
+        piece_ids = starts[local_edges][members] + positions
+        piece_pairs = local_pairs[members]
+
+        P = pieces[piece_ids]
+        K = len(piece_ids)
+        inside = _points_inside_polygon_pairs(
+            numpy.concatenate((_side_points(P, 1), _side_points(P, -1))),
+            numpy.concatenate((ids[piece_pairs], ids[piece_pairs])),
+            polygons, edges, owners)
+        inside = inside[:K] * inside[K:]
+        moments = _edge_moments(P[inside], origins[ids[piece_pairs[inside]]])
+        result += numpy.bincount(piece_pairs[inside], weights=moments,
+                                 minlength=len(ids))
+
+    # Remove rounding errors
+    result = numpy.minimum(result, areas[ids])
+    mask = result > 0
+
+    return ids[mask], clip_ids[mask], result[mask]
+
+
+def _polygon_edges(polygons):
+    """Get oriented edges of polygons
+
+    Args:
+        * polygons: list of polygon geometry objects or list of polygon arrays
+
+    Returns:
+        * edges: Kx4 array with one row [x0, y0, x1, y1] per edge
+        * owners: Index of the polygon each edge belongs to (in
+          increasing order)
+
+    Note:
+        Outer rings are oriented counter clockwise and inner rings
+        clockwise so the interior of each polygon is to the left of all its
+        edges. Edges of zero length (e.g. from a repeated closing vertex)
+        are left out.
+
+        Packed polygons (see safe.storage.geometry.PolygonArray) are used
+        as they are. Other polygons are packed the same way first.
+    """
+
+    if hasattr(polygons, 'ring_offsets'):
+        coordinates = polygons.coordinates
+        ring_offsets = polygons.ring_offsets
+        part_offsets = polygons.part_offsets
+    else:
+        rings = []
+        part_sizes = []
+        for polygon in polygons:
+            outer_ring, inner_rings = _get_polygon_rings(polygon)
+            if inner_rings is None:
+                inner_rings = []
+            for ring in [outer_ring] + list(inner_rings):
+                rings.append(numpy.reshape(ensure_numeric(ring, numpy.float),
+                                           (-1, 2)))
+            part_sizes.append(len(inner_rings) + 1)
+
+        ring_offsets = numpy.zeros(len(rings) + 1, dtype=numpy.int)
+        numpy.cumsum([len(ring) for ring in rings], out=ring_offsets[1:])
+        part_offsets = numpy.zeros(len(part_sizes) + 1, dtype=numpy.int)
+        numpy.cumsum(part_sizes, out=part_offsets[1:])
+        if len(rings) > 0:
+            coordinates = numpy.concatenate(rings)
+        else:
+            coordinates = numpy.zeros((0, 2), dtype=numpy.float)
+
+    # Index of ring and polygon of each vertex
+    ring_sizes = numpy.diff(ring_offsets)
+    ring_ids = numpy.repeat(numpy.arange(len(ring_sizes)), ring_sizes)
+    ring_owners = numpy.repeat(numpy.arange(len(part_offsets) - 1),
+                               numpy.diff(part_offsets))
+
+    # Each vertex is joined to the next one in its ring
+    following = numpy.arange(1, len(coordinates) + 1)
+    closing = ring_sizes > 0
+    following[ring_offsets[1:][closing] - 1] = ring_offsets[:-1][closing]
+
+    x0 = coordinates[:, 0]
+    y0 = coordinates[:, 1]
+    x1 = x0[following]
+    y1 = y0[following]
+
+    # Reverse rings with the wrong orientation
+    areas = numpy.bincount(ring_ids, weights=x0 * y1 - x1 * y0,
+                           minlength=len(ring_sizes))
+    outer = numpy.zeros(len(ring_sizes), dtype=numpy.bool)
+    outer[part_offsets[:-1][numpy.diff(part_offsets) > 0]] = True
+    reverse = (outer * (areas < 0) + ~outer * (areas > 0))[ring_ids]
+
+    edges = numpy.array([numpy.where(reverse, x1, x0),
+                         numpy.where(reverse, y1, y0),
+                         numpy.where(reverse, x0, x1),
+                         numpy.where(reverse, y0, y1)]).T
+
+    mask = (x0 != x1) + (y0 != y1)
+    return edges[mask], ring_owners[ring_ids[mask]]
+
+
+def _edge_bboxes(edges):
+    """Get bounding boxes [minx, maxx, miny, maxy] of edges
+    """
+
+    return numpy.array([numpy.minimum(edges[:, 0], edges[:, 2]),
+                        numpy.maximum(edges[:, 0], edges[:, 2]),
+                        numpy.minimum(edges[:, 1], edges[:, 3]),
+                        numpy.maximum(edges[:, 1], edges[:, 3])]).T
+
+
+def _edge_moments(edges, origins):
+    """Get signed areas of triangles spanned by edges and origins
+
+    The area of a polygon is the sum of these over its oriented edges
+    """
+
+    x0 = edges[:, 0] - origins[:, 0]
+    y0 = edges[:, 1] - origins[:, 1]
+    x1 = edges[:, 2] - origins[:, 0]
+    y1 = edges[:, 3] - origins[:, 1]
+
+    return (x0 * y1 - x1 * y0) / 2
+
+
+def _side_points(edges, side):
+    """Get points just left (side=1) or right (side=-1) of edge midpoints
+    """
+
+    dx = edges[:, 2] - edges[:, 0]
+    dy = edges[:, 3] - edges[:, 1]
+    x = (edges[:, 0] + edges[:, 2]) / 2 - side * SIDE_OFFSET * dy
+    y = (edges[:, 1] + edges[:, 3]) / 2 + side * SIDE_OFFSET * dx
+
+    return numpy.array([x, y]).T
+
+
+def _edge_crossings(edges, clip_edges, clip_index, rtol=1.0e-12):
+    """Find points where edges meet edges of clip polygons
+
+    Args:
+        * edges: Kx4 array of edges [x0, y0, x1, y1]
+        * clip_edges: Lx4 array of edges [x0, y0, x1, y1]
+        * clip_index: BoundingBoxIndex built from bounding boxes of
+            clip_edges
+        * rtol: Relative tolerance for edges to be deemed parallel
+
+    Returns:
+        * edge_ids: Indices of edges
+        * clip_edge_ids: Indices of clip edges
+        * t: Position of meeting point along edges (0 to 1)
+        * u: Position of meeting point along clip edges (0 to 1)
+
+    Note:
+        Crossing edges meet in one point. For overlapping collinear edges
+        the end points of each edge lying on the other are reported.
+    """
+
+    e, c = clip_index.query_bboxes(_edge_bboxes(edges))
+
+    px = edges[e, 0]
+    py = edges[e, 1]
+    rx = edges[e, 2] - px
+    ry = edges[e, 3] - py
+    qx = clip_edges[c, 0] - px
+    qy = clip_edges[c, 1] - py
+    sx = clip_edges[c, 2] - clip_edges[c, 0]
+    sy = clip_edges[c, 3] - clip_edges[c, 1]
+
+    rr = rx * rx + ry * ry
+    ss = sx * sx + sy * sy
+    denom = rx * sy - ry * sx
+    qs = qx * sy - qy * sx
+    qr = qx * ry - qy * rx
+
+    # Suppress numpy warnings (as we'll be dividing by zero)
+    original_numpy_settings = numpy.seterr(invalid='ignore', divide='ignore')
+
+    # Edges crossing in one point
+    parallel = numpy.abs(denom) <= rtol * numpy.sqrt(rr * ss)
+    t = qs / denom
+    u = qr / denom
+    crossing = ((~parallel) * (t >= 0) * (t <= 1) * (u >= 0) * (u <= 1))
+
+    # Overlapping collinear edges
+    qq = qx * qx + qy * qy
+    collinear = parallel * (numpy.abs(qr) <= rtol * (rr + qq))
+    qdotr = qx * rx + qy * ry
+    qdots = qx * sx + qy * sy
+    sdotr = sx * rx + sy * ry
+    t0 = qdotr / rr  # Start of clip edge
+    t1 = (qdotr + sdotr) / rr  # End of clip edge
+    u0 = -qdots / ss  # Start of edge
+    u1 = (sdotr - qdots) / ss  # End of edge
+
+    numpy.seterr(**original_numpy_settings)
+
+    edge_ids = [e[crossing]]
+    clip_edge_ids = [c[crossing]]
+    ts = [t[crossing]]
+    us = [u[crossing]]
+    for tc, uc in [(t0, 0.0), (t1, 1.0)]:
+        mask = collinear * (tc >= 0) * (tc <= 1)
+        edge_ids.append(e[mask])
+        clip_edge_ids.append(c[mask])
+        ts.append(tc[mask])
+        us.append(numpy.zeros(numpy.sum(mask)) + uc)
+    for uc, tc in [(u0, 0.0), (u1, 1.0)]:
+        mask = collinear * (uc >= 0) * (uc <= 1)
+        edge_ids.append(e[mask])
+        clip_edge_ids.append(c[mask])
+        ts.append(numpy.zeros(numpy.sum(mask)) + tc)
+        us.append(uc[mask])
+
+    return (numpy.concatenate(edge_ids), numpy.concatenate(clip_edge_ids),
+            numpy.concatenate(ts), numpy.concatenate(us))
+
+
+def _split_edges(edges, selected, edge_ids, t):
+    """Split edges at given positions
+
+    Args:
+        * edges: Kx4 array of edges [x0, y0, x1, y1]
+        * selected: Boolean array flagging the edges to split
+        * edge_ids: Indices of edges to split
+        * t: Positions (0 to 1) along the corresponding edges to split at.
+            Positions on edges not selected are ignored.
+
+    Returns:
+        * pieces: Array of edge pieces [x0, y0, x1, y1]
+        * piece_edges: Index of the edge each piece belongs to
+
+        Pieces are ordered by edge and then along the edge. Every
+        selected edge has at least one piece.
+    """
+
+    ends = numpy.where(selected)[0]
+    mask = selected[edge_ids]
+    ids = numpy.concatenate((ends, ends, edge_ids[mask]))
+    positions = numpy.concatenate((numpy.zeros(len(ends)),
+                                   numpy.ones(len(ends)),
+                                   numpy.clip(t[mask], 0, 1)))
+
+    order = numpy.lexsort((positions, ids))
+    ids = ids[order]
+    positions = positions[order]
+
+    # Consecutive positions along the same edge
+    keep = (ids[:-1] == ids[1:]) * (positions[:-1] < positions[1:])
+    piece_edges = ids[:-1][keep]
+    t0 = positions[:-1][keep]
+    t1 = positions[1:][keep]
+
+    E = edges[piece_edges]
+    dx = E[:, 2] - E[:, 0]
+    dy = E[:, 3] - E[:, 1]
+    pieces = numpy.array([E[:, 0] + t0 * dx, E[:, 1] + t0 * dy,
+                          E[:, 0] + t1 * dx, E[:, 1] + t1 * dy]).T
+
+    # Make pieces meet exactly at the ends of edges
+    pieces[t1 == 1, 2:] = E[t1 == 1, 2:]
+
+    return pieces, piece_edges
+
+
+def _points_inside_polygon_pairs(points, polygon_ids, polygons,
+                                 edges, owners, closed=None):
+    """Determine whether each point is inside an associated polygon
+
+    Args:
+        * points: Nx2 array of point coordinates
+        * polygon_ids: Index of the polygon to test each point against
+        * polygons: list of polygon geometry objects or list of polygon arrays
+        * edges: Edges of polygons as returned by _polygon_edges
+        * owners: Index of the polygon each edge belongs to
+        * closed: Set to True if points on boundary are considered
+            to be 'inside' polygon. If None (default) points on the
+            boundary may be deemed inside or outside.
+
+    Returns:
+        * Boolean array which is True for points inside their polygon
+
+    Note:
+        Points are tested against small polygons all at once by counting
+        edge crossings and testing boundary coincidence with the same
+        formulas as in separate_points_by_polygon. Large polygons are
+        tested one at a time with in_and_outside_polygon.
+    """
+
+    inside = numpy.zeros(len(polygon_ids), dtype=numpy.bool)
+    if len(polygon_ids) == 0:
+        return inside
+
+    counts = numpy.bincount(owners, minlength=len(polygons))
+    starts = numpy.cumsum(counts) - counts
+
+    # Small polygons: Expand all pairs of points and edges
+    small = numpy.where(counts[polygon_ids] <= SMALL_POLYGON_SIZE)[0]
+    if len(small) > 0:
+        members, positions = _expand_ranges(counts[polygon_ids[small]])
+        E = edges[starts[polygon_ids[small]][members] + positions]
+        x = points[small[members], 0]
+        y = points[small[members], 1]
+
+        # Suppress numpy warnings (as we'll be dividing by zero)
+        original_numpy_settings = numpy.seterr(invalid='ignore',
+                                               divide='ignore')
+        sigma = (y - E[:, 1]) / (E[:, 3] - E[:, 1]) * (E[:, 2] - E[:, 0])
+        seg_i = (E[:, 1] < y) * (E[:, 3] >= y)
+        seg_j = (E[:, 3] < y) * (E[:, 1] >= y)
+        crossings = (E[:, 0] + sigma < x) * (seg_i + seg_j)
+        numpy.seterr(**original_numpy_settings)
+
+        crossings = numpy.bincount(members, weights=crossings,
+                                   minlength=len(small))
+        inside[small] = crossings % 2 == 1
+
+        if closed is not None:
+            # Boundary test as in point_on_line with rtol = atol = 0
+            a0 = x - E[:, 0]
+            a1 = y - E[:, 1]
+            b0 = E[:, 2] - E[:, 0]
+            b1 = E[:, 3] - E[:, 1]
+            nominator = abs(a1 * b0 + (-a0) * b1)
+            len_a = numpy.sqrt(a0 * a0 + a1 * a1)
+            len_b = numpy.sqrt(b0 * b0 + b1 * b1)
+            cross = a0 * b0 + a1 * b1
+            hit = (nominator <= 0.0) * (cross >= 0) * (len_a <= len_b)
+            on_boundary = numpy.bincount(members, weights=hit,
+                                         minlength=len(small)) > 0
+            inside[small[on_boundary]] = closed
+
+    # Large polygons: One call per polygon
+    large = numpy.where(counts[polygon_ids] > SMALL_POLYGON_SIZE)[0]
+    order = large[numpy.argsort(polygon_ids[large], kind='mergesort')]
+    unique_ids, first = numpy.unique(polygon_ids[order], return_index=True)
+    bounds = numpy.append(first, len(order))
+
+    for k, i in enumerate(unique_ids):
+        subset = order[bounds[k]:bounds[k + 1]]
+        outer_ring, inner_rings = _get_polygon_rings(polygons[i])
+        if inner_rings is not None:
+            inner_rings = list(inner_rings)
+        indices, _ = in_and_outside_polygon(points[subset],
+                                            outer_ring,
+                                            holes=inner_rings,
+                                            closed=closed)
+        inside[subset[indices]] = True
+
+    return inside
+
+
+#----------------------------------
+# Clipping of lines by many polygons
+#----------------------------------
+def intersect_lines_with_polygons(lines, polygons, closed=True, index=None):
+    """Clip multiple lines by multiple polygons using spatial indices
+
+    Args:
+        * lines: list of Nx2 arrays of line vertices
+        * polygons: list of polygon geometry objects or list of polygon
+            arrays. Inner rings (holes) of geometry objects are respected.
+        * closed: Set to True if lines on polygon boundaries are
+            considered to be 'inside' polygons
+        * index: Optional BoundingBoxIndex built from the bounding boxes
+            of polygons. If None (default) it will be built here.
+
+    Returns:
+        * polygon_ids: Index of the polygon each clipped line is inside
+        * line_ids: Index of the line each clipped line was cut from
+        * clipped_lines: list of Nx2 arrays of vertices of clipped lines
+
+        Clipped lines are ordered by polygon, then by line and then along
+        the line. Each polygon clips all lines so clipped lines inside
+        overlapping polygons are reported for each of them.
+
+    Note:
+        This gives the same lines as :func:`clip_lines_by_polygon` applied
+        to each polygon in turn but only compares line segments with
+        polygon edges nearby: Candidate pairs of segments and polygons
+        are found through a spatial index over bounding boxes of polygons
+        and the crossings of segments with polygon edges through a second
+        index over the edges. Segments are split at the crossings and the
+        midpoints of all pieces classified in one batch. All steps are
+        vectorised so the work grows with the number of candidate pairs
+        and crossings rather than with the product of the numbers of
+        lines and polygons.
+    """
+
+    if index is None:
+        index = BoundingBoxIndex(polygons2bboxes(polygons))
+
+    msg = ('Spatial index has %i boxes but there are %i polygons'
+           % (len(index), len(polygons)))
+    if len(index) != len(polygons):
+        raise PolygonInputError(msg)
+
+    empty = numpy.zeros(0, dtype=numpy.int)
+    segments, segment_lines = _line_segments(lines)
+    if len(segments) == 0 or len(polygons) == 0:
+        return empty, empty, []
+
+    # Candidate pairs of segments and polygons
+    M = len(polygons)
+    segment_ids, polygon_ids = index.query_bboxes(_edge_bboxes(segments))
+    if len(segment_ids) == 0:
+        return empty, empty, []
+    keys = segment_ids * M + polygon_ids
+
+    # Positions where segments meet polygon edges. Edges lie within the
+    # bounding box of their polygon so each crossing has a candidate pair.
+    edges, owners = _polygon_edges(polygons)
+    edge_index = BoundingBoxIndex(_edge_bboxes(edges))
+    crossing_segments, crossing_edges, t, _ = _edge_crossings(segments,
+                                                              edges,
+                                                              edge_index)
+    crossing_keys = crossing_segments * M + owners[crossing_edges]
+    pairs = numpy.minimum(numpy.searchsorted(keys, crossing_keys),
+                          len(keys) - 1)
+    mask = keys[pairs] == crossing_keys
+
+    # Split each candidate pair at its crossings and keep pieces with
+    # their midpoint inside the polygon
+    pieces, piece_pairs = _split_edges(segments[segment_ids],
+                                       numpy.ones(len(keys), dtype=bool),
+                                       pairs[mask], t[mask])
+    midpoints = (pieces[:, :2] + pieces[:, 2:]) / 2
+    inside = _points_inside_polygon_pairs(midpoints,
+                                          polygon_ids[piece_pairs],
+                                          polygons, edges, owners,
+                                          closed=closed)
+    pieces = pieces[inside]
+    piece_pairs = piece_pairs[inside]
+    if len(pieces) == 0:
+        return empty, empty, []
+
+    # Order pieces by polygon. Pairs are ordered by segment so pieces
+    # remain ordered by line and along the line within each polygon.
+    order = numpy.argsort(polygon_ids[piece_pairs], kind='mergesort')
+    pieces = pieces[order]
+    piece_polygons = polygon_ids[piece_pairs[order]]
+    piece_lines = segment_lines[segment_ids[piece_pairs[order]]]
+
+    # Join pieces continuing each other into clipped lines
+    continued = ((piece_polygons[1:] == piece_polygons[:-1]) *
+                 (piece_lines[1:] == piece_lines[:-1]) *
+                 (pieces[1:, 0] == pieces[:-1, 2]) *
+                 (pieces[1:, 1] == pieces[:-1, 3]))
+    starts = numpy.where(numpy.concatenate(([True], ~continued)))[0]
+    ends = numpy.append(starts[1:], len(pieces))
+
+    # Vertices are the start of each piece followed by the end of the
+    # last piece of each clipped line
+    runs = numpy.cumsum(numpy.concatenate(([True], ~continued))) - 1
+    vertices = numpy.zeros((len(pieces) + len(starts), 2),
+                           dtype=numpy.float)
+    vertices[numpy.arange(len(pieces)) + runs] = pieces[:, :2]
+    vertices[ends + numpy.arange(len(starts))] = pieces[ends - 1, 2:]
+    clipped_lines = numpy.split(vertices,
+                                (ends + numpy.arange(len(starts)) + 1)[:-1])
+
+    return piece_polygons[starts], piece_lines[starts], clipped_lines
+
+
+#-------------------------------------
+# Scanline filling of polygons on grids
+#-------------------------------------
+def grid_indices_by_polygons(shape, geotransform, polygons, closed=True):
+    """Find grid points inside each of multiple polygons by scanline filling
+
+    Args:
+        * shape: Shape (ny, nx) of the grid
+        * geotransform: 6-tuple used to locate the grid geographically
+            (top left x, w-e pixel resolution, rotation,
+            top left y, rotation, n-s pixel resolution)
+        * polygons: list of polygon geometry objects or list of polygon arrays.
+            Inner rings (holes) of geometry objects are respected.
+        * closed: Set to True if points on boundary are considered
+            to be 'inside' polygon
+
+    Returns:
+        * List of arrays of indices into the flattened grid
+          (i.e. row * nx + col) of grid points inside each polygon
+          - one per input polygon. Each array is sorted in increasing order.
+
+    Note:
+        Grid points are pixel-registered as in :func:`clip_grid_by_polygons`.
+        If multiple polygons overlap, the one first encountered will be used.
+
+        Each ring is intersected with the rows of grid points it spans and
+        the grid points between pairs of crossings are filled. Crossings
+        and boundary coincidence are computed with the same formulas as in
+        separate_points_by_polygon so the result is the same as that of
+        label_points_by_polygons applied to all grid points.
+    """
+
+    ny, nx = shape
+    x, y = geotransform2axes(geotransform, nx, ny)
+    if len(polygons) == 0:
+        return []
+
+    # Grid points already claimed by a polygon. Only the part of the grid
+    # spanned by the polygons (padded by one to allow for rounding) is
+    # represented.
+    bboxes = polygons2bboxes(polygons)
+    col0 = numpy.searchsorted(x, numpy.min(bboxes[:, 0])) - 1
+    col1 = numpy.searchsorted(x, numpy.max(bboxes[:, 1]), side='right') + 1
+    row0 = ny - numpy.searchsorted(y, numpy.max(bboxes[:, 3]),
+                                   side='right') - 1
+    row1 = ny - numpy.searchsorted(y, numpy.min(bboxes[:, 2])) + 1
+    col0, row0 = max(col0, 0), max(row0, 0)
+    col1, row1 = min(col1, nx), min(row1, ny)
+    claimed = numpy.zeros((max(row1 - row0, 0), max(col1 - col0, 0)),
+                          dtype=numpy.bool)
+
+    result = []
+    for polygon in polygons:
+        outer_ring, inner_rings = _get_polygon_rings(polygon)
+        if inner_rings is None:
+            inner_rings = []
+
+        inside, on_boundary = _scanline_ring(outer_ring, x, y)
+        if closed is not None:
+            inside = numpy.setdiff1d(inside, on_boundary)
+            if closed:
+                inside = numpy.union1d(inside, on_boundary)
+
+        # Points on the boundary of holes are inside if polygon is open
+        for ring in inner_rings:
+            in_hole, on_boundary = _scanline_ring(ring, x, y)
+            if closed is not None:
+                in_hole = numpy.setdiff1d(in_hole, on_boundary)
+                if not closed:
+                    in_hole = numpy.union1d(in_hole, on_boundary)
+            inside = numpy.setdiff1d(inside, in_hole)
+
+        rows = inside // nx - row0
+        cols = inside % nx - col0
+        unclaimed = ~claimed[rows, cols]
+        inside = inside[unclaimed]
+        claimed[rows[unclaimed], cols[unclaimed]] = True
+        result.append(inside)
+
+    return result
+
+
+def label_grid_by_polygons(shape, geotransform, polygons, closed=True):
+    """Label grid points by the polygon they fall into
+
+    Args:
+        * shape: Shape (ny, nx) of the grid
+        * geotransform: 6-tuple used to locate the grid geographically
+        * polygons: list of polygon geometry objects or list of polygon arrays
+        * closed: Set to True if points on boundary are considered
+            to be 'inside' polygon
+
+    Returns:
+        * labels: Integer array of the given shape with the index of the
+          polygon each grid point falls into or -1 if it is not inside any.
+
+    Note:
+        See grid_indices_by_polygons for details.
+    """
+
+    # Use 32 bit labels to keep the memory footprint low for large grids
+    labels = -numpy.ones(shape, dtype=numpy.int32)
+    flat_labels = labels.reshape(-1)
+    for i, indices in enumerate(grid_indices_by_polygons(shape, geotransform,
+                                                         polygons, closed)):
+        flat_labels[indices] = i
+
+    return labels
+
+
+def _scanline_ring(ring, x, y):
+    """Fill one polygon ring along the rows of a grid
+
+    Args:
+        * ring: Nx2 array of ring vertices
+        * x: Longitudes of grid columns (west->east)
+        * y: Latitudes of grid rows (south->north)
+
+    Returns:
+        * inside: Sorted array of flat indices of grid points inside the ring
+          according to the edge crossing rule
+        * on_boundary: Sorted array of flat indices of grid points on the
+          ring as determined by point_on_line with zero tolerance
+    """
+
+    ring = ensure_numeric(ring, numpy.float)
+    nx = len(x)
+    ny = len(y)
+    N = ring.shape[0]
+
+    px_i = ring[:, 0]
+    py_i = ring[:, 1]
+    px_j = numpy.roll(px_i, -1)
+    py_j = numpy.roll(py_i, -1)
+
+    # Edges cross the rows with latitudes in (min(py_i, py_j), max(py_i, py_j)]
+    start = numpy.searchsorted(y, numpy.minimum(py_i, py_j), side='right')
+    end = numpy.searchsorted(y, numpy.maximum(py_i, py_j), side='right')
+    edges, positions = _expand_ranges(end - start)
+    k = start[edges] + positions
+    rows = ny - 1 - k
+
+    # Edge crossing formula as used in _separate_points_by_polygon
+    original_numpy_settings = numpy.seterr(invalid='ignore', divide='ignore')
+    sigma = ((y[k] - py_i[edges]) / (py_j[edges] - py_i[edges]) *
+             (px_j[edges] - px_i[edges]))
+    numpy.seterr(**original_numpy_settings)
+    crossings = px_i[edges] + sigma
+
+    # Sort crossings along each row. Each row is crossed an even number of
+    # times and grid points between consecutive pairs of crossings are inside
+    order = numpy.lexsort((crossings, rows))
+    rows = rows[order]
+    crossings = crossings[order]
+    edges = edges[order]
+
+    row = rows[0::2]
+    first = numpy.searchsorted(x, crossings[0::2], side='right')
+    last = numpy.searchsorted(x, crossings[1::2], side='right')
+    owners, positions = _expand_ranges(last - first)
+    inside = row[owners] * nx + first[owners] + positions
+
+    # Pairs of grid points and edges they may be on:
+    # Grid points either side of each crossing
+    col = numpy.searchsorted(x, crossings)
+    cells = [rows * nx + numpy.clip(col - 1, 0, nx - 1),
+             rows * nx + numpy.clip(col, 0, nx - 1)]
+    candidate_edges = [edges, edges]
+
+    # Grid points around each vertex paired with both edges meeting there
+    col = numpy.searchsorted(x, px_i)
+    k = numpy.searchsorted(y, py_i)
+    for dk in [-1, 0]:
+        row = ny - 1 - numpy.clip(k + dk, 0, ny - 1)
+        for dc in [-1, 0]:
+            cell = row * nx + numpy.clip(col + dc, 0, nx - 1)
+            cells.extend([cell, cell])
+            candidate_edges.extend([numpy.arange(N),
+                                    (numpy.arange(N) - 1) % N])
+
+    # Grid points on horizontal edges lying exactly on a row
+    horizontal = numpy.where(py_i == py_j)[0]
+    k = numpy.searchsorted(y, py_i[horizontal])
+    on_row = k < ny
+    on_row[on_row] = y[k[on_row]] == py_i[horizontal][on_row]
+    horizontal = horizontal[on_row]
+    row = ny - 1 - k[on_row]
+    first = numpy.searchsorted(x, numpy.minimum(px_i[horizontal],
+                                                px_j[horizontal]))
+    last = numpy.searchsorted(x, numpy.maximum(px_i[horizontal],
+                                               px_j[horizontal]),
+                              side='right')
+    owners, positions = _expand_ranges(last - first)
+    cells.append(row[owners] * nx + first[owners] + positions)
+    candidate_edges.append(horizontal[owners])
+
+    cells = numpy.concatenate(cells)
+    candidate_edges = numpy.concatenate(candidate_edges)
+
+    # Boundary test as in point_on_line with rtol = atol = 0
+    points = grid_indices2points(cells, x, y)
+    a0 = points[:, 0] - px_i[candidate_edges]
+    a1 = points[:, 1] - py_i[candidate_edges]
+    b0 = px_j[candidate_edges] - px_i[candidate_edges]
+    b1 = py_j[candidate_edges] - py_i[candidate_edges]
+
+    nominator = abs(a1 * b0 + (-a0) * b1)
+    len_a = numpy.sqrt(a0 * a0 + a1 * a1)
+    len_b = numpy.sqrt(b0 * b0 + b1 * b1)
+    cross = a0 * b0 + a1 * b1
+    hit = (nominator <= 0.0) * (cross >= 0) * (len_a <= len_b)
+    on_boundary = numpy.unique(cells[hit])
+
+    return inside, on_boundary
+
+
+#--------------------------------
+# Traversal of grid cells by lines
+#--------------------------------
+def grid_cells_along_lines(lines, shape, geotransform):
+    """Split lines into pieces at the boundaries of grid cells
+
+    Args:
+        * lines: list of Nx2 arrays of line vertices
+        * shape: Shape (ny, nx) of the grid
+        * geotransform: 6-tuple used to locate the grid geographically
+            (top left x, w-e pixel resolution, rotation,
+            top left y, rotation, n-s pixel resolution)
+
+    Returns:
+        * line_ids: Index of the line each piece belongs to
+        * indices: Index into the flattened grid (i.e. row * nx + col)
+          of the cell containing each piece
+        * lengths: Length of each piece
+
+        Pieces are ordered by line and then along the line. Parts of lines
+        outside the grid are left out.
+
+    Note:
+        Cells are the pixels of the grid so the grid point of a cell is
+        at its centre as in :func:`clip_grid_by_polygons`. Rows are counted
+        from the top as in raster data.
+
+        Each line segment is walked through the cells it crosses in the
+        manner of a digital differential analyser: The positions where it
+        crosses grid lines are enumerated directly from its end points
+        and the segment is split there. This is vectorised over all
+        segments of all lines so lines are never densified into points.
+
+        Lengths are in the units of the coordinates, e.g. degrees for
+        geographic data.
+    """
+
+    ny, nx = shape
+    segments, segment_lines = _line_segments(lines)
+
+    # Fractional column and row coordinates of end points
+    c0 = (segments[:, 0] - geotransform[0]) / geotransform[1]
+    r0 = (segments[:, 1] - geotransform[3]) / geotransform[5]
+    c1 = (segments[:, 2] - geotransform[0]) / geotransform[1]
+    r1 = (segments[:, 3] - geotransform[3]) / geotransform[5]
+    dc = c1 - c0
+    dr = r1 - r0
+
+    # Part of each segment inside the grid (Liang-Barsky clipping)
+    original_numpy_settings = numpy.seterr(invalid='ignore', divide='ignore')
+    t_enter = numpy.zeros(len(segments), dtype=numpy.float)
+    t_exit = numpy.ones(len(segments), dtype=numpy.float)
+    for p, d, size in [(c0, dc, nx), (r0, dr, ny)]:
+        ta = (0 - p) / d
+        tb = (size - p) / d
+        parallel = d == 0
+        t_enter = numpy.where(parallel, t_enter,
+                              numpy.maximum(t_enter,
+                                            numpy.minimum(ta, tb)))
+        t_exit = numpy.where(parallel, t_exit,
+                             numpy.minimum(t_exit, numpy.maximum(ta, tb)))
+
+        # Segments parallel to the grid lines and outside the grid
+        outside = parallel * ((p < 0) + (p > size))
+        t_exit[outside] = -1
+    numpy.seterr(**original_numpy_settings)
+
+    selected = numpy.where(t_exit > t_enter)[0]
+    t_enter = t_enter[selected]
+    t_exit = t_exit[selected]
+
+    # Positions where segments cross grid lines inside the grid
+    segment_ids = [selected, selected]
+    positions = [t_enter, t_exit]
+    for p, d in [(c0, dc), (r0, dr)]:
+        p = p[selected]
+        d = d[selected]
+        pa = p + t_enter * d
+        pb = p + t_exit * d
+        first = numpy.floor(numpy.minimum(pa, pb)) + 1
+        last = numpy.ceil(numpy.maximum(pa, pb)) - 1
+        counts = numpy.maximum(last - first + 1, 0).astype(numpy.int)
+        owners, k = _expand_ranges(counts)
+        segment_ids.append(selected[owners])
+        positions.append((first[owners] + k - p[owners]) / d[owners])
+
+    segment_ids = numpy.concatenate(segment_ids)
+    positions = numpy.concatenate(positions)
+    order = numpy.lexsort((positions, segment_ids))
+    segment_ids = segment_ids[order]
+    positions = positions[order]
+
+    # Pieces between consecutive positions along the same segment
+    keep = ((segment_ids[:-1] == segment_ids[1:]) *
+            (positions[:-1] < positions[1:]))
+    pieces = segment_ids[:-1][keep]
+    ta = positions[:-1][keep]
+    tb = positions[1:][keep]
+
+    # Cell containing the midpoint of each piece
+    t = (ta + tb) / 2
+    cols = numpy.floor(c0[pieces] + t * dc[pieces]).astype(numpy.int)
+    rows = numpy.floor(r0[pieces] + t * dr[pieces]).astype(numpy.int)
+    cols = numpy.clip(cols, 0, nx - 1)
+    rows = numpy.clip(rows, 0, ny - 1)
+
+    dx = segments[pieces, 2] - segments[pieces, 0]
+    dy = segments[pieces, 3] - segments[pieces, 1]
+    lengths = (tb - ta) * numpy.sqrt(dx * dx + dy * dy)
+
+    return segment_lines[pieces], rows * nx + cols, lengths
+
+
+def _line_segments(lines):
+    """Get segments of lines
+
+    Args:
+        * lines: list of Nx2 arrays of line vertices
+
+    Returns:
+        * segments: Kx4 array with one row [x0, y0, x1, y1] per segment
+        * segment_lines: Index of the line each segment belongs to
+
+        Segments are ordered by line and then along the line.
+    """
+
+    lines = [numpy.reshape(ensure_numeric(line, numpy.float), (-1, 2))
+             for line in lines]
+    if len(lines) == 0:
+        return numpy.zeros((0, 4), dtype=numpy.float), \
+            numpy.zeros(0, dtype=numpy.int)
+
+    sizes = numpy.array([len(line) for line in lines], dtype=numpy.int)
+    vertices = numpy.concatenate(lines)
+
+    # Segments join each vertex to the next one in the same line
+    counts = numpy.maximum(sizes - 1, 0)
+    segment_lines, positions = _expand_ranges(counts)
+    starts = (numpy.cumsum(sizes) - sizes)[segment_lines] + positions
+
+    segments = numpy.concatenate((vertices[starts], vertices[starts + 1]),
+                                 axis=1)
+    return segments, segment_lines
@@ -18,7 +18,9 @@ __copyright__ = ('Copyright 2012, Australia Indonesia Facility for '
 
 import os
 import unittest
-from converter import convert_mmi_data
+import numpy
+from converter import convert_mmi_data, read_grid_xml
+from safe.common.exceptions import GridXmlParseError
 from safe.common.utilities import unique_filename, temp_dir
 
 from safe.common.testing import TESTDATA
@@ -45,6 +47,62 @@ class ConverterTest(unittest.TestCase):
                          (my_result[:-3] + 'qml')
     test_convertGridToRaster.slow = True
 
+    def test_read_grid_xml(self):
+        """Header and data of grid.xml are read block by block
+        """
+        my_data = numpy.array([[126.29, 4.798, 0.01, 1.16],
+                               [126.315, 4.798, 0.02, 1.17],
+                               [126.29, 4.773, 0.01, 1.2],
+                               [126.315, 4.773, 0.03, 2.5],
+                               [126.29, 4.748, 0.01, 1.0],
+                               [126.315, 4.748, 0.01, 1.12]])
+        my_grid = ('<?xml version="1.0" encoding="US-ASCII" '
+                   'standalone="yes"?>\n'
+                   '<shakemap_grid event_id="20120807015938">\n'
+                   '<event magnitude="5.1" depth="206" lat="2.800000" '
+                   'lon="128.290000" '
+                   'event_timestamp="2012-08-07T01:55:12WIB" '
+                   'event_description="Halmahera, Indonesia    " />\n'
+                   '<grid_specification lon_min="126.290000" '
+                   'lat_min="4.748000" lon_max="126.315000" '
+                   'lat_max="4.798000" nlon="2" nlat="3" />\n'
+                   '<grid_field index="1" name="LON" units="dd" />\n'
+                   '<grid_field index="2" name="LAT" units="dd" />\n'
+                   '<grid_field index="4" name="MMI" units="intensity" />\n'
+                   '<grid_field index="3" name="PGA" units="pctg" />\n'
+                   '<grid_data>\n')
+        for my_row in my_data:
+            my_grid += '%.4f %07.4f %.2f %.2f\n' % tuple(my_row)
+        my_grid += '</grid_data>\n</shakemap_grid>\n'
+
+        my_path = unique_filename(suffix='.xml', dir=temp_dir('test'))
+        my_file = open(my_path, 'w')
+        my_file.write(my_grid)
+        my_file.close()
+
+        # Blocks smaller than numbers and tags are handled
+        for my_block_size in [3, 50, 2 ** 20]:
+            my_header, my_fields, my_result = read_grid_xml(my_path,
+                                                            my_block_size)
+            assert my_fields == ['LON', 'LAT', 'PGA', 'MMI']
+            assert my_header['event']['magnitude'] == '5.1'
+            assert my_header['event']['event_description'].strip() == \
+                'Halmahera, Indonesia'
+            assert my_header['grid_specification']['nlat'] == '3'
+            assert numpy.allclose(my_result, my_data)
+
+        # Grid data must match the grid specification
+        my_file = open(my_path, 'w')
+        my_file.write(my_grid.replace('nlat="3"', 'nlat="4"'))
+        my_file.close()
+        self.assertRaises(GridXmlParseError, read_grid_xml, my_path)
+
+        my_file = open(my_path, 'w')
+        my_file.write(my_grid.split('</grid_data>')[0])
+        my_file.close()
+        self.assertRaises(GridXmlParseError, read_grid_xml, my_path)
+        os.remove(my_path)
+
 
 if __name__ == '__main__':
     suite = unittest.makeSuite(ConverterTest, 'test')
@@ -11,6 +11,7 @@ import numpy
 #from safe.common.numerics import erf
 from safe.common.numerics import axes2points
 from safe.common.numerics import grid2points
+from safe.common.numerics import order_statistics
 #from safe.common.numerics import geotransform2axes
 
 
@@ -76,6 +77,30 @@ class Test_Numerics(unittest.TestCase):
         assert numpy.allclose(P[:L:N, 1], latitudes[::-1])
         assert numpy.allclose(V, A.flat[:])
 
+    def test_order_statistics(self):
+        """Values of given ranks are found without sorting all data
+        """
+
+        numpy.random.seed(17)
+        for A in [numpy.random.random(1000),
+                  numpy.random.lognormal(0, 5, 1000),
+                  numpy.random.randint(0, 5, 1000).astype('d'),
+                  numpy.concatenate([numpy.zeros(990),
+                                     numpy.random.random(10)])]:
+
+            def blocks():
+                return iter(numpy.array_split(A, 7))
+
+            B = numpy.sort(A)
+            ranks = [0, 1, 99, 500, 501, 998, 999]
+            expected = [B[rank] for rank in ranks]
+
+            # Few histogram bins and values to sort need more passes
+            for bins, limit in [(4096, 2 ** 20), (16, 100), (4, 0)]:
+                values = order_statistics(blocks, ranks, B[0], B[-1],
+                                          bins=bins, limit=limit)
+                assert values == expected
+
 
 if __name__ == '__main__':
     suite = unittest.makeSuite(Test_Numerics, 'test')
@@ -12,6 +12,7 @@ from safe.common.polygon import (separate_points_by_polygon,
                                  inside_polygon,
                                  clip_lines_by_polygon,
                                  clip_lines_by_polygons,
+                                 intersect_lines_with_polygons,
                                  in_and_outside_polygon,
                                  intersection,
                                  join_line_segments,
@@ -20,9 +21,20 @@ from safe.common.polygon import (separate_points_by_polygon,
                                  populate_polygon,
                                  generate_random_points_in_bbox,
                                  PolygonInputError,
-                                 line_dictionary_to_geometry)
+                                 line_dictionary_to_geometry,
+                                 inside_polygons,
+                                 label_points_by_polygons,
+                                 labels_to_indices,
+                                 polygons2bboxes,
+                                 BoundingBoxIndex,
+                                 polygon_intersection_areas,
+                                 grid_indices_by_polygons,
+                                 label_grid_by_polygons,
+                                 grid_cells_along_lines)
 from safe.common.testing import test_polygon, test_lines
+from safe.common.testing import combine_coordinates
 from safe.common.numerics import ensure_numeric
+from safe.common.numerics import geotransform2axes, grid2points
 
 
 def linear_function(x, y):
@@ -540,6 +552,50 @@ class Test_Polygon(unittest.TestCase):
         assert numpy.allclose(ins_p, [1, 2, 3])
         assert numpy.allclose(out_p, [0, 4, 5])
 
+    def test_separate_points_by_polygon_blocked(self):
+        """Blocked polygon clipping agrees with reference implementation
+        """
+
+        # Simple example with points on boundary
+        polygon = [[0, 0], [1, 0], [0.5, -1], [2, -1], [2, 1], [0, 1]]
+        points = [[0.5, 1.4], [0.5, 0.5], [1, -0.5], [1.5, 0],
+                  [0.5, 1.5], [0.5, -0.5], [0, 0.5], [2, 1]]
+        for closed in [True, False]:
+            ins_r, out_r = separate_points_by_polygon(points, polygon,
+                                                      closed=closed)
+            ins_b, out_b = separate_points_by_polygon(points, polygon,
+                                                      closed=closed,
+                                                      method='blocked')
+            assert numpy.all(ins_r == ins_b)
+            assert numpy.all(out_r == out_b)
+
+        # Real polygon with random points, vertices and edge midpoints
+        polygon = ensure_numeric(test_polygon)
+        midpoints = (polygon[:-1] + polygon[1:]) / 2
+        points = generate_random_points_in_bbox(polygon, 5000, seed=17)
+        points = numpy.concatenate((points, polygon, midpoints,
+                                    [[numpy.nan, numpy.nan]]))
+
+        for closed in [True, False, None]:
+            ins_r, out_r = separate_points_by_polygon(points, polygon,
+                                                      closed=closed)
+            ins_b, out_b = separate_points_by_polygon(points, polygon,
+                                                      closed=closed,
+                                                      method='blocked')
+            assert numpy.all(ins_r == ins_b)
+            assert numpy.all(out_r == out_b)
+            assert len(ins_b) > 0
+            assert len(out_b) > 0
+
+        # Unknown method
+        try:
+            separate_points_by_polygon(points, polygon, method='nonsense')
+        except PolygonInputError:
+            pass
+        else:
+            msg = 'Unknown method should have raised PolygonInputError'
+            raise Exception(msg)
+
     def test_polygon_clipping_error_handling(self):
         """Polygon clipping checks input as expected"""
 
@@ -1524,6 +1580,83 @@ class Test_Polygon(unittest.TestCase):
                               [[0.3, 0.2],
                                [0.31666667, 0.31666667]])
 
+    def test_intersect_lines_with_polygons(self):
+        """Lines are clipped by many polygons at once using spatial indices
+        """
+
+        polygons = [[[0, 0], [1, 0], [1, 1], [0, 1]],
+                    [[1, 0], [3, 0], [2, 1]],
+                    [[0, 3], [1, 3], [0.5, 2],
+                     [2, 2], [2, 4], [0, 4]],
+                    [[-1, -1], [6, -1], [6, 6], [6, 6]]]
+        lines = [[[0, 0.5], [4, 0.5]],
+                 [[2, 0], [2, 5]],
+                 [[0, 0], [5, 5]],
+                 [[10, 10], [30, 10]],
+                 [[-1, 0.5], [0.5, 0.5], [2.5, 3]],
+                 [[0.3, 0.2], [0.7, 3], [1.0, 1.9]]]
+
+        polygon_ids, line_ids, clipped_lines = \
+            intersect_lines_with_polygons(lines, polygons)
+        assert len(polygon_ids) == len(line_ids) == len(clipped_lines)
+
+        # Same lines as clipping by one polygon at a time
+        k = 0
+        for i, polygon in enumerate(polygons):
+            inside, _ = clip_lines_by_polygon(lines, polygon)
+            for j in sorted(inside.keys()):
+                for line in inside[j]:
+                    assert polygon_ids[k] == i
+                    assert line_ids[k] == j
+                    assert numpy.allclose(clipped_lines[k], line)
+                    k += 1
+        assert k == len(clipped_lines)
+
+        # Old interface gives the same result
+        lines_covered = clip_lines_by_polygons(lines, polygons,
+                                               method='loop')
+        for i, D in enumerate(clip_lines_by_polygons(lines, polygons)):
+            assert sorted(D.keys()) == range(len(lines))
+            for j in D:
+                assert len(D[j]) == len(lines_covered[i][j])
+                for line, expected in zip(D[j], lines_covered[i][j]):
+                    assert numpy.allclose(line, expected)
+
+        # Holes are respected and boundaries are inside if closed
+        square = numpy.array([[0, 0], [1, 0], [1, 1], [0, 1]])
+        P = Polygon(outer_ring=square * 4, inner_rings=[square * 2 + 1])
+        lines = [[[-1, 2], [5, 2]], [[1, 1], [3, 1]]]
+        polygon_ids, line_ids, clipped_lines = \
+            intersect_lines_with_polygons(lines, [P])
+        assert numpy.allclose(line_ids, [0, 0, 1])
+        assert numpy.allclose(clipped_lines[0], [[0, 2], [1, 2]])
+        assert numpy.allclose(clipped_lines[1], [[3, 2], [4, 2]])
+        assert numpy.allclose(clipped_lines[2], [[1, 1], [3, 1]])
+
+        _, line_ids, _ = intersect_lines_with_polygons(lines, [P],
+                                                       closed=False)
+        assert numpy.allclose(line_ids, [0, 0])
+
+        # Polygons with more than SMALL_POLYGON_SIZE edges only
+        t = numpy.linspace(0, 2 * numpy.pi, 100, endpoint=False)
+        circle = numpy.array([numpy.cos(t), numpy.sin(t)]).T
+        polygons = [circle, circle * 2 + [3, 0], circle * 0.5 + [-10, 10]]
+        lines = [[[-20, 0], [20, 0]],
+                 [[0, -5], [0, 5], [3, 5], [3, -5]],
+                 [[-20, 10], [-10, 10]],
+                 [[0.5, 0.5], [2, 0.5]]]
+        lines_covered = clip_lines_by_polygons(lines, polygons,
+                                               method='loop')
+        D = clip_lines_by_polygons(lines, polygons)
+        assert len(D) == len(lines_covered)
+        for i in range(len(D)):
+            assert sorted(D[i].keys()) == sorted(lines_covered[i].keys())
+            for j in D[i]:
+                assert len(D[i][j]) == len(lines_covered[i][j])
+                for line, expected in zip(D[i][j], lines_covered[i][j]):
+                    assert numpy.allclose(line, expected)
+        assert numpy.allclose(D[0][0], [[[-1, 0], [1, 0]]])
+
     def test_clip_lines_by_polygon_real_data(self):
         """Real roads are clipped by complex polygon
         """
@@ -1682,6 +1815,389 @@ class Test_Polygon(unittest.TestCase):
         for i in range(len(lines)):
             assert numpy.allclose(lines[i], segments[i])
 
+    def test_bounding_box_index(self):
+        """Bounding box index finds all boxes containing points
+        """
+
+        bboxes = [[0, 1, 0, 1],  # Unit square
+                  [0.5, 2, 0.5, 2],  # Overlapping the unit square
+                  [10, 11, 10, 11],  # Far away
+                  [3, 3, 3, 3]]  # Degenerate box
+        index = BoundingBoxIndex(bboxes)
+        assert len(index) == 4
+
+        points = [[0.25, 0.25],  # In box 0
+                  [0.75, 0.75],  # In boxes 0 and 1
+                  [1, 1],  # On boundary of box 0 and inside 1
+                  [5, 5],  # In no box
+                  [10.5, 10.5],  # In box 2
+                  [3, 3],  # In degenerate box 3
+                  [-1, 0.5],  # Outside extent
+                  [numpy.nan, 0.5]]  # Not a number
+        point_ids, box_ids = index.query_points(points)
+        assert numpy.allclose(point_ids, [0, 1, 1, 2, 2, 4, 5])
+        assert numpy.allclose(box_ids, [0, 0, 1, 0, 1, 2, 3])
+
+        # Brute force check with a fine grid
+        index = BoundingBoxIndex(bboxes, cellsize=0.1)
+        point_ids, box_ids = index.query_points(points)
+        assert numpy.allclose(point_ids, [0, 1, 1, 2, 2, 4, 5])
+        assert numpy.allclose(box_ids, [0, 0, 1, 0, 1, 2, 3])
+
+        # Empty cases
+        point_ids, box_ids = index.query_points(numpy.zeros((0, 2)))
+        assert len(point_ids) == len(box_ids) == 0
+
+        index = BoundingBoxIndex(numpy.zeros((0, 4)))
+        point_ids, box_ids = index.query_points(points)
+        assert len(point_ids) == len(box_ids) == 0
+
+    def test_bounding_box_index_query_bboxes(self):
+        """Bounding box index finds all boxes overlapping boxes
+        """
+
+        bboxes = [[0, 1, 0, 1],  # Unit square
+                  [0.5, 2, 0.5, 2],  # Overlapping the unit square
+                  [10, 11, 10, 11],  # Far away
+                  [3, 3, 3, 3]]  # Degenerate box
+
+        queries = [[0.2, 0.4, 0.2, 0.4],  # Inside box 0
+                   [0.9, 1.5, -1, 0.7],  # Overlapping boxes 0 and 1
+                   [2, 3, 2, 3],  # Touching boxes 1 and 3
+                   [-5, 20, -5, 20],  # Containing all boxes
+                   [4, 5, 4, 5],  # Overlapping no box
+                   [numpy.nan, 1, 0, 1]]  # Not a number
+
+        for cellsize in [None, 0.1, 100]:
+            index = BoundingBoxIndex(bboxes, cellsize=cellsize)
+            query_ids, box_ids = index.query_bboxes(queries)
+            assert numpy.allclose(query_ids, [0, 1, 1, 2, 2, 3, 3, 3, 3])
+            assert numpy.allclose(box_ids, [0, 0, 1, 1, 3, 0, 1, 2, 3])
+
+        # Empty cases
+        query_ids, box_ids = index.query_bboxes(numpy.zeros((0, 4)))
+        assert len(query_ids) == len(box_ids) == 0
+
+        index = BoundingBoxIndex(numpy.zeros((0, 4)))
+        query_ids, box_ids = index.query_bboxes(queries)
+        assert len(query_ids) == len(box_ids) == 0
+
+    def test_polygon_intersection_areas(self):
+        """Areas of intersection between polygons are correct
+        """
+
+        # Squares in either orientation, one with a hole
+        square = numpy.array([[0, 0], [1, 0], [1, 1], [0, 1]])
+        hole = numpy.array([[2, 2], [2, 8], [8, 8], [8, 2]])
+        polygons = [square * 2,
+                    square[::-1] * 2 + 1,
+                    square + 10,
+                    square * 12 - 1,
+                    Polygon(outer_ring=square * 10, inner_rings=[hole])]
+        clip_polygons = [square * 3 + 1,
+                         Polygon(outer_ring=square * 10, inner_rings=[hole]),
+                         square * 100 - 50]
+
+        ids, clip_ids, areas = polygon_intersection_areas(polygons,
+                                                          clip_polygons)
+        assert numpy.all(ids == [0, 0, 0, 1, 1, 1, 2, 3, 3, 3,
+                                 4, 4, 4])
+        assert numpy.all(clip_ids == [0, 1, 2, 0, 1, 2, 2, 0, 1, 2,
+                                      0, 1, 2])
+        assert numpy.allclose(areas, [1, 4, 4, 4, 3, 4, 1, 9, 64, 144,
+                                      9 - 4, 64, 64])
+
+        # Pieces of a tiling add up to the polygon and touching polygons
+        # do not intersect
+        tiles = []
+        for i in range(4):
+            for j in range(4):
+                tiles.append(square * 2.5 + [2.5 * i, 2.5 * j])
+        star = numpy.array([[5, 0], [6, 4], [10, 5], [6, 6], [5, 10],
+                            [4, 6], [0, 5], [4, 4]])
+        polygons = [star, Polygon(outer_ring=square * 10, inner_rings=[hole]),
+                    square * 2.5 + 10]
+        ids, clip_ids, areas = polygon_intersection_areas(polygons, tiles)
+        totals = numpy.bincount(ids, weights=areas)
+        assert numpy.allclose(totals, [20, 64])
+
+        # Overlap of shifted non convex polygons by Monte Carlo
+        points = generate_random_points_in_bbox(star, 20000, seed=13)
+        inside = inside_polygon(points, star)
+        inside = inside_polygon(points[inside], star + 1)
+        ids, clip_ids, areas = polygon_intersection_areas([star], [star + 1])
+        assert numpy.allclose(areas, len(inside) / 20000.0 * 100, rtol=0.05)
+
+        # Small polygons far from the origin
+        offset = numpy.array([120, -7])
+        ids, clip_ids, areas = polygon_intersection_areas(
+            [square * 1.0e-4 + offset], [square * 0.5e-4 + offset])
+        assert numpy.allclose(areas, 0.25e-8, rtol=1.0e-6, atol=0)
+
+        # Polygons with more than SMALL_POLYGON_SIZE edges only
+        n = 100
+        t = numpy.linspace(0, 2 * numpy.pi, n, endpoint=False)
+        circle = numpy.array([numpy.cos(t), numpy.sin(t)]).T
+        circle_area = n / 2.0 * numpy.sin(2 * numpy.pi / n)
+        ids, clip_ids, areas = polygon_intersection_areas([square],
+                                                          [circle])
+        assert numpy.all(ids == [0]) and numpy.all(clip_ids == [0])
+        assert numpy.allclose(areas, circle_area / 4)
+        ids, clip_ids, areas = polygon_intersection_areas([circle * 2],
+                                                          [circle])
+        assert numpy.allclose(areas, circle_area)
+
+        # Empty cases
+        ids, clip_ids, areas = polygon_intersection_areas([], tiles)
+        assert len(ids) == len(clip_ids) == len(areas) == 0
+        ids, clip_ids, areas = polygon_intersection_areas([square + 20],
+                                                          tiles)
+        assert len(ids) == len(clip_ids) == len(areas) == 0
+
+    def test_inside_polygons(self):
+        """Points inside multiple polygons are the same as for inside_polygon
+        """
+
+        # Overlapping polygons, one with a hole, one given as array
+        outer_ring = numpy.array([[0, 0], [10, 0], [10, 10], [0, 10]])
+        hole = numpy.array([[2, 2], [4, 2], [4, 4], [2, 4]])
+        polygons = [Polygon(outer_ring=outer_ring, inner_rings=[hole]),
+                    Polygon(outer_ring=outer_ring + 5),
+                    numpy.array([[3, 3], [12, 3], [7, 20]]),
+                    Polygon(outer_ring=outer_ring + 100)]
+
+        bboxes = polygons2bboxes(polygons)
+        assert numpy.allclose(bboxes[0], [0, 10, 0, 10])
+        assert numpy.allclose(bboxes[2], [3, 12, 3, 20])
+
+        # Random points and grid points (including polygon boundaries)
+        points = generate_random_points_in_bbox(outer_ring * 2 - 2,
+                                                1000, seed=17)
+        x = y = numpy.arange(-2, 18)
+        points = numpy.concatenate((points,
+                                    combine_coordinates(x, y)))
+
+        # Reference result polygon by polygon
+        reference = []
+        for polygon in polygons:
+            if hasattr(polygon, 'outer_ring'):
+                reference.append(inside_polygon(points, polygon.outer_ring,
+                                                holes=polygon.inner_rings))
+            else:
+                reference.append(inside_polygon(points, polygon))
+
+        res = inside_polygons(points, polygons)
+        assert len(res) == len(polygons)
+        for i in range(len(polygons)):
+            assert numpy.all(res[i] == reference[i])
+
+        # Last polygon is away from all points
+        assert len(res[3]) == 0
+
+        # Index can be passed in
+        index = BoundingBoxIndex(bboxes, cellsize=0.7)
+        res = inside_polygons(points, polygons, index=index)
+        for i in range(len(polygons)):
+            assert numpy.all(res[i] == reference[i])
+
+    def test_label_points_by_polygons(self):
+        """Points are labelled by the first polygon they fall into
+        """
+
+        outer_ring = numpy.array([[0, 0], [10, 0], [10, 10], [0, 10]])
+        hole = numpy.array([[2, 2], [4, 2], [4, 4], [2, 4]])
+        polygons = [Polygon(outer_ring=outer_ring, inner_rings=[hole]),
+                    Polygon(outer_ring=outer_ring + 5),
+                    numpy.array([[1, 1], [5, 1], [5, 5], [1, 5]]),
+                    Polygon(outer_ring=outer_ring + 100)]
+
+        points = [[1, 1],  # In polygon 0 and vertex of polygon 2
+                  [3, 3],  # In hole of polygon 0 and inside polygon 2
+                  [2, 3],  # On boundary of hole and inside polygon 2
+                  [7, 7],  # In polygons 0 and 1
+                  [12, 12],  # In polygon 1 only
+                  [50, 50],  # Not in any polygon
+                  [105, 110]]  # On boundary of polygon 3
+        labels = label_points_by_polygons(points, polygons)
+        assert numpy.all(labels == [0, 2, 0, 0, 1, -1, 3])
+
+        # Open polygons
+        labels = label_points_by_polygons(points, polygons, closed=False)
+        assert numpy.all(labels == [0, 2, 2, 0, 1, -1, -1])
+
+        # Conversion to indices
+        indices = labels_to_indices(labels, len(polygons))
+        assert len(indices) == len(polygons)
+        assert numpy.all(indices[0] == [0, 3])
+        assert numpy.all(indices[1] == [4])
+        assert numpy.all(indices[2] == [1, 2])
+        assert len(indices[3]) == 0
+
+        # Compare with polygon by polygon clipping of random points
+        points = generate_random_points_in_bbox(outer_ring * 2 - 2,
+                                                1000, seed=17)
+        labels = label_points_by_polygons(points, polygons)
+        remaining = numpy.arange(len(points))
+        for i, polygon in enumerate(polygons):
+            if hasattr(polygon, 'outer_ring'):
+                inside, outside = in_and_outside_polygon(
+                    points[remaining], polygon.outer_ring,
+                    holes=polygon.inner_rings)
+            else:
+                inside, outside = in_and_outside_polygon(points[remaining],
+                                                         polygon)
+            assert numpy.all(labels[remaining[inside]] == i)
+            remaining = remaining[outside]
+        assert numpy.all(labels[remaining] == -1)
+
+        # Degenerate input
+        labels = label_points_by_polygons(numpy.zeros((0, 2)), polygons)
+        assert len(labels) == 0
+        labels = label_points_by_polygons(points, [])
+        assert numpy.all(labels == -1)
+        assert labels_to_indices(labels, 0) == []
+
+    def test_label_points_by_polygons_many_points(self):
+        """Spatially indexed labelling agrees with looping over polygons
+
+        Compare label_points_by_polygons with the loop over inside_polygon
+        it replaces for 400 polygons and 200000 points.
+        """
+
+        # Tile area with 20 x 20 square polygons each having a hole
+        polygons = []
+        square = numpy.array([[0, 0], [1, 0], [1, 1], [0, 1]], dtype='d')
+        for i in range(20):
+            for j in range(20):
+                outer_ring = square + [i, j]
+                hole = square * 0.5 + [i + 0.25, j + 0.25]
+                polygons.append(Polygon(outer_ring=outer_ring,
+                                        inner_rings=[hole]))
+
+        points = generate_random_points_in_bbox(
+            numpy.array([[0, 0], [20, 20]]), 200000, seed=13)
+
+        reference = -numpy.ones(len(points), dtype=numpy.int)
+        for i, p in enumerate(polygons):
+            inside = inside_polygon(points, p.outer_ring,
+                                    holes=p.inner_rings)
+            inside = inside[reference[inside] < 0]
+            reference[inside] = i
+
+        labels = label_points_by_polygons(points, polygons)
+        assert numpy.all(labels == reference)
+
+    test_label_points_by_polygons_many_points.slow = True
+
+    def test_clip_grid_by_polygons_scanline(self):
+        """Scanline filling of polygons gives same result as point clipping
+        """
+
+        outer_ring = numpy.array([[0, 0], [10, 0], [10, 10], [0, 10]])
+        hole = numpy.array([[2, 2], [4, 2], [4, 4], [2, 4]])
+        polygons = [Polygon(outer_ring=outer_ring, inner_rings=[hole]),
+                    Polygon(outer_ring=outer_ring + 5),
+                    numpy.array([[3, 3], [12, 3], [7, 20], [3, 3]]),
+                    Polygon(outer_ring=outer_ring + 100),
+                    numpy.array([[-3, 1.3], [4.7, -2.1], [17.3, 6.2],
+                                 [9.1, 2.2], [6.6, 19.1]])]
+
+        # Grids with points on polygon boundaries and an unaligned one
+        grids = [((-2.5, 1.0, 0, 20.5, 0, -1.0), (23, 22)),
+                 ((-2.5, 0.5, 0, 20.5, 0, -0.5), (46, 44)),
+                 ((-2.37, 0.0731, 0, 21.13, 0, -0.0677), (340, 330))]
+
+        for geotransform, shape in grids:
+            A = numpy.arange(shape[0] * shape[1]).reshape(shape)
+            ny, nx = shape
+            x, y = geotransform2axes(geotransform, nx, ny)
+            points, _ = grid2points(A, x, y)
+
+            for P in [polygons, polygons[::-1]]:
+                reference = clip_grid_by_polygons(A, geotransform, P)
+                res = clip_grid_by_polygons(A, geotransform, P,
+                                            method='scanline')
+                assert len(res) == len(P)
+                for i in range(len(P)):
+                    assert numpy.all(res[i][0] == reference[i][0])
+                    assert numpy.all(res[i][1] == reference[i][1])
+
+                for closed in [True, False]:
+                    labels = label_points_by_polygons(points, P,
+                                                      closed=closed)
+                    indices = grid_indices_by_polygons(shape, geotransform,
+                                                       P, closed=closed)
+                    reference = labels_to_indices(labels, len(P))
+                    for i in range(len(P)):
+                        assert numpy.all(indices[i] == reference[i])
+
+                    grid_labels = label_grid_by_polygons(shape, geotransform,
+                                                         P, closed=closed)
+                    assert grid_labels.shape == shape
+                    assert numpy.all(grid_labels.reshape(-1) == labels)
+
+        # Check that invalid method is caught
+        try:
+            clip_grid_by_polygons(A, geotransform, polygons, method='x')
+        except PolygonInputError:
+            pass
+        else:
+            msg = 'Invalid method should have raised exception'
+            raise Exception(msg)
+
+    def test_grid_cells_along_lines(self):
+        """Lines are split into pieces at grid cell boundaries
+        """
+
+        # Grid of 4 x 3 unit cells with top left corner at (0, 3)
+        geotransform = (0.0, 1.0, 0, 3.0, 0, -1.0)
+        shape = (3, 4)
+
+        lines = [numpy.array([[0.5, 2.5], [3.5, 2.5]]),  # Along top row
+                 numpy.array([[0.5, 0.5], [1.5, 1.5], [1.5, 2.5]]),
+                 numpy.array([[-2, 1.5], [6, 1.5]]),  # Beyond the grid
+                 numpy.array([[5, 5], [6, 6]]),  # Outside the grid
+                 numpy.array([[1, 0.5], [1, 2.5]])]  # Along grid line
+        line_ids, indices, lengths = grid_cells_along_lines(lines, shape,
+                                                            geotransform)
+
+        assert numpy.all(line_ids == [0, 0, 0, 0,
+                                      1, 1, 1, 1,
+                                      2, 2, 2, 2,
+                                      4, 4, 4])
+        assert numpy.all(indices == [0, 1, 2, 3,
+                                     8, 5, 5, 1,
+                                     4, 5, 6, 7,
+                                     9, 5, 1])
+        d = numpy.sqrt(2) / 2
+        assert numpy.allclose(lengths, [0.5, 1, 1, 0.5,
+                                        d, d, 0.5, 0.5,
+                                        1, 1, 1, 1,
+                                        0.5, 1, 0.5])
+
+        # Lines crossing many cells give pieces adding up to their lengths
+        geotransform = (-2.37, 0.0731, 0, 21.13, 0, -0.0677)
+        shape = (340, 330)
+        lines = [numpy.array([[-2, 1.3], [4.7, -1.5], [17.3, 6.2],
+                              [9.1, 2.2], [6.6, 19.1]])]
+        line_ids, indices, lengths = grid_cells_along_lines(lines, shape,
+                                                            geotransform)
+        segments = numpy.diff(lines[0], axis=0)
+        total = numpy.sum(numpy.sqrt(numpy.sum(segments ** 2, axis=1)))
+        assert numpy.allclose(numpy.sum(lengths), total)
+        assert numpy.all(lengths > 0)
+
+        # Consecutive pieces are in neighbouring cells
+        rows = indices // shape[1]
+        cols = indices % shape[1]
+        steps = numpy.abs(numpy.diff(rows)) + numpy.abs(numpy.diff(cols))
+        assert numpy.all(steps <= 2)
+
+        # Empty cases
+        line_ids, indices, lengths = grid_cells_along_lines([], shape,
+                                                            geotransform)
+        assert len(line_ids) == len(indices) == len(lengths) == 0
+
 if __name__ == '__main__':
     suite = unittest.makeSuite(Test_Polygon, 'test')
     runner = unittest.TextTestRunner(verbosity=2)
@@ -3,11 +3,17 @@
 Provides the function calculate_impact()
 """
 
+import os
 import numpy
+import multiprocessing
 
 from safe.storage.projection import Projection
 from safe.storage.projection import DEFAULT_PROJECTION
-from safe.impact_functions.core import extract_layers
+from safe.storage.array_store import write_array_store, read_array_store
+from safe.storage.raster import Raster
+from safe.storage.block_writer import BlockWriter
+from safe.storage.utilities import write_keywords
+from safe.impact_functions.core import extract_layers, get_hazard_layer
 from safe.common.utilities import unique_filename, verify
 from utilities import REQUIRED_KEYWORDS
 from datetime import datetime
@@ -19,8 +25,23 @@ import getpass
 import logging
 LOGGER = logging.getLogger('InaSAFE')
 
+# Maximal number of bytes of each raster tile processed at a time
+# by impact functions supporting tiled execution
+TILE_SIZE = 2 ** 24
 
-def calculate_impact(layers, impact_fcn):
+# Layers and impact function of worker processes running tiles
+# (see init_tile_worker)
+TILE_WORKER = {}
+
+# Functions merging statistics of raster tiles. Missing values (NaN)
+# are ignored by min and max as for numpy.nanmin and numpy.nanmax.
+TILE_REDUCTIONS = {'sum': numpy.add,
+                   'min': numpy.fmin,
+                   'max': numpy.fmax}
+
+
+def calculate_impact(layers, impact_fcn, lazy_export=False, tiled=False,
+                     tile_size=TILE_SIZE, processes=1):
     """Calculate impact levels as a function of list of input layers
 
     Input
@@ -28,6 +49,25 @@ def calculate_impact(layers, impact_fcn):
 
         impact_fcn: Function of the form f(layers)
 
+        lazy_export: If True, the result is stored as memory mapped arrays
+                     (see safe.storage.array_store) and only written
+                     to GeoTIFF or Shapefile when its filename is first
+                     requested e.g. for saving or styling.
+                     Default is False as the QGIS plugin and realtime
+                     use the file of the result straight away. Enable it
+                     for batch runs where most results are never exported.
+
+        tiled: If True and the impact function supports it (see
+               supports_tiling), raster layers are processed in tiles
+               of rows and the result is written to GeoTIFF tile by
+               tile (see run_tiled). Otherwise this has no effect.
+               Lazy export does not apply to results written by tiles.
+
+        tile_size: Maximal number of bytes of each tile of each layer
+
+        processes: Number of worker processes running tiles in parallel
+                   (see run_tiled). None means one per CPU.
+
     Output
         filename of resulting impact layer (GML). Comment is embedded as
         metadata. Filename is generated from input data and date.
@@ -54,7 +94,12 @@ def calculate_impact(layers, impact_fcn):
     start_time = datetime.now()
 
     # Pass input layers to plugin
-    F = impact_function.run(layers)
+    tiled = tiled and supports_tiling(impact_function, layers)
+    if tiled:
+        F = run_tiled(impact_function, layers, tile_size=tile_size,
+                      processes=processes)
+    else:
+        F = impact_function.run(layers)
 
     # End time
     end_time = datetime.now()
@@ -111,9 +156,19 @@ def calculate_impact(layers, impact_fcn):
         extension = '.shp'
         # use default style for vector
 
-    output_filename = unique_filename(suffix=extension)
-    F.filename = output_filename
-    F.write_to_file(output_filename)
+    if tiled:
+        # Data has been written tile by tile so only update keywords
+        basename = os.path.splitext(F.get_filename())[0]
+        write_keywords(F.keywords, basename + '.keywords')
+    elif lazy_export:
+        store_name = unique_filename(suffix='.npys')
+        write_array_store(F, store_name)
+        F = read_array_store(store_name)
+        F.set_lazy_export(extension)
+    else:
+        output_filename = unique_filename(suffix=extension)
+        F.filename = output_filename
+        F.write_to_file(output_filename)
 
     # Establish default name (layer1 X layer1 x impact_function)
     if not F.get_name():
@@ -136,6 +191,233 @@ def calculate_impact(layers, impact_fcn):
     return F
 
 
+def supports_tiling(impact_function, layers):
+    """Check if impact function can be run tile by tile on layers
+
+    Input
+        impact_function: Instance of impact function
+        layers: List of input layers
+
+    Output
+        True if impact function declares tile_reductions (and so provides
+        run_tile and summarise_tiles, see FunctionProvider) and all
+        layers are rasters. False otherwise.
+    """
+
+    if getattr(impact_function, 'tile_reductions', None) is None:
+        return False
+
+    for layer in layers:
+        if not layer.is_raster:
+            return False
+
+    return True
+
+
+def get_tiles(rows, columns, tile_size=TILE_SIZE):
+    """Split grid into tiles of whole rows
+
+    Input
+        rows, columns: Dimensions of grid
+        tile_size: Maximal number of bytes of double precision values
+                   in each tile. Tiles have at least one row.
+
+    Output
+        List of windows (xoff, yoff, xsize, ysize) covering the grid
+        from top to bottom. See Raster.get_data.
+    """
+
+    tile_rows = max(1, tile_size // (8 * max(columns, 1)))
+    return [(0, yoff, columns, min(tile_rows, rows - yoff))
+            for yoff in range(0, rows, tile_rows)]
+
+
+def merge_tile_statistics(reductions, statistics, tile_statistics):
+    """Merge statistics of one tile into statistics of previous tiles
+
+    Input
+        reductions: Dictionary mapping names of statistics to reductions
+                    (keys of TILE_REDUCTIONS)
+        statistics: Dictionary of merged statistics of previous tiles or
+                    None for the first tile
+        tile_statistics: Dictionary of statistics of the tile. Values may
+                         be numbers or arrays of the same shape for all
+                         tiles.
+
+    Output
+        Dictionary of merged statistics
+    """
+
+    for name in reductions:
+        msg = 'Statistic %s was not returned for tile' % name
+        verify(name in tile_statistics, msg)
+
+    if statistics is None:
+        return dict((name, tile_statistics[name]) for name in reductions)
+
+    merged = {}
+    for name, reduction in reductions.items():
+        merged[name] = TILE_REDUCTIONS[reduction](statistics[name],
+                                                  tile_statistics[name])
+    return merged
+
+
+def get_tile_sources(layers):
+    """Get files from which worker processes can read tiles of layers
+
+    Input
+        layers: List of raster layers
+
+    Output
+        List of tuples (filename, name, keywords) for each layer or None
+        if any layer holds its data in memory.
+    """
+
+    sources = []
+    for layer in layers:
+        filename = getattr(layer, 'filename', None)
+        if getattr(layer, 'data', None) is not None or not filename:
+            return None
+        sources.append((filename, layer.get_name(), layer.get_keywords()))
+
+    return sources
+
+
+def init_tile_worker(impact_function, parameters, sources):
+    """Open layers and set up impact function in worker process
+
+    Input
+        impact_function: Instance of impact function
+        parameters: Parameters of impact function or None
+        sources: List of layer files as returned by get_tile_sources
+
+    Note
+        Each worker opens the files itself so tiles are read in
+        parallel and no grid data is passed between processes.
+    """
+
+    if parameters is not None:
+        impact_function.parameters = parameters
+
+    layers = []
+    for filename, name, keywords in sources:
+        layer = Raster(filename)
+        layer.set_name(name)
+        layer.keywords = keywords
+        layers.append(layer)
+
+    TILE_WORKER['impact_function'] = impact_function
+    TILE_WORKER['layers'] = layers
+
+
+def run_tile_worker(window):
+    """Run impact function on one tile in worker process
+
+    Input
+        window: Tuple (xoff, yoff, xsize, ysize) of tile
+
+    Output
+        Tuple of window, impact array and statistics of tile
+    """
+
+    impact_function = TILE_WORKER['impact_function']
+    impact, statistics = impact_function.run_tile(TILE_WORKER['layers'],
+                                                  window)
+    return window, impact, statistics
+
+
+def run_tiled(impact_function, layers, tile_size=TILE_SIZE, filename=None,
+              processes=1):
+    """Run impact function on aligned rasters tile by tile
+
+    Input
+        impact_function: Instance of impact function supporting tiled
+                         execution (see supports_tiling)
+        layers: List of aligned raster layers
+        tile_size: Maximal number of bytes of each tile of each layer
+        filename: Optional name of GeoTIFF file for the impact layer.
+                  If None a unique filename is generated.
+        processes: Number of worker processes running tiles in parallel.
+                   None means one per CPU. Tiles are run in this process
+                   if processes is 1 or any layer is held in memory.
+
+    Output
+        Impact layer as a Raster instance reading from filename
+
+    Note
+        Tiles are processed from top to bottom. The impact data of each
+        tile is written to file as soon as it is computed and statistics
+        of tiles are merged according to tile_reductions. The impact
+        function then summarises the merged statistics in the keywords,
+        style and name of the impact layer. Only one tile of each layer
+        is held in memory at a time.
+
+        With worker processes, each worker reads its own tiles from the
+        layer files. Results are collected in the order of the tiles, so
+        statistics are merged exactly as when running in this process
+        and the results are identical.
+    """
+
+    reductions = impact_function.tile_reductions
+    for name, reduction in reductions.items():
+        msg = ('Reduction %s of statistic %s must be one of %s'
+               % (reduction, name, ', '.join(sorted(TILE_REDUCTIONS))))
+        verify(reduction in TILE_REDUCTIONS, msg)
+
+    reference = get_hazard_layer(layers)
+    if filename is None:
+        filename = unique_filename(suffix='.tif')
+
+    windows = get_tiles(reference.rows, reference.columns, tile_size)
+    if processes is None:
+        processes = multiprocessing.cpu_count()
+    processes = min(processes, len(windows))
+
+    sources = get_tile_sources(layers)
+    if processes > 1 and sources is not None:
+        parameters = getattr(impact_function, 'parameters', None)
+        pool = multiprocessing.Pool(processes, init_tile_worker,
+                                    (impact_function, parameters, sources))
+        tiles = pool.imap(run_tile_worker, windows)
+    else:
+        pool = None
+        tiles = ((window,) + tuple(impact_function.run_tile(layers, window))
+                 for window in windows)
+
+    writer = BlockWriter(filename,
+                         reference.rows, reference.columns,
+                         reference.get_projection(),
+                         reference.get_geotransform())
+    try:
+        statistics = None
+        for window, impact, tile_statistics in tiles:
+            writer.write(impact, window[1], window[0])
+            statistics = merge_tile_statistics(reductions, statistics,
+                                               tile_statistics)
+    finally:
+        writer.close()
+        if pool is not None:
+            pool.terminate()
+            pool.join()
+
+    try:
+        summary = impact_function.summarise_tiles(layers, statistics)
+    except:
+        os.remove(filename)
+        raise
+
+    keywords = summary.get('keywords', {})
+    write_keywords(keywords, os.path.splitext(filename)[0] + '.keywords')
+
+    F = Raster(filename)
+    F.keywords = keywords
+    F.style_info = summary.get('style_info', {})
+    if summary.get('name'):
+        F.set_name(summary['name'])
+
+    return F
+
+
 def check_data_integrity(layer_objects):
     """Check list of layer objects
 
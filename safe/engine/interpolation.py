@@ -12,19 +12,29 @@ from safe.common.utilities import ugettext as tr
 from safe.common.numerics import ensure_numeric
 from safe.common.geodesy import Point
 from safe.common.exceptions import InaSAFEError, BoundsError
-from safe.common.polygon import (inside_polygon,
-                                 clip_lines_by_polygons, clip_grid_by_polygons)
+from safe.common.polygon import (label_points_by_polygons,
+                                 intersect_lines_with_polygons,
+                                 grid_indices_by_polygons,
+                                 grid_cells_along_lines,
+                                 polygon_intersection_areas)
 
 from safe.storage.vector import Vector, convert_polygons_to_centroids
+from safe.storage.vector import calculate_polygon_centroids
+from safe.storage.vector import calculate_polygon_areas
+from safe.storage.clipping import clip_raster_by_polygons
 from safe.storage.utilities import geometrytype2string
 from safe.storage.utilities import DEFAULT_ATTRIBUTE
+from safe.storage.utilities import DEFAULT_FRACTION_ATTRIBUTE
 from safe.storage.geometry import Polygon
+from third_party.odict import OrderedDict
 
 
 def assign_hazard_values_to_exposure_data(hazard, exposure,
                                           layer_name=None,
                                           attribute_name=None,
-                                          mode='linear'):
+                                          mode='linear',
+                                          zonal=None,
+                                          overlay=False):
     """Assign hazard values to exposure data
 
         This is the high level wrapper around interpolation functions for
@@ -60,6 +70,21 @@ def assign_hazard_values_to_exposure_data(hazard, exposure,
                  all the way down to the underlying interpolation function
                  interpolate2d (module common/interpolation2d.py)
 
+            * zonal:
+                 Raster to polygon interpolation only. If None (default)
+                 the hazard level at the centroid of each polygon is used.
+                 If 'max' or 'mean' the maximum or mean of the hazard
+                 levels at grid points inside each polygon is used.
+
+            * overlay:
+                 Polygon to polygon interpolation only. If False (default)
+                 exposure polygons are assigned the attributes of the
+                 hazard polygon containing their centroid. If True they
+                 are intersected with the hazard polygons and assigned the
+                 attributes of the hazard polygon covering most of them
+                 as well as the fraction of their area covered by hazard
+                 polygons.
+
     Returns:
             Layer representing the exposure data with hazard levels assigned.
 
@@ -91,7 +116,10 @@ def assign_hazard_values_to_exposure_data(hazard, exposure,
 
           Polygon-Line: * Not Implemented *
 
-          Polygon-Polygon: * Not Implemented *
+          Polygon-Polygon: Clip centroids of exposure polygons to hazard
+            polygons and assign polygon attributes to them or, if overlay
+            is specified, intersect exposure polygons with hazard polygons
+            and assign attributes by area
 
           Polygon-Raster: Convert raster to points, clip to polygon,
             assign values and return point data
@@ -99,9 +127,12 @@ def assign_hazard_values_to_exposure_data(hazard, exposure,
           Raster-Point: Bilinear (or constant) interpolation as currently
             implemented
 
-          Raster-Line: * Not Implemented *
+          Raster-Line: Take maximum of grid values in cells crossed by
+            each line
 
-          Raster-Polygon:  Calculate centroids and use Raster - Point algorithm
+          Raster-Polygon:  Interpolate to centroids using the Raster - Point
+            algorithm or, if zonal is specified, take maximum or mean of
+            grid points inside each polygon
 
           Raster-Raster:   Exposure raster is returned as is
 
@@ -112,13 +143,13 @@ def assign_hazard_values_to_exposure_data(hazard, exposure,
 
           Polygon-Line: N/A
 
-          Polygon-Polygon: N/A
+          Polygon-Polygon: Polygon data
 
           Polygon-Raster: Point data
 
           Raster-Point: Point data
 
-          Raster-Line: N/A
+          Raster-Line: Line data
 
           Raster-Polygon: Polygon data
 
@@ -144,14 +175,16 @@ def assign_hazard_values_to_exposure_data(hazard, exposure,
         return interpolate_raster_vector(hazard, exposure,
                                          layer_name=layer_name,
                                          attribute_name=attribute_name,
-                                         mode=mode)
+                                         mode=mode,
+                                         zonal=zonal)
     # Raster-Raster
     elif hazard.is_raster and exposure.is_raster:
         return interpolate_raster_raster(hazard, exposure)
     # Vector-Vector
     elif hazard.is_vector and exposure.is_vector:
         return interpolate_polygon_vector(hazard, exposure,
-                                          layer_name=layer_name)
+                                          layer_name=layer_name,
+                                          overlay=overlay)
     # Vector-Raster
     elif hazard.is_vector and exposure.is_raster:
         return interpolate_polygon_raster(hazard, exposure,
@@ -206,8 +239,9 @@ def check_inputs(hazard, exposure, layer_name, attribute_name):
         and attribute_name is None):
         attribute_name = exposure.get_name()
 
-    if (hazard.is_raster and exposure.is_vector and exposure.is_point_data
-        and attribute_name is None):
+    if (hazard.is_raster and exposure.is_vector and
+        (exposure.is_point_data or exposure.is_line_data) and
+        attribute_name is None):
         attribute_name = hazard.get_name()
 
     # Launder for shape files
@@ -223,23 +257,27 @@ def check_inputs(hazard, exposure, layer_name, attribute_name):
 #-------------------------------------------------------------
 def interpolate_raster_vector(source, target,
                               layer_name=None, attribute_name=None,
-                              mode='linear'):
+                              mode='linear', zonal=None):
     """Interpolate from raster layer to vector data
 
     Args:
         * source: Raster data set (grid)
-        * target: Vector data set (points or polygons)
+        * target: Vector data set (points, lines or polygons)
         * layer_name: Optional name of returned interpolated layer.
               If None the name of V is used for the returned layer.
         * attribute_name: Name for new attribute.
               If None (default) the name of R is used
+        * mode: 'linear' or 'constant' interpolation to points
+        * zonal: None, 'max' or 'mean'. Polygon data only.
+              See interpolate_raster_vector_polygons
 
     Returns:
         I: Vector data set; points located as target with values
            interpolated from source
 
     Note: If target geometry is polygon, data will be interpolated to
-    its centroids and the output is a point data set.
+    its centroids (or aggregated over each polygon if zonal is specified)
+    and the output has the polygon geometry of target.
     """
 
     # Input checks
@@ -252,22 +290,15 @@ def interpolate_raster_vector(source, target,
                                              layer_name=layer_name,
                                              attribute_name=attribute_name,
                                              mode=mode)
-    #elif target.is_line_data:
-    # TBA - issue https://github.com/AIFDR/inasafe/issues/36
-    #
+    elif target.is_line_data:
+        R = interpolate_raster_vector_lines(source, target,
+                                            layer_name=layer_name,
+                                            attribute_name=attribute_name)
     elif target.is_polygon_data:
-        # Use centroids, in case of polygons
-        P = convert_polygons_to_centroids(target)
-        R = interpolate_raster_vector_points(source, P,
-                                             layer_name=layer_name,
-                                             attribute_name=attribute_name)
-        # In case of polygon data, restore the polygon geometry
-        # Do this setting the geometry of the returned set to
-        # that of the original polygon
-        R = Vector(data=R.get_data(),
-                   projection=R.get_projection(),
-                   geometry=target.get_geometry(),
-                   name=R.get_name())
+        R = interpolate_raster_vector_polygons(source, target,
+                                               layer_name=layer_name,
+                                               attribute_name=attribute_name,
+                                               zonal=zonal)
     else:
         msg = ('Unknown datatype for raster2vector interpolation: '
                'I got %s' % str(target))
@@ -278,14 +309,17 @@ def interpolate_raster_vector(source, target,
 
 
 def interpolate_polygon_vector(source, target,
-                               layer_name=None):
+                               layer_name=None, overlay=False):
     """Interpolate from polygon vector layer to vector data
 
     Args:
         * source: Vector data set (polygon)
-        * target: Vector data set (points or polygons)  - TBA also lines
+        * target: Vector data set (points, lines or polygons)
         * layer_name: Optional name of returned interpolated layer.
               If None the name of target is used for the returned layer.
+        * overlay: Polygon data only. If True, polygons are intersected
+              rather than represented by their centroids.
+              See interpolate_polygon_polygons
 
     Output
         I: Vector data set; points located as target with values interpolated
@@ -293,7 +327,8 @@ def interpolate_polygon_vector(source, target,
 
     Note:
         If target geometry is polygon, data will be interpolated to
-        its centroids and the output is a point data set.
+        its centroids (unless overlay is True) and the output has the
+        polygon geometry of target.
     """
 
     # Input checks
@@ -307,6 +342,9 @@ def interpolate_polygon_vector(source, target,
     elif target.is_line_data:
         R = interpolate_polygon_lines(source, target,
                                       layer_name=layer_name)
+    elif target.is_polygon_data and overlay:
+        R = interpolate_polygon_polygons(source, target,
+                                         layer_name=layer_name)
     elif target.is_polygon_data:
         # Use polygon centroids
         X = convert_polygons_to_centroids(target)
@@ -355,13 +393,10 @@ def interpolate_polygon_raster(source, target,
     verify(source.is_vector)
     verify(source.is_polygon_data)
 
-    # Run underlying clipping algorithm
-    polygon_geometry = source.get_geometry(as_geometry_objects=True)
-
+    # Run underlying clipping algorithm reading only the raster blocks
+    # covered by polygons
     polygon_attributes = source.get_data()
-    res = clip_grid_by_polygons(target.get_data(scaling=False),
-                                target.get_geotransform(),
-                                polygon_geometry)
+    res = clip_raster_by_polygons(target, source, scaling=False)
 
     # Create one new point layer with interpolated attributes
     new_geometry = []
@@ -415,20 +450,60 @@ def interpolate_raster_vector_points(source, target,
     verify(target.is_vector)
     verify(target.is_point_data)
 
-    # Get raster data and corresponding x and y axes
-    A = source.get_data(nan=True)
-    longitudes, latitudes = source.get_geometry()
-    verify(len(longitudes) == A.shape[1])
-    verify(len(latitudes) == A.shape[0])
-
     # Get vector point geometry as Nx2 array
     coordinates = numpy.array(target.get_geometry(),
                               dtype='d',
                               copy=False)
+
     # Get original attributes
     attributes = target.get_data()
 
     # Create new attribute and interpolate
+    values = interpolate_raster_to_points(source, target, coordinates,
+                                          mode=mode)
+
+    # Add interpolated attribute to existing attributes and return
+    N = len(target)
+    for i in range(N):
+        attributes[i][attribute_name] = values[i]
+
+    return Vector(data=attributes,
+                  projection=target.get_projection(),
+                  geometry=coordinates,
+                  name=layer_name)
+
+
+def interpolate_raster_to_points(source, target, coordinates, mode='linear'):
+    """Interpolate raster values to array of points
+
+    Args:
+        * source: Raster data set (grid)
+        * target: Vector data set the points belong to (for messages)
+        * coordinates: Nx2 array of point coordinates
+        * mode: 'linear' or 'constant'
+
+    Returns:
+        * Array of N interpolated values
+
+    Note:
+        Only the window of the raster needed to interpolate to the points
+        is read.
+    """
+
+    # Only read the part of the raster needed to interpolate to the points
+    bbox = [numpy.nanmin(coordinates[:, 0]), numpy.nanmin(coordinates[:, 1]),
+            numpy.nanmax(coordinates[:, 0]), numpy.nanmax(coordinates[:, 1])]
+    if numpy.any(numpy.isnan(bbox)):
+        window = None
+    else:
+        window = source.get_window(bbox)
+
+    # Get raster data and corresponding x and y axes
+    A = source.get_data(nan=True, window=window)
+    longitudes, latitudes = source.get_geometry(window=window)
+    verify(len(longitudes) == A.shape[1])
+    verify(len(latitudes) == A.shape[0])
+
     try:
         values = interpolate_raster(longitudes, latitudes, A,
                                     coordinates, mode=mode)
@@ -440,17 +515,216 @@ def interpolate_raster_vector_points(source, target,
                   'error': str(e)})
         raise InaSAFEError(msg)
 
-    # Add interpolated attribute to existing attributes and return
-    N = len(target)
-    for i in range(N):
-        attributes[i][attribute_name] = values[i]
+    return values
 
-    return Vector(data=attributes,
+
+def interpolate_raster_vector_polygons(source, target,
+                                       layer_name=None,
+                                       attribute_name=None,
+                                       zonal=None):
+    """Interpolate from raster layer to polygon data
+
+    Args:
+        * source: Raster data set (grid)
+        * target: Vector data set (polygons)
+        * layer_name: Optional name of returned interpolated layer.
+              If None the name of target is used for the returned layer.
+        * attribute_name: Name for new attribute.
+              If None (default) the name of layer source is used
+        * zonal: If None (default) values are interpolated bilinearly to
+              the centroid of each polygon. If 'max' or 'mean' the maximum
+              or mean of the values at grid points inside each polygon
+              is used instead.
+
+    Output
+        I: Vector data set with geometry and attributes of target and the
+           new attribute
+
+    Note:
+        Centroids are computed for all polygons at once and the raster is
+        sampled in one call. The returned layer shares the geometry and
+        attribute columns of target rather than copying them.
+
+        In zonal mode, polygons that contain no grid points with data
+        (e.g. buildings smaller than a grid cell) get the centroid value.
+        If polygons overlap, grid points are assigned to the first one
+        only (see grid_indices_by_polygons).
+    """
+
+    msg = ('There are no data points to interpolate to. Perhaps zoom out '
+           'and try again')
+    verify(len(target) > 0, msg)
+
+    # Input checks
+    verify(source.is_raster)
+    verify(target.is_vector)
+    verify(target.is_polygon_data)
+
+    msg = ('Parameter zonal must be either None, "max" or "mean". '
+           'I got %s' % str(zonal))
+    verify(zonal in [None, 'max', 'mean'], msg)
+
+    polygons = target.get_geometry(as_geometry_objects=True)
+    N = len(polygons)
+
+    # Interpolate to centroids
+    centroids = calculate_polygon_centroids(target)
+    values = interpolate_raster_to_points(source, target, centroids)
+
+    if zonal is not None:
+        # Grid points inside each polygon
+        nx = source.columns
+        indices = grid_indices_by_polygons((source.rows, source.columns),
+                                           source.get_geotransform(),
+                                           polygons)
+        counts = numpy.array([len(idx) for idx in indices], dtype=numpy.int)
+
+        if numpy.sum(counts) > 0:
+            covered = numpy.concatenate(indices)
+            labels = numpy.repeat(numpy.arange(N), counts)
+
+            # Read window of raster covered by polygons only
+            rows = covered // nx
+            cols = covered % nx
+            xoff = numpy.min(cols)
+            yoff = numpy.min(rows)
+            window = (xoff, yoff,
+                      numpy.max(cols) - xoff + 1, numpy.max(rows) - yoff + 1)
+            A = source.get_data(nan=True, window=window)
+            grid_values = A[rows - yoff, cols - xoff]
+
+            # Ignore grid points without data
+            valid = numpy.logical_not(numpy.isnan(grid_values))
+            labels = labels[valid]
+            grid_values = grid_values[valid]
+            counts = numpy.bincount(labels, minlength=N)
+
+            if zonal == 'mean':
+                sums = numpy.bincount(labels, weights=grid_values,
+                                      minlength=N)
+                zonal_values = sums / numpy.maximum(counts, 1)
+            else:
+                # Sort by polygon then value and pick last of each polygon
+                order = numpy.lexsort((grid_values, labels))
+                last = numpy.cumsum(counts) - 1
+                zonal_values = numpy.zeros(N, dtype=numpy.float)
+                zonal_values[counts > 0] = \
+                    grid_values[order][last[counts > 0]]
+
+            values[counts > 0] = zonal_values[counts > 0]
+
+    # Add interpolated attribute as new column and return
+    columns = OrderedDict()
+    for name in target.get_attribute_names():
+        columns[name] = target.get_data(name, as_array=True)
+    columns[attribute_name] = values
+
+    return Vector(data=columns,
                   projection=target.get_projection(),
-                  geometry=coordinates,
+                  geometry=polygons,
+                  name=layer_name)
+
+
+def interpolate_raster_vector_lines(source, target,
+                                    layer_name=None,
+                                    attribute_name=None):
+    """Interpolate from raster layer to line data
+
+    Args:
+        * source: Raster data set (grid)
+        * target: Vector data set (lines)
+        * layer_name: Optional name of returned interpolated layer.
+              If None the name of target is used for the returned layer.
+        * attribute_name: Name for new attribute.
+              If None (default) the name of layer source is used
+
+    Output
+        I: Vector data set with geometry and attributes of target and the
+           new attribute holding the maximum of the grid values in the
+           cells crossed by each line. Lines crossing no cells with data
+           get NaN.
+
+    Note:
+        Use interpolate_raster_to_lines to get values and lengths for
+        each piece of the lines, e.g. to calculate the length of roads
+        flooded deeper than a threshold.
+    """
+
+    msg = ('There are no data points to interpolate to. Perhaps zoom out '
+           'and try again')
+    verify(len(target) > 0, msg)
+
+    # Input checks
+    verify(source.is_raster)
+    verify(target.is_vector)
+    verify(target.is_line_data)
+
+    N = len(target)
+    line_ids, values, _ = interpolate_raster_to_lines(source, target)
+
+    # Ignore cells without data
+    valid = numpy.logical_not(numpy.isnan(values))
+    line_ids = line_ids[valid]
+    values = values[valid]
+
+    # Sort by line then value and pick last of each line
+    order = numpy.lexsort((values, line_ids))
+    counts = numpy.bincount(line_ids, minlength=N)
+    last = numpy.cumsum(counts) - 1
+    maxima = numpy.zeros(N, dtype=numpy.float) + numpy.nan
+    maxima[counts > 0] = values[order][last[counts > 0]]
+
+    # Add interpolated attribute as new column and return
+    columns = OrderedDict()
+    for name in target.get_attribute_names():
+        columns[name] = target.get_data(name, as_array=True)
+    columns[attribute_name] = maxima
+
+    return Vector(data=columns,
+                  projection=target.get_projection(),
+                  geometry=target.get_geometry(),
+                  geometry_type='line',
                   name=layer_name)
 
 
+def interpolate_raster_to_lines(source, target):
+    """Sample raster along lines cell by cell
+
+    Args:
+        * source: Raster data set (grid)
+        * target: Vector data set (lines)
+
+    Returns:
+        * line_ids: Index of the line each piece belongs to
+        * values: Grid value (possibly NaN) in the cell of each piece
+        * lengths: Length of each piece in the units of the coordinates
+
+        Pieces are ordered by line and then along the line.
+        See grid_cells_along_lines.
+
+    Note:
+        Only the window of the raster crossed by the lines is read.
+    """
+
+    nx = source.columns
+    line_ids, indices, lengths = grid_cells_along_lines(
+        target.get_geometry(), (source.rows, source.columns),
+        source.get_geotransform())
+
+    values = numpy.zeros(len(indices), dtype=numpy.float)
+    if len(indices) > 0:
+        rows = indices // nx
+        cols = indices % nx
+        xoff = numpy.min(cols)
+        yoff = numpy.min(rows)
+        window = (xoff, yoff,
+                  numpy.max(cols) - xoff + 1, numpy.max(rows) - yoff + 1)
+        A = source.get_data(nan=True, window=window)
+        values = A[rows - yoff, cols - xoff]
+
+    return line_ids, values, lengths
+
+
 def interpolate_polygon_points(source, target,
                                layer_name=None):
     """Interpolate from polygon vector layer to point vector data
@@ -468,6 +742,8 @@ def interpolate_polygon_points(source, target,
     Note
         All attribute names from polygons are transferred to the points
         that are inside them.
+
+        If multiple polygons overlap, the one first encountered will be used.
     """
 
     msg = ('Vector layer to interpolate to must be point geometry. '
@@ -506,23 +782,24 @@ def interpolate_polygon_points(source, target,
         for key in attribute_names:
             a[key] = None
 
-    # Traverse polygons and assign attributes to points that fall inside
-    for i, polygon in enumerate(geom):
-        # Carry all attributes across from source
-        poly_attr = data[i]
-
-        # Assign default attribute to indicate points inside
+    # Assign default attribute to indicate points inside
+    for poly_attr in data:
         poly_attr[DEFAULT_ATTRIBUTE] = True
 
-        # Clip data points by polygons and add polygon attributes
-        indices = inside_polygon(points, polygon.outer_ring,
-                                 holes=polygon.inner_rings)
+    # Label each data point by the polygon it falls into
+    labels = label_points_by_polygons(points, geom)
 
-        for k in indices:
-            for key in poly_attr:
-                # Assign attributes from polygon to points
-                attributes[k][key] = poly_attr[key]
-            attributes[k]['polygon_id'] = i  # Store id for associated polygon
+    # Assign attributes from polygon to points that fall inside
+    for k, i in enumerate(labels):
+        if i < 0:
+            # Point is not inside any polygon
+            continue
+
+        # Carry all attributes across from source
+        poly_attr = data[i]
+        for key in poly_attr:
+            attributes[k][key] = poly_attr[key]
+        attributes[k]['polygon_id'] = i  # Store id for associated polygon
 
     # Create new Vector instance and return
     V = Vector(data=attributes,
@@ -532,6 +809,143 @@ def interpolate_polygon_points(source, target,
     return V
 
 
+def interpolate_polygon_polygons(source, target,
+                                 layer_name=None):
+    """Interpolate from polygon vector layer to polygon vector data
+
+    Args:
+        * source: Vector data set (polygons)
+        * target: Vector data set (polygons)
+        * layer_name: Optional name of returned interpolated layer.
+              If None the name of target is used for the returned layer.
+
+    Output
+        I: Vector data set with geometry and attributes of target
+
+    Note
+        All attribute names from source are transferred to the target
+        polygons that intersect source polygons. Values are taken from
+        the source polygon covering the largest part of each target
+        polygon. The attribute 'polygon_id' refers to that polygon.
+
+        The fraction of the area of each target polygon covered by source
+        polygons is stored in the attribute DEFAULT_FRACTION_ATTRIBUTE.
+        Overlapping source polygons are counted as many times as they
+        overlap but the fraction is at most 1. Use
+        calculate_overlay_fractions to get fractions for each value of a
+        source attribute such as a hazard category.
+    """
+
+    msg = ('Vector layer to interpolate to must be polygon geometry. '
+           'I got OGR geometry type %s'
+           % geometrytype2string(target.geometry_type))
+    verify(target.is_polygon_data, msg)
+    verify(source.is_polygon_data)
+
+    msg = ('Name must be either a string or None. I got %s'
+           % (str(type(target)))[1:-1])
+    verify(layer_name is None or
+           isinstance(layer_name, basestring), msg)
+
+    N = len(target)
+    ids, clip_ids, areas = polygon_intersection_areas(
+        target.get_geometry(as_geometry_objects=True),
+        source.get_geometry(as_geometry_objects=True))
+
+    # Fraction of each polygon covered
+    covered = numpy.bincount(ids, weights=areas, minlength=N)
+    fractions = _overlay_fractions(covered, calculate_polygon_areas(target))
+
+    # Source polygon with largest overlap is the last one of each
+    # target polygon when sorted by area (the first one in case of ties)
+    order = numpy.lexsort((-clip_ids, areas, ids))
+    counts = numpy.bincount(ids, minlength=N)
+    hit = counts > 0
+    dominant = -numpy.ones(N, dtype=numpy.int)
+    dominant[hit] = clip_ids[order][(numpy.cumsum(counts) - 1)[hit]]
+
+    # Attributes of target followed by those of source
+    columns = OrderedDict()
+    for name in target.get_attribute_names():
+        columns[name] = target.get_data(name, as_array=True)
+
+    for name in source.get_attribute_names():
+        values = numpy.empty(N, dtype=object)
+        values[hit] = source.get_data(name, as_array=True)[dominant[hit]]
+        columns[name] = values
+
+    values = numpy.empty(N, dtype=object)
+    values[hit] = dominant[hit]
+    columns['polygon_id'] = values
+
+    values = numpy.empty(N, dtype=object)
+    values[hit] = True
+    columns[DEFAULT_ATTRIBUTE] = values
+
+    columns[DEFAULT_FRACTION_ATTRIBUTE] = fractions
+
+    return Vector(data=columns,
+                  projection=target.get_projection(),
+                  geometry=target.get_geometry(as_geometry_objects=True),
+                  name=layer_name)
+
+
+def calculate_overlay_fractions(source, target, attribute_name):
+    """Calculate fractions of polygons covered by each class of polygons
+
+    Args:
+        * source: Vector data set (polygons) e.g. hazard zones
+        * target: Vector data set (polygons) e.g. buildings or land use
+        * attribute_name: Name of source attribute classifying its
+              polygons e.g. by hazard category
+
+    Returns:
+        * OrderedDict mapping each value of the attribute (in sorted order)
+          to an array with the fraction of the area of each target polygon
+          covered by source polygons with that value.
+
+    Note:
+        See interpolate_polygon_polygons
+    """
+
+    verify(source.is_polygon_data)
+    verify(target.is_polygon_data)
+
+    msg = ('Attribute %s not found in layer %s. Available attributes are %s'
+           % (attribute_name, source.get_name(),
+              source.get_attribute_names()))
+    verify(attribute_name in source.get_attribute_names(), msg)
+
+    N = len(target)
+    ids, clip_ids, areas = polygon_intersection_areas(
+        target.get_geometry(as_geometry_objects=True),
+        source.get_geometry(as_geometry_objects=True))
+    target_areas = calculate_polygon_areas(target)
+
+    categories = source.get_data(attribute_name, as_array=True)
+    result = OrderedDict()
+    for value in sorted(set(categories)):
+        mask = categories[clip_ids] == value
+        covered = numpy.bincount(ids[mask], weights=areas[mask],
+                                 minlength=N)
+        result[value] = _overlay_fractions(covered, target_areas)
+
+    return result
+
+
+def _overlay_fractions(covered, areas):
+    """Divide covered areas by polygon areas limiting results to [0, 1]
+
+    Polygons without area get fraction 0.
+    """
+
+    fractions = numpy.zeros(len(areas), dtype=numpy.float)
+    positive = areas > 0
+    fractions[positive] = covered[positive] / areas[positive]
+
+    return numpy.minimum(fractions, 1)
+
+
 def interpolate_polygon_lines(source, target,
                               layer_name=None):
     """Interpolate from polygon vector layer to line vector data
@@ -548,6 +962,12 @@ def interpolate_polygon_lines(source, target,
            line that was clipped.
 
            Lines not in any polygon are ignored.
+
+    Note:
+        Lines are clipped by all polygons at once using spatial indices
+        (see intersect_lines_with_polygons) so the work grows with the
+        number of clipped lines rather than with the number of lines
+        times the number of polygons. Holes in polygons are respected.
     """
 
     # Extract line features
@@ -558,41 +978,26 @@ def interpolate_polygon_lines(source, target,
     verify(len(line_attributes) == N)
 
     # Extract polygon features
-    polygons = source.get_geometry()
+    polygons = source.get_geometry(as_geometry_objects=True)
     polygon_attributes = source.get_data()
     verify(len(polygons) == len(polygon_attributes))
 
-    # Data structure for resulting line segments
-    #clipped_geometry = []
-    #clipped_attributes = []
-
-    # Clip line lines to polygons
-    lines_covered = clip_lines_by_polygons(lines, polygons)
+    # Clip lines to polygons. Clipped lines come ordered by polygon,
+    # then by parent line and then along the parent line.
+    polygon_ids, line_ids, new_geometry = \
+        intersect_lines_with_polygons(lines, polygons)
 
     # Create one new line data layer with joined attributes
     # from polygons and lines
-    new_geometry = []
     new_attributes = []
-    for i in range(len(polygons)):
-        # Loop over polygons
-
-        for j in lines_covered[i]:
-            # Loop over parent lines
-
-            lines = lines_covered[i][j]
-            for line in lines:
-                # Loop over lines clipped from line j by polygon i
-
-                # Associated polygon and line attributes
-                attr = polygon_attributes[i].copy()
-                attr.update(line_attributes[j].copy())
-                attr['polygon_id'] = i  # Store id for associated polygon
-                attr['parent_line_id'] = j  # Store id for parent line
-                attr[DEFAULT_ATTRIBUTE] = True
-
-                # Store new line feature
-                new_geometry.append(line)
-                new_attributes.append(attr)
+    for i, j in zip(polygon_ids.tolist(), line_ids.tolist()):
+        # Associated polygon and line attributes
+        attr = polygon_attributes[i].copy()
+        attr.update(line_attributes[j].copy())
+        attr['polygon_id'] = i  # Store id for associated polygon
+        attr['parent_line_id'] = j  # Store id for parent line
+        attr[DEFAULT_ATTRIBUTE] = True
+        new_attributes.append(attr)
 
     R = Vector(data=new_attributes,
                projection=source.get_projection(),
@@ -691,9 +1096,7 @@ def tag_polygons_by_grid(polygons, grid, threshold=0, tag='affected'):
     polygon_geometry = polygons.get_geometry(as_geometry_objects=True)
 
     # Separate grid points by polygon
-    res = clip_grid_by_polygons(grid.get_data(),
-                                grid.get_geotransform(),
-                                polygon_geometry)
+    res = clip_raster_by_polygons(grid, polygons)
 
     # Create new polygon layer with tag set according to grid values
     # and threshold
@@ -9,15 +9,20 @@ from os.path import join
 from safe.engine.core import calculate_impact
 from safe.engine.interpolation import interpolate_polygon_raster
 from safe.engine.interpolation import interpolate_raster_vector_points
+from safe.engine.interpolation import interpolate_raster_to_lines
 from safe.engine.interpolation import assign_hazard_values_to_exposure_data
 from safe.engine.interpolation import tag_polygons_by_grid
+from safe.engine.interpolation import calculate_overlay_fractions
 
 
 from safe.storage.core import read_layer
 from safe.storage.core import write_vector_data
 from safe.storage.core import write_raster_data
-from safe.storage.vector import Vector
+from safe.storage.vector import Vector, convert_polygons_to_centroids
+from safe.storage.raster import Raster
+from safe.storage.clipping import clip_raster_by_polygons
 from safe.storage.utilities import DEFAULT_ATTRIBUTE
+from safe.storage.utilities import DEFAULT_FRACTION_ATTRIBUTE
 
 from safe.common.polygon import separate_points_by_polygon
 from safe.common.polygon import is_inside_polygon, inside_polygon
@@ -294,6 +299,75 @@ class Test_Engine(unittest.TestCase):
         assert numpy.allclose(fatalities, expected_fatalities,
                               rtol=1.0e-5), msg
 
+    def test_earthquake_fatality_rates_for_continuous_mmi(self):
+        """Fatality rates can be applied to MMI of each cell
+        """
+
+        projection = read_layer(join(TESTDATA, 'test_grid.asc')).projection
+        geotransform = (106.0, 0.01, 0, -6.0, 0, -0.01)
+        x, y = numpy.meshgrid(numpy.arange(40), numpy.arange(30))
+        population = 100.0 * (x + 1)
+        E = Raster(data=population, projection=projection.get_projection(),
+                   geotransform=geotransform, name='Population',
+                   keywords={'category': 'exposure',
+                             'subcategory': 'population'})
+
+        for plugin_name in ['I T B Fatality Function',
+                            'P A G Fatality Function']:
+            IF = get_plugin(plugin_name)
+            mmi_range = IF.parameters['mmi_range']
+
+            # Rates of arrays are rates of each value
+            mmi = numpy.linspace(2, 10, 17)
+            rates = IF().fatality_rate(mmi)
+            for i, value in enumerate(mmi):
+                assert numpy.allclose(rates[i], IF().fatality_rate(value),
+                                      rtol=1.0e-12)
+
+            # Continuous and binned MMI agree on the MMI levels
+            levels = numpy.array(mmi_range, dtype=numpy.float)
+            H = Raster(data=levels[(x + y) % len(levels)],
+                       projection=projection.get_projection(),
+                       geotransform=geotransform, name='Shake',
+                       keywords={'category': 'hazard',
+                                 'subcategory': 'earthquake',
+                                 'unit': 'MMI'})
+            expected = IF().run([H, E])
+
+            impact_function = IF()
+            impact_function.parameters = dict(IF.parameters)
+            impact_function.parameters['continuous_mmi'] = True
+            impact = impact_function.run([H, E])
+            assert nanallclose(impact.get_data(), expected.get_data())
+            for key in ['exposed_per_mmi', 'fatalites_per_mmi',
+                        'displaced_per_mmi']:
+                for level in mmi_range:
+                    assert numpy.allclose(impact.get_keywords()[key][level],
+                                          expected.get_keywords()[key][level])
+
+            # Nobody is displaced in cells outside all MMI levels
+            A = levels[(x + y) % len(levels)]
+            A[:, :5] = levels[-1] + 1
+            H = Raster(data=A, projection=projection.get_projection(),
+                       geotransform=geotransform, name='Shake',
+                       keywords=H.get_keywords())
+            expected = IF().run([H, E])
+            impact = impact_function.run([H, E])
+            assert numpy.all(numpy.isnan(impact.get_data()[:, :5]))
+            assert nanallclose(impact.get_data(), expected.get_data())
+            for key in ['fatalites_per_mmi', 'displaced_per_mmi']:
+                for level in mmi_range:
+                    assert numpy.allclose(impact.get_keywords()[key][level],
+                                          expected.get_keywords()[key][level])
+
+            # Rates can be looked up in tables
+            A = 1 + (x + y) / 8.0
+            fatality, displaced = impact_function.get_rates(A)
+            impact_function.rate_table_resolution = 0.001
+            table_fatality, table_displaced = impact_function.get_rates(A)
+            assert numpy.allclose(table_fatality, fatality, rtol=1.0e-3)
+            assert numpy.mean(table_displaced == displaced) > 0.99
+
     def test_ITB_earthquake_fatality_estimation_org(self):
         """Fatalities from ground shaking can be computed correctly
            using the ITB fatality model (Test data from Hadi Ghasemi).
@@ -631,6 +705,63 @@ class Test_Engine(unittest.TestCase):
 
     test_volcano_population_evacuation_impact.slow = True
 
+    def test_tiled_impact_calculation(self):
+        """Raster impact functions give the same result tile by tile
+        """
+
+        # Flood depths and population on the same grid
+        projection = read_layer(join(TESTDATA, 'test_grid.asc')).projection
+        geotransform = (106.0, 0.01, 0, -6.0, 0, -0.01)
+        x, y = numpy.meshgrid(numpy.arange(40), numpy.arange(30))
+        depth = numpy.where(x > y, (x - y) / 10.0, 0.0)
+        depth[0, 0] = numpy.nan
+        population = 100.0 * (x + 1)
+
+        H = Raster(data=depth, projection=projection.get_projection(),
+                   geotransform=geotransform, name='Flood',
+                   keywords={'category': 'hazard',
+                             'subcategory': 'flood',
+                             'unit': 'm'})
+        E = Raster(data=population, projection=projection.get_projection(),
+                   geotransform=geotransform, name='Population',
+                   keywords={'category': 'exposure',
+                             'subcategory': 'population'})
+
+        IF = get_plugin('Flood Evacuation Function')
+        expected = calculate_impact(layers=[H, E], impact_fcn=IF)
+
+        # Tiles of 7 rows so that the last tile is smaller
+        impact = calculate_impact(layers=[H, E], impact_fcn=IF,
+                                  tiled=True, tile_size=7 * 8 * 40)
+        assert impact.get_filename().endswith('.tif')
+        assert impact.get_name() == expected.get_name()
+        assert nanallclose(impact.get_data(), expected.get_data())
+        assert impact.get_geotransform() == expected.get_geotransform()
+
+        keywords = read_layer(impact.get_filename()).get_keywords()
+        for key in ['impact_summary', 'map_title', 'hazard_title']:
+            assert keywords[key] == expected.get_keywords()[key]
+        assert (impact.get_style_info()['style_classes'] ==
+                expected.get_style_info()['style_classes'])
+
+        # Worker processes read tiles of layers from file
+        for layer in [H, E]:
+            layer.write_to_file(unique_filename(suffix='.tif'))
+        H = read_layer(H.get_filename())
+        H.set_name('Flood')
+        E = read_layer(E.get_filename())
+        E.set_name('Population')
+        impact = calculate_impact(layers=[H, E], impact_fcn=IF,
+                                  tiled=True, tile_size=7 * 8 * 40,
+                                  processes=2)
+        assert nanallclose(impact.get_data(), expected.get_data())
+        assert (impact.get_keywords()['impact_summary'] ==
+                expected.get_keywords()['impact_summary'])
+
+        # Tiling is ignored by impact functions not supporting it
+        IF = get_plugin('Volcano Polygon Hazard Population')
+        assert IF().tile_reductions is None
+
     # This one currently fails because the clipped input data has
     # different resolution to the full data. Issue #344
     #
@@ -928,6 +1059,114 @@ class Test_Engine(unittest.TestCase):
         assert data[2]['tag'] is True
         assert data[3]['tag'] is False
 
+    def test_interpolation_from_raster_to_polygons(self):
+        """Raster values are assigned to polygons directly or zonally
+        """
+
+        # Name input files
+        polygon = join(TESTDATA, 'test_polygon_on_test_grid.shp')
+        grid = join(TESTDATA, 'test_grid.asc')
+
+        G = read_layer(grid)
+        P = read_layer(polygon)
+
+        # Centroid values must be the same as interpolating to centroids
+        R = assign_hazard_values_to_exposure_data(G, P,
+                                                  attribute_name='grid')
+        assert R.is_polygon_data
+        assert len(R) == len(P)
+        assert R.get_geometry(as_geometry_objects=True) is \
+            P.get_geometry(as_geometry_objects=True)
+
+        # Original attributes are retained and target is unchanged
+        for name in P.get_attribute_names():
+            assert R.get_data(name) == P.get_data(name)
+        assert 'grid' not in P.get_attribute_names()
+
+        C = convert_polygons_to_centroids(P)
+        I = interpolate_raster_vector_points(G, C, attribute_name='grid')
+        assert nanallclose(R.get_data('grid'), I.get_data('grid'))
+
+        # Zonal statistics against grid points clipped by each polygon
+        res = clip_raster_by_polygons(G, P)
+        for zonal, fcn in [('max', numpy.max), ('mean', numpy.mean)]:
+            R = assign_hazard_values_to_exposure_data(G, P,
+                                                      attribute_name='grid',
+                                                      zonal=zonal)
+            values = R.get_data('grid')
+            for i, (_, grid_values) in enumerate(res):
+                grid_values = grid_values[numpy.logical_not(
+                    numpy.isnan(grid_values))]
+                if len(grid_values) > 0:
+                    assert numpy.allclose(values[i], fcn(grid_values))
+                else:
+                    # Polygons without grid points get centroid value
+                    assert nanallclose(values[i], I.get_data('grid', i))
+
+        # Unknown zonal mode
+        try:
+            assign_hazard_values_to_exposure_data(G, P, zonal='median')
+        except VerificationError:
+            pass
+        else:
+            msg = 'Unknown zonal mode should have raised VerificationError'
+            raise Exception(msg)
+
+    def test_interpolation_from_raster_to_lines(self):
+        """Raster values are assigned to lines cell by cell
+        """
+
+        # Grid of 6 x 5 cells with one cell without data
+        A = numpy.arange(30, dtype=numpy.float).reshape((5, 6))
+        A[2, 3] = numpy.nan
+        dx = 0.5
+        geotransform = (100.0, dx, 0, 10.0, 0, -dx)
+        projection = read_layer(join(TESTDATA, 'test_grid.asc')).projection
+        G = Raster(data=A, projection=projection.get_projection(),
+                   geotransform=geotransform)
+        longitudes, latitudes = G.get_geometry()
+
+        # Lines along rows of grid points and a diagonal line
+        lines = []
+        expected = []
+        for row, first, last in [(0, 0, 3), (2, 1, 4), (4, 2, 2)]:
+            y = latitudes[::-1][row]
+            lines.append(numpy.array([[longitudes[first], y],
+                                      [longitudes[last], y]]))
+            expected.append(numpy.nanmax(A[row, first:last + 1]))
+        diagonal = numpy.array([[longitudes[0], latitudes[0]],
+                                [longitudes[-1], latitudes[-1]]])
+        lines.append(diagonal)
+
+        L = Vector(data=[{'id': i} for i in range(len(lines))],
+                   geometry=lines,
+                   geometry_type='line',
+                   projection=G.get_projection())
+
+        I = assign_hazard_values_to_exposure_data(G, L,
+                                                  attribute_name='depth')
+        assert I.is_line_data
+        assert len(I) == len(L)
+        assert I.get_data('id') == L.get_data('id')
+        assert 'depth' not in L.get_attribute_names()
+
+        values = I.get_data('depth')
+        assert nanallclose(values[:3], expected)
+
+        # Pieces cover the lines and are sampled in the cells they cross
+        line_ids, values, lengths = interpolate_raster_to_lines(G, L)
+        for i, line in enumerate(lines):
+            length = numpy.sqrt(numpy.sum((line[1] - line[0]) ** 2))
+            assert numpy.allclose(numpy.sum(lengths[line_ids == i]), length)
+
+        # A horizontal line from grid point to grid point has half
+        # cells at its ends
+        assert numpy.allclose(lengths[line_ids == 0], [dx / 2, dx, dx,
+                                                      dx / 2])
+        assert nanallclose(values[line_ids == 0], A[0, 0:4])
+        assert numpy.allclose(lengths[line_ids == 2], 0)
+        assert nanallclose(values[line_ids == 2], A[4, 2])
+
     def test_polygon_hazard_with_holes_and_raster_exposure(self):
         """Rasters can be clipped by polygons (with holes)
 
@@ -2061,6 +2300,58 @@ class Test_Engine(unittest.TestCase):
 
     test_interpolation_from_polygons_multiple.slow = True
 
+    def test_interpolation_from_polygons_by_overlay(self):
+        """Polygons can be interpolated to polygons by area of overlap
+        """
+
+        # Name file names for hazard and exposure
+        hazard_filename = ('%s/tsunami_polygon_WGS84.shp' % TESTDATA)
+        exposure_filename = ('%s/building_Maumere.shp' % TESTDATA)
+
+        # Read input data
+        H = read_layer(hazard_filename)
+        E = read_layer(exposure_filename)
+        assert E.is_polygon_data
+
+        I = assign_hazard_values_to_exposure_data(H, E, overlay=True)
+        assert I.is_polygon_data
+        assert len(I) == len(E)
+
+        I_names = I.get_attribute_names()
+        for name in H.get_attribute_names() + E.get_attribute_names():
+            msg = 'Did not find name "%s" in %s' % (name, I_names)
+            assert name in I_names, msg
+
+        # Polygons are tagged exactly when they are partly covered
+        fractions = I.get_data(DEFAULT_FRACTION_ATTRIBUTE, as_array=True)
+        tagged = I.get_data(DEFAULT_ATTRIBUTE)
+        assert numpy.all(fractions >= 0) and numpy.all(fractions <= 1)
+        for i in range(len(I)):
+            assert (tagged[i] is True) == (fractions[i] > 0)
+
+        # Polygons whose centroid is in a hazard zone are partly covered
+        # and those fully covered by one zone agree on its category
+        C = assign_hazard_values_to_exposure_data(H, E)
+        categories = I.get_data('Category')
+        centroid_categories = C.get_data('Category')
+        centroid_tagged = C.get_data(DEFAULT_ATTRIBUTE)
+        count = 0
+        for i in range(len(I)):
+            if centroid_tagged[i]:
+                assert fractions[i] > 0
+                if numpy.allclose(fractions[i], 1):
+                    assert categories[i] == centroid_categories[i]
+                    count += 1
+        assert count > 0
+
+        # Fractions by category add up to the total fraction
+        by_category = calculate_overlay_fractions(H, E, 'Category')
+        assert 'High' in by_category and 'Very High' in by_category
+        total = numpy.sum(by_category.values(), axis=0)
+        assert numpy.allclose(numpy.minimum(total, 1), fractions)
+
+    test_interpolation_from_polygons_by_overlay.slow = True
+
     def test_interpolation_from_polygons_error_handling(self):
         """Interpolation using polygons handles input errors as expected
 
@@ -3,10 +3,33 @@ Basic plugin framework based on::
 http://martyalchin.com/2008/jan/10/simple-plugin-framework/
 """
 import os
+import logging
 
+LOGGER = logging.getLogger('InaSAFE')
+
+
+def load_plugins(lazy=True):
+    """Iterate through each plugin dir loading all plugins.
+
+    If lazy is True and the manifest of impact functions is up to date,
+    plugins are registered from it instead and their modules are only
+    imported when needed (see safe.impact_functions.manifest).
+    Otherwise all plugins are imported and the manifest is written.
+    """
+    from safe.impact_functions.core import REQUIREMENT_REGISTRY
+    from safe.impact_functions.manifest import (read_manifest,
+                                                register_manifest,
+                                                write_manifest)
+
+    # Plugin set may change so forget cached requirements
+    REQUIREMENT_REGISTRY.clear()
+
+    if lazy:
+        entries = read_manifest()
+        if entries is not None:
+            register_manifest(entries)
+            return
 
-def load_plugins():
-    """Iterate through each plugin dir loading all plugins."""
     dirname = os.path.dirname(__file__)
     # Import all the subdirectories
     for f in os.listdir(dirname):
@@ -18,6 +41,11 @@ def load_plugins():
                 # FIXME (Ole): Should we emit a warning to the log file?
                 pass
 
+    try:
+        write_manifest()
+    except (IOError, OSError), e:
+        LOGGER.debug('Could not write manifest of impact functions: %s' % e)
+
 
 load_plugins()
 
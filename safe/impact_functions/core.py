@@ -9,8 +9,9 @@ using it.
 import numpy
 import logging
 import keyword as python_keywords
-from safe.common.polygon import inside_polygon
-from safe.common.utilities import ugettext as tr
+from safe.common.polygon import (label_points_by_polygons,
+                                 labels_to_indices)
+from safe.common.utilities import ugettext as tr, verify
 from safe.common.tables import Table, TableCell, TableRow
 from utilities import pretty_string, remove_double_spaces
 from third_party.odict import OrderedDict
@@ -48,12 +49,62 @@ class FunctionProvider:
     layers           A list of layers
     result           A list of layers
     ===============  =========================
+
+    Plugins taking only aligned raster layers may also support tiled
+    execution (see safe.engine.core.run_tiled) by providing
+
+    run_tile(layers, window)
+
+    ===============  =========================
+    layers           A list of layers
+    window           Tuple (xoff, yoff, xsize, ysize) of the tile
+                     or None for the whole grid
+    result           Impact array of tile and dictionary of
+                     statistics of tile
+    ===============  =========================
+
+    summarise_tiles(layers, statistics)
+
+    ===============  =========================
+    layers           A list of layers
+    statistics       Dictionary of statistics merged over all tiles
+    result           Dictionary with name, keywords and style_info
+                     of impact layer
+    ===============  =========================
+
+    and by setting tile_reductions to a dictionary mapping the name of
+    each statistic to how it is merged: 'sum', 'min' or 'max'.
     """
     __metaclass__ = PluginMount
 
     target_field = 'DAMAGE'
     symbol_field = 'USE_MAJOR'
 
+    # Merging of statistics of tiles. None if tiling is not supported.
+    tile_reductions = None
+
+
+# Impact functions registered from the manifest whose modules may not have
+# been imported yet (see safe.impact_functions.manifest).
+# Keys are tuples of module and class name.
+LAZY_PLUGINS = OrderedDict()
+
+
+def get_all_plugins():
+    """Get list of all registered impact functions
+
+    This includes impact functions registered from the manifest which
+    have not been imported yet unless they have been imported since.
+    """
+
+    plugins = list(FunctionProvider.plugins)
+    imported = set([(p.__module__, p.__name__) for p in plugins])
+    for key, p in LAZY_PLUGINS.items():
+        if key not in imported:
+            plugins.append(p)
+
+    return plugins
+
 
 def get_function_title(func):
     """Get title for impact function
@@ -82,7 +133,7 @@ def get_plugins(name=None):
     """
 
     plugins_dict = dict([(pretty_function_name(p), p)
-                         for p in FunctionProvider.plugins])
+                         for p in get_all_plugins()])
 
     if name is None:
         return plugins_dict
@@ -90,7 +141,7 @@ def get_plugins(name=None):
     if isinstance(name, basestring):
         # Add the names
         plugins_dict.update(dict([(p.__name__, p)
-                                  for p in FunctionProvider.plugins]))
+                                  for p in get_all_plugins()]))
 
         msg = ('No plugin named "%s" was found. '
                'List of available plugins is: %s'
@@ -127,6 +178,8 @@ def unload_plugins():
     for p in FunctionProvider.plugins:
         del p
 
+    REQUIREMENT_REGISTRY.clear()
+
 
 # FIXME (Ole): Deprecate this function (see issue #392)
 def pretty_function_name(func):
@@ -196,7 +249,41 @@ def requirements_collect(func):
 def requirement_check(params, require_str, verbose=False):
     """Checks a dictionary params against the requirements defined
     in require_str. Require_str must be a valid python expression
-    and evaluate to True or False"""
+    and evaluate to True or False
+
+    Requirements are compiled once and results are remembered by
+    REQUIREMENT_REGISTRY (see class RequirementRegistry)."""
+
+    return REQUIREMENT_REGISTRY.check(params, require_str, verbose=verbose)
+
+
+# Maximal number of requirement check results remembered
+REQUIREMENT_CACHE_SIZE = 10000
+
+
+def _freeze_keywords(params):
+    """Hashable representation of keyword dictionary
+
+    Values are represented by repr as they may not be hashable
+    (e.g. lists).
+    """
+
+    return tuple(sorted([(key, repr(value))
+                         for key, value in params.items()]))
+
+
+class RequirementRegistry:
+    """Compiled plugin requirements and memo of their evaluation
+
+    Requirement expressions are collected from each plugin docstring
+    (see requirements_collect) and compiled only once. Results of checking
+    them against a keywords dictionary are remembered, so repeated queries
+    e.g. from the QGIS dock each time the selected layers change are cheap.
+
+    Note:
+        The registry is cleared by load_plugins and unload_plugins
+        as the set of plugins may change.
+    """
 
     # Some keyword should never go into the requirement check
     # FIXME (Ole): This is not the most robust way. If we get a
@@ -204,57 +291,122 @@ def requirement_check(params, require_str, verbose=False):
     # many other things separately. See issue #148
     excluded_keywords = ['impact_summary']
 
-    execstr = 'def check():\n'
-    for key in params.keys():
-        if key == '':
-            if params[''] != '':
-                # This should never happen
-                msg = ('Empty key found in requirements with '
-                       'non-empty value: %s' % params[''])
-                raise Exception(msg)
-            else:
+    def __init__(self, capacity=REQUIREMENT_CACHE_SIZE):
+        """Create empty registry
+
+        Args:
+            * capacity: Maximal number of remembered results
+        """
+
+        self.capacity = capacity
+        self.clear()
+
+    def clear(self):
+        """Forget all requirements, compiled expressions and results
+        """
+
+        self.requirements = {}
+        self.expressions = {}
+        self.results = {}
+
+    def get_requirements(self, func):
+        """Get list of requirement expressions of plugin
+
+        Same as requirements_collect but the docstring is only parsed once.
+        """
+
+        if func not in self.requirements:
+            self.requirements[func] = requirements_collect(func)
+        return list(self.requirements[func])
+
+    def get_expression(self, require_str):
+        """Get compiled requirement expression
+
+        Returns:
+            * Code object or None if the expression is not valid Python
+        """
+
+        if require_str not in self.expressions:
+            try:
+                code = compile(require_str, '<requirement>', 'eval')
+            except SyntaxError, e:
+                LOGGER.debug('Requirements header could not compiled: %s. '
+                             'Original message: %s' % (require_str, e))
+                code = None
+            self.expressions[require_str] = code
+        return self.expressions[require_str]
+
+    def check(self, params, require_str, verbose=False):
+        """Check keywords params against requirement expression
+
+        See requirement_check for details.
+        """
+
+        key = (require_str, _freeze_keywords(params))
+        if key in self.results:
+            return self.results[key]
+
+        result = self.evaluate(params, require_str, verbose=verbose)
+
+        if len(self.results) >= self.capacity:
+            self.results = {}
+        self.results[key] = result
+
+        return result
+
+    def evaluate(self, params, require_str, verbose=False):
+        """Evaluate requirement expression with keywords as variables
+
+        Returns:
+            * Value of expression or False if it could not be evaluated
+        """
+
+        namespace = {}
+        for key in params.keys():
+            if key == '':
+                if params[''] != '':
+                    # This should never happen
+                    msg = ('Empty key found in requirements with '
+                           'non-empty value: %s' % params[''])
+                    raise Exception(msg)
+                else:
+                    continue
+
+            # Check that symbol is not a Python keyword
+            if key in python_keywords.kwlist:
+                #msg = ('Error in plugin requirements'
+                #       'Must not use Python keywords as params: %s' % key)
+                return False
+
+            if key in self.excluded_keywords:
                 continue
 
-        # Check that symbol is not a Python keyword
-        if key in python_keywords.kwlist:
-            msg = ('Error in plugin requirements'
-                   'Must not use Python keywords as params: %s' % key)
-            #print msg
-            #logger.error(msg)
+            namespace[key.strip()] = params[key]
+
+        if verbose:
+            print 'Requirement %s with keywords %s' % (require_str, namespace)
+
+        code = self.get_expression(require_str)
+        if code is None:
             return False
 
-        if key in excluded_keywords:
-            continue
+        try:
+            # pylint: disable=W0123
+            return eval(code, globals(), namespace)
+            # pylint: enable=W0123
+        except NameError:
+            # This condition will happen frequently since the function
+            # is evaled against many params that are not relevant and
+            # hence correctly return False
+            pass
+        except Exception, e:
+            LOGGER.debug('Requirement %s could not be evaluated. '
+                         'Original message: %s' % (require_str, e))
 
-        if isinstance(params[key], basestring):
-            execstr += '  %s = "%s" \n' % (key.strip(), params[key])
-        else:
-            execstr += '  %s = %s \n' % (key.strip(), params[key])
-
-    execstr += '  return ' + require_str
-
-    if verbose:
-        print execstr
-    try:
-        # pylint: disable=W0122
-        exec(compile(execstr, '<string>', 'exec'))
-        # pylint: enable=W0122
-
-        # pylint: disable=E0602
-        return check()
-        # pylint: enable=E0602
-    except NameError, e:
-        # This condition will happen frequently since the function
-        # is evaled against many params that are not relevant and
-        # hence correctly return False
-        pass
-    except Exception, e:
-        msg = ('Requirements header could not compiled: %s. '
-               'Original message: %s' % (execstr, e))
-        #print msg
-        #logger.error(msg)
+        return False
 
-    return False
+
+REQUIREMENT_REGISTRY = RequirementRegistry()
 
 
 def requirements_met(requirements, params):  # , verbose=False):
@@ -290,7 +442,7 @@ def compatible_layers(func, layer_descriptors):
     """
 
     layers = []
-    requirements = requirements_collect(func)
+    requirements = REQUIREMENT_REGISTRY.get_requirements(func)
 
     for layer_name, layer_params in layer_descriptors:
         if requirements_met(requirements, layer_params):
@@ -391,6 +543,64 @@ def get_thresholds(layer):
     return thresholds
 
 
+def binned_sum(hazard, exposure, edges, right=False, classes=False):
+    """Sum exposure over bins of hazard values in a single pass
+
+    Input
+        hazard: Array of hazard values e.g. depths or MMI
+        exposure: Array of exposure values e.g. population, of the
+                  same shape as hazard. NaN's are ignored.
+        edges: Increasing sequence of N + 1 bin edges. Bin i holds hazard
+               values in [edges[i], edges[i + 1]), or in
+               (edges[i], edges[i + 1]] if right is True.
+        right: Flag selecting which bin edges are inclusive
+        classes: If True also return the bin of each hazard value
+
+    Output
+        Array of N sums of exposure values in each bin. If classes is
+        True also an array of the same shape as hazard with the bin of
+        each value. Values outside all bins (and NaN's) have bin -1.
+
+    Note
+        This replaces one comparison and one sum over the grids for
+        each bin so run time does not grow with the number of bins.
+    """
+
+    edges = numpy.array(edges, dtype=numpy.float)
+    msg = 'Bin edges must be an increasing sequence. I got %s' % str(edges)
+    verify(len(edges.shape) == 1 and len(edges) > 1, msg)
+    verify(numpy.all(edges[1:] > edges[:-1]), msg)
+
+    hazard = numpy.asarray(hazard)
+    exposure = numpy.asarray(exposure, dtype=numpy.float)
+    msg = ('Hazard and exposure arrays must have the same shape. '
+           'I got %s and %s' % (str(hazard.shape), str(exposure.shape)))
+    verify(hazard.shape == exposure.shape, msg)
+
+    # Bin of each value, from -1 below the first edge to N above the
+    # last. NaN's are sorted above all edges.
+    if right:
+        side = 'left'
+    else:
+        side = 'right'
+    bins = numpy.searchsorted(edges, hazard.ravel(), side=side) - 1
+
+    weights = exposure.ravel()
+    nans = numpy.isnan(weights)
+    if numpy.any(nans):
+        weights = numpy.where(nans, 0, weights)
+
+    N = len(edges) - 1
+    sums = numpy.bincount(bins + 1, weights=weights, minlength=N + 2)
+    sums = sums[1:N + 1]
+
+    if not classes:
+        return sums
+
+    bins[bins == N] = -1
+    return sums, bins.reshape(hazard.shape)
+
+
 def aggregate_point_data(data=None, boundaries=None,
                          attribute_name=None,
                          aggregation_function='count'):
@@ -413,6 +623,8 @@ def aggregate_point_data(data=None, boundaries=None,
         'count': Dictionary with counts of occurences of each value
         of attribute_name
 
+        If multiple polygons overlap, points are aggregated in the first
+        one encountered.
     """
 
     msg = ('Input argument "data" must be point type. I got type: %s'
@@ -431,13 +643,11 @@ def aggregate_point_data(data=None, boundaries=None,
     points = data.get_geometry()
     attributes = data.get_data()
 
-    result = []
-    #for i, polygon in enumerate(polygon_geoms):
-    for polygon in polygon_geoms:
-        indices = inside_polygon(points, polygon)
-
-        #print 'Found %i points in polygon %i' % (len(indices), i)
+    # Find the polygon each point falls into
+    labels = label_points_by_polygons(points, polygon_geoms)
 
+    result = []
+    for indices in labels_to_indices(labels, len(polygon_geoms)):
         # Aggregate numbers
         if aggregation_function == 'count':
             bins = {}
@@ -534,7 +744,7 @@ def get_admissible_plugins(keywords=None):  # , name=None):
     for f_name, func in plugin_dict.items():
 
         # Required keywords for func
-        requirelines = requirements_collect(func)
+        requirelines = REQUIREMENT_REGISTRY.get_requirements(func)
 
         # Keep impact function if requirements are met for all given keywords
         match = True
@@ -619,11 +829,11 @@ def get_plugins_as_table(dict_filter=None):
     table_body.append(header)
 
     plugins_dict = dict([(pretty_function_name(p), p)
-                         for p in FunctionProvider.plugins])
+                         for p in get_all_plugins()])
 
     not_found_value = 'N/A'
     for key, func in plugins_dict.iteritems():
-        for requirement in requirements_collect(func):
+        for requirement in REQUIREMENT_REGISTRY.get_requirements(func):
             dict_found = {'title': False,
                           'id': False,
                           'category': False,
@@ -709,13 +919,13 @@ def get_unique_values():
                    'title': set()}
 
     plugins_dict = dict([(pretty_function_name(p), p)
-                         for p in FunctionProvider.plugins])
+                         for p in get_all_plugins()])
     for key, func in plugins_dict.iteritems():
         if not is_function_enabled(func):
             continue
         dict_retval['title'].add(get_function_title(func))
         dict_retval['id'].add(key)
-        for requirement in requirements_collect(func):
+        for requirement in REQUIREMENT_REGISTRY.get_requirements(func):
             dict_req = parse_single_requirement(str(requirement))
             for key in dict_req.iterkeys():
                 if key not in atts:
@@ -750,7 +960,7 @@ def get_documentation(func):
     retval['unique_identifier'] = func
 
     plugins_dict = dict([(pretty_function_name(p), p)
-                         for p in FunctionProvider.plugins])
+                         for p in get_all_plugins()])
     if func not in plugins_dict.keys():
         return None
     else:
@@ -813,7 +1023,7 @@ def is_function_enabled(func):
     :param func:
     :return: False is disabled param is True
     """
-    for requirement in requirements_collect(func):
+    for requirement in REQUIREMENT_REGISTRY.get_requirements(func):
         dict_req = parse_single_requirement(str(requirement))
 
         # If the impact function is disabled, do not show it
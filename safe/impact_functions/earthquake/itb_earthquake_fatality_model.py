@@ -7,7 +7,8 @@ from safe.impact_functions.core import (
     FunctionProvider,
     get_hazard_layer,
     get_exposure_layer,
-    get_question)
+    get_question,
+    binned_sum)
 from safe.storage.raster import Raster
 from safe.common.utilities import (
     ugettext as tr,
@@ -73,7 +74,8 @@ class ITBFatalityFunction(FunctionProvider):
         intensity level; however the associated uncertainty for the proposed
         model is not addressed.
     4 - There are few known mistakes in developing the current model:
-        - rounding MMI values to the nearest 0.5,
+        - rounding MMI values to the nearest 0.5 (avoided with the
+          parameter continuous_mmi),
         - Implementing Finite-Fault models of candidate events, and
         - consistency between selected GMPEs with those in use by BMKG.
           These issues will be addressed by ITB team in the final report.
@@ -151,6 +153,8 @@ class ITBFatalityFunction(FunctionProvider):
         # Threshold below which layer should be transparent
         ('tolerance', 0.01),
         ('calculate_displaced_people', True),
+        # Apply fatality rates to MMI of each cell rather than of its level
+        ('continuous_mmi', False),
         ('postprocessors', OrderedDict([
             ('Gender', {'on': True}),
             ('Age', {
@@ -160,19 +164,105 @@ class ITBFatalityFunction(FunctionProvider):
                     ('adult_ratio', defaults['ADULT_RATIO']),
                     ('elder_ratio', defaults['ELDER_RATIO'])])})]))])
 
+    # Statistics of tiles (see run_tile)
+    tile_reductions = {'exposed': 'sum',
+                       'displaced': 'sum',
+                       'fatalities': 'sum',
+                       'total': 'sum',
+                       'impact_min': 'min',
+                       'impact_max': 'max'}
+
+    # Resolution in MMI of lookup tables of rates used with continuous_mmi
+    # (see get_rates). None evaluates the rate functions for each cell.
+    rate_table_resolution = None
+
+    # Range of MMI values covered by lookup tables of rates
+    rate_table_range = (0.0, 12.0)
+
+    # Lookup tables of rates and the parameters they were computed for
+    rate_tables = None
+
     def fatality_rate(self, mmi):
         """
         ITB method to compute fatality rate
-        :param mmi:
+        :param mmi: MMI value or array of MMI values
+        :returns: Fatality rate or array of fatality rates
         """
-        # As per email discussion with Ole, Trevor, Hadi, mmi < 4 will have
-        # a fatality rate of 0 - Tim
-        if mmi < 4:
-            return 0
 
         x = self.parameters['x']
         y = self.parameters['y']
-        return numpy.power(10.0, x * mmi - y)
+
+        mmi = numpy.asarray(mmi, dtype=numpy.float)
+        rate = numpy.power(10.0, x * mmi - y)
+
+        # As per email discussion with Ole, Trevor, Hadi, mmi < 4 will have
+        # a fatality rate of 0 - Tim
+        rate = numpy.where(mmi < 4, 0, rate)
+
+        if rate.ndim == 0:
+            return float(rate)
+        return rate
+
+    def displacement_rates(self, mmi):
+        """Rates of people displaced for array of MMI values
+
+        :param mmi: Array of MMI values
+
+        :returns: Array of rates of the levels in parameter
+            displacement_rate nearest to each MMI value. Values half way
+            between two levels get the rate of the lower level as when
+            counting people in each level. NaN's are kept.
+        """
+
+        displacement_rate = self.parameters['displacement_rate']
+        levels = sorted(displacement_rate.keys())
+        rates = numpy.array([displacement_rate[level] for level in levels],
+                            dtype=numpy.float)
+
+        levels = numpy.array(levels, dtype=numpy.float)
+        midpoints = (levels[1:] + levels[:-1]) / 2
+
+        mmi = numpy.asarray(mmi, dtype=numpy.float)
+        rate = rates[numpy.searchsorted(midpoints, mmi, side='left')]
+        return numpy.where(numpy.isnan(mmi), numpy.nan, rate)
+
+    def get_rates(self, mmi):
+        """Fatality and displacement rates for array of MMI values
+
+        :param mmi: Array of MMI values
+
+        :returns: Arrays of fatality rates and displacement rates
+
+        Note: If rate_table_resolution is set, the rates are looked up in
+            tables of rates at MMI values quantised to that resolution.
+            The tables are computed once for each set of parameters.
+            This is useful for rate functions that are expensive to
+            evaluate for each cell.
+        """
+
+        resolution = self.rate_table_resolution
+        if resolution is None:
+            return self.fatality_rate(mmi), self.displacement_rates(mmi)
+
+        lo, hi = self.rate_table_range
+        key = (resolution, lo, hi, repr(self.parameters))
+        if self.rate_tables is None or self.rate_tables[0] != key:
+            levels = numpy.linspace(lo, hi,
+                                    int(round((hi - lo) / resolution)) + 1)
+
+            # Last entries are for NaN's
+            tables = (numpy.append(self.fatality_rate(levels), numpy.nan),
+                      numpy.append(self.displacement_rates(levels),
+                                   numpy.nan))
+            self.rate_tables = (key, tables)
+
+        fatality_table, displacement_table = self.rate_tables[1]
+
+        index = numpy.rint((numpy.clip(mmi, lo, hi) - lo) / resolution)
+        index[numpy.isnan(index)] = len(fatality_table) - 1
+        index = index.astype(numpy.int)
+
+        return fatality_table[index], displacement_table[index]
 
     def run(self, layers):
         """Indonesian Earthquake Fatality Model
@@ -186,6 +276,32 @@ class ITBFatalityFunction(FunctionProvider):
                 my_exposure: Raster layer of population density
         """
 
+        population = get_exposure_layer(layers)
+        R, statistics = self.run_tile(layers, None)
+        summary = self.summarise_tiles(layers, statistics)
+
+        # Create raster object and return
+        L = Raster(R,
+                   projection=population.get_projection(),
+                   geotransform=population.get_geotransform(),
+                   **summary)
+
+        return L
+
+    def run_tile(self, layers, window):
+        """Displaced population and fatalities in one tile
+
+        Input:
+
+        :param layers: List of layers as for run
+
+        :param window: Tuple (xoff, yoff, xsize, ysize) of tile or None
+            for the entire grid
+
+        :returns: Array of displaced population in tile and dictionary of
+            statistics of tile (see tile_reductions)
+        """
+
         displacement_rate = self.parameters['displacement_rate']
 
         # Tolerance for transparency
@@ -195,66 +311,134 @@ class ITBFatalityFunction(FunctionProvider):
         intensity = get_hazard_layer(layers)
         population = get_exposure_layer(layers)
 
-        question = get_question(intensity.get_name(),
-                                population.get_name(),
-                                self)
-
         # Extract data grids
-        my_hazard = intensity.get_data()   # Ground Shaking
-        my_exposure = population.get_data(scaling=True)  # Population Density
+        # Single precision is ample for MMI and halves memory use
+        my_hazard = intensity.get_data(window=window,
+                                       dtype=numpy.float32)  # Ground Shaking
+        # Population Density
+        my_exposure = population.get_data(scaling=True, window=window)
 
         # Calculate population affected by each MMI level
         # FIXME (Ole): this range is 2-9. Should 10 be included?
 
         mmi_range = self.parameters['mmi_range']
-        number_of_exposed = {}
-        number_of_displaced = {}
-        number_of_fatalities = {}
-
-        # Calculate fatality rates for observed Intensity values (my_hazard
-        # based on ITB power model
-        R = numpy.zeros(my_hazard.shape)
-        for mmi in mmi_range:
-            # Identify cells where MMI is in class i and
-            # count population affected by this shake level
-            I = numpy.where(
-                (my_hazard > mmi - self.parameters['step']) * (
-                    my_hazard <= mmi + self.parameters['step']),
-                my_exposure, 0)
-
-            # Calculate expected number of fatalities per level
-            fatality_rate = self.fatality_rate(mmi)
-
-            F = fatality_rate * I
-
-            # Calculate expected number of displaced people per level
-            try:
-                D = displacement_rate[mmi] * I
-            except KeyError, e:
-                msg = 'mmi = %i, I = %s, Error msg: %s' % (mmi, str(I), str(e))
-                # noinspection PyExceptionInherit
-                raise InaSAFEError(msg)
-
-            # Adjust displaced people to disregard fatalities.
-            # Set to zero if there are more fatalities than displaced.
-            D = numpy.where(D > F, D - F, 0)
-
-            # Sum up numbers for map
-            R += D   # Displaced
-
-            # Generate text with result for this study
-            # This is what is used in the real time system exposure table
-            number_of_exposed[mmi] = numpy.nansum(I.flat)
-            number_of_displaced[mmi] = numpy.nansum(D.flat)
-            # noinspection PyUnresolvedReferences
-            number_of_fatalities[mmi] = numpy.nansum(F.flat)
+        step = self.parameters['step']
+        number_of_exposed = numpy.zeros(len(mmi_range))
+        number_of_displaced = numpy.zeros(len(mmi_range))
+        number_of_fatalities = numpy.zeros(len(mmi_range))
+
+        # Count population in bins between all bounds of the MMI levels
+        # (mmi - step, mmi + step] so that each level is a range of bins
+        lower = [mmi - step for mmi in mmi_range]
+        upper = [mmi + step for mmi in mmi_range]
+        edges = numpy.unique(lower + upper)
+        exposed, classes = binned_sum(my_hazard, my_exposure, edges,
+                                      right=True, classes=True)
+
+        if self.parameters.get('continuous_mmi', False):
+            # Apply rates to the MMI of each cell in one pass and sum
+            # fatalities and displaced people in each level
+            fatality, displaced = self.get_rates(my_hazard)
+            displaced = numpy.maximum(displaced - fatality, 0)
+
+            # Cells outside all levels count as in binned mode: Nobody
+            # is displaced or killed there. The last entry is for cells
+            # outside all bins.
+            covered = numpy.zeros(len(edges), dtype=bool)
+            for i in range(len(mmi_range)):
+                first = numpy.searchsorted(edges, lower[i])
+                last = numpy.searchsorted(edges, upper[i])
+                covered[first:last] = True
+            outside = numpy.logical_not(covered[classes])
+            fatality[outside] = 0
+            displaced[outside] = 0
+
+            F = fatality * my_exposure
+            R = displaced * my_exposure
+            fatalities = binned_sum(my_hazard, F, edges, right=True)
+            displacements = binned_sum(my_hazard, R, edges, right=True)
+
+            for i in range(len(mmi_range)):
+                first = numpy.searchsorted(edges, lower[i])
+                last = numpy.searchsorted(edges, upper[i])
+                number_of_exposed[i] = numpy.sum(exposed[first:last])
+                number_of_displaced[i] = numpy.sum(displacements[first:last])
+                number_of_fatalities[i] = numpy.sum(fatalities[first:last])
+        else:
+            # Rate of displaced people in each bin. The last entry is for
+            # cells outside all levels.
+            rates = numpy.zeros(len(edges))
+            for i, mmi in enumerate(mmi_range):
+                first = numpy.searchsorted(edges, lower[i])
+                last = numpy.searchsorted(edges, upper[i])
+
+                # Calculate fatality rates for this level based on ITB power
+                # model
+                fatality_rate = self.fatality_rate(mmi)
+
+                try:
+                    displaced_rate = displacement_rate[mmi]
+                except KeyError, e:
+                    msg = 'mmi = %i, Error msg: %s' % (mmi, str(e))
+                    # noinspection PyExceptionInherit
+                    raise InaSAFEError(msg)
+
+                # Adjust displaced people to disregard fatalities.
+                # Set to zero if there are more fatalities than displaced.
+                displaced_rate = max(displaced_rate - fatality_rate, 0)
+                rates[first:last] += displaced_rate
+
+                # Generate text with result for this study
+                # This is what is used in the real time system exposure table
+                number_of_exposed[i] = numpy.sum(exposed[first:last])
+                number_of_displaced[i] = displaced_rate * number_of_exposed[i]
+                number_of_fatalities[i] = fatality_rate * number_of_exposed[i]
+
+            # Displaced people per cell for map
+            R = rates[classes] * my_exposure
 
         # Set resulting layer to NaN when less than a threshold. This is to
         # achieve transparency (see issue #126).
         R[R < tolerance] = numpy.nan
 
+        statistics = {'exposed': number_of_exposed,
+                      'displaced': number_of_displaced,
+                      'fatalities': number_of_fatalities,
+                      'total': numpy.nansum(my_exposure.flat),
+                      'impact_min': numpy.nanmin(R),
+                      'impact_max': numpy.nanmax(R)}
+        return R, statistics
+
+    def summarise_tiles(self, layers, statistics):
+        """Impact report and style from statistics of all tiles
+
+        Input:
+
+        :param layers: List of layers as for run
+
+        :param statistics: Dictionary of statistics merged over all tiles
+
+        :returns: Dictionary with name, keywords and style_info of
+            impact layer
+        """
+
+        # Extract input layers
+        intensity = get_hazard_layer(layers)
+        population = get_exposure_layer(layers)
+
+        question = get_question(intensity.get_name(),
+                                population.get_name(),
+                                self)
+
+        # Numbers per MMI level as used in the real time system
+        mmi_range = self.parameters['mmi_range']
+        number_of_exposed = dict(zip(mmi_range, statistics['exposed']))
+        number_of_displaced = dict(zip(mmi_range, statistics['displaced']))
+        number_of_fatalities = dict(zip(mmi_range,
+                                        statistics['fatalities']))
+
         # Total statistics
-        total = int(round(numpy.nansum(my_exposure.flat) / 1000) * 1000)
+        total = int(round(statistics['total'] / 1000) * 1000)
 
         # Compute number of fatalities
         fatalities = int(round(numpy.nansum(number_of_fatalities.values())
@@ -355,7 +539,9 @@ class ITBFatalityFunction(FunctionProvider):
         impact_table = impact_summary
 
         # check for zero impact
-        if numpy.nanmax(R) == 0 == numpy.nanmin(R):
+        impact_min = statistics['impact_min']
+        impact_max = statistics['impact_max']
+        if impact_max == 0 == impact_min:
             table_body = [
                 question,
                 TableRow([tr('Fatalities'), '%s' % format_int(fatalities)],
@@ -365,7 +551,7 @@ class ITBFatalityFunction(FunctionProvider):
 
         # Create style
         colours = ['#EEFFEE', '#FFFF7F', '#E15500', '#E4001B', '#730000']
-        classes = create_classes(R.flat[:], len(colours))
+        classes = create_classes([impact_min, impact_max], len(colours))
         interval_classes = humanize_class(classes)
         style_classes = []
         for i in xrange(len(colours)):
@@ -391,22 +577,16 @@ class ITBFatalityFunction(FunctionProvider):
         legend_units = tr('(people per cell)')
         legend_title = tr('Population density')
 
-        # Create raster object and return
-        L = Raster(R,
-                   projection=population.get_projection(),
-                   geotransform=population.get_geotransform(),
-                   keywords={'impact_summary': impact_summary,
-                             'total_population': total,
-                             'total_fatalities': fatalities,
-                             'fatalites_per_mmi': number_of_fatalities,
-                             'exposed_per_mmi': number_of_exposed,
-                             'displaced_per_mmi': number_of_displaced,
-                             'impact_table': impact_table,
-                             'map_title': map_title,
-                             'legend_notes': legend_notes,
-                             'legend_units': legend_units,
-                             'legend_title': legend_title},
-                   name=tr('Estimated displaced population per cell'),
-                   style_info=style_info)
-
-        return L
+        return dict(keywords={'impact_summary': impact_summary,
+                              'total_population': total,
+                              'total_fatalities': fatalities,
+                              'fatalites_per_mmi': number_of_fatalities,
+                              'exposed_per_mmi': number_of_exposed,
+                              'displaced_per_mmi': number_of_displaced,
+                              'impact_table': impact_table,
+                              'map_title': map_title,
+                              'legend_notes': legend_notes,
+                              'legend_units': legend_units,
+                              'legend_title': legend_title},
+                    name=tr('Estimated displaced population per cell'),
+                    style_info=style_info)
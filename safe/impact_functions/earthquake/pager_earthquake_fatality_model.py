@@ -1,4 +1,3 @@
-import math
 import numpy
 
 from safe.impact_functions.earthquake.itb_earthquake_fatality_model import (
@@ -52,6 +51,7 @@ class PAGFatalityFunction(ITBFatalityFunction):
                       # Threshold below which layer should be transparent
                       tolerance=0.01,
                       calculate_displaced_people=True,
+                      continuous_mmi=False,
                       postprocessors={'Gender': {'on': True},
                                       'Age': {'on': True,
                                       'params': {
@@ -63,11 +63,20 @@ class PAGFatalityFunction(ITBFatalityFunction):
                                               defaults['ELDER_RATIO']}}})
 
     def fatality_rate(self, mmi):
-        """Pager method to compute fatality rate"""
+        """Pager method to compute fatality rate
 
-        N = math.sqrt(2 * math.pi)
+        :param mmi: MMI value or array of MMI values
+        :returns: Fatality rate or array of fatality rates
+        """
+
+        N = numpy.sqrt(2 * numpy.pi)
         THETA = self.parameters['Theta']
         BETA = self.parameters['Beta']
 
-        x = math.log(mmi / THETA) / BETA
-        return math.exp(-x * x / 2.0) / N
+        mmi = numpy.asarray(mmi, dtype=numpy.float)
+        x = numpy.log(mmi / THETA) / BETA
+        rate = numpy.exp(-x * x / 2.0) / N
+
+        if rate.ndim == 0:
+            return float(rate)
+        return rate
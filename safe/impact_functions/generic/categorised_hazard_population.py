@@ -60,6 +60,14 @@ class CategorisedHazardPopulationImpactFunction(FunctionProvider):
                     ('adult_ratio', defaults['ADULT_RATIO']),
                     ('elder_ratio', defaults['ELDER_RATIO'])])})]))])
 
+    # Statistics of tiles (see run_tile)
+    tile_reductions = {'total': 'sum',
+                       'high': 'sum',
+                       'medium': 'sum',
+                       'low': 'sum',
+                       'impact_min': 'min',
+                       'impact_max': 'max'}
+
     def run(self, layers):
         """Plugin for impact of population as derived by categorised hazard
 
@@ -75,6 +83,30 @@ class CategorisedHazardPopulationImpactFunction(FunctionProvider):
           Table with number of people in each category
         """
 
+        my_hazard = get_hazard_layer(layers)
+        M, statistics = self.run_tile(layers, None)
+        summary = self.summarise_tiles(layers, statistics)
+
+        # Create raster object and return
+        R = Raster(M,
+                   projection=my_hazard.get_projection(),
+                   geotransform=my_hazard.get_geotransform(),
+                   **summary)
+        return R
+
+    def run_tile(self, layers, window):
+        """Population exposed to each category of the hazard in one tile
+
+        Input
+          layers: List of layers as for run
+          window: Tuple (xoff, yoff, xsize, ysize) of tile or None
+              for the entire grid
+
+        Return
+          Array of population exposed to high or medium category in tile
+          and dictionary of statistics of tile (see tile_reductions)
+        """
+
         # The 3 category
         high_t = 1
         medium_t = 0.66
@@ -84,24 +116,47 @@ class CategorisedHazardPopulationImpactFunction(FunctionProvider):
         my_hazard = get_hazard_layer(layers)    # Categorised Hazard
         my_exposure = get_exposure_layer(layers)  # Population Raster
 
-        question = get_question(my_hazard.get_name(),
-                                my_exposure.get_name(),
-                                self)
-
         # Extract data as numeric arrays
-        C = my_hazard.get_data(nan=0.0)  # Category
+        C = my_hazard.get_data(nan=0.0, window=window)  # Category
 
         # Calculate impact as population exposed to each category
-        P = my_exposure.get_data(nan=0.0, scaling=True)
+        P = my_exposure.get_data(nan=0.0, scaling=True, window=window)
         H = numpy.where(C == high_t, P, 0)
         M = numpy.where(C > medium_t, P, 0)
         L = numpy.where(C < low_t, P, 0)
 
+        statistics = {'total': numpy.sum(P),
+                      'high': numpy.sum(H),
+                      'medium': numpy.sum(M),
+                      'low': numpy.sum(L),
+                      'impact_min': numpy.nanmin(M),
+                      'impact_max': numpy.nanmax(M)}
+        return M, statistics
+
+    def summarise_tiles(self, layers, statistics):
+        """Impact report and style from statistics of all tiles
+
+        Input
+          layers: List of layers as for run
+          statistics: Dictionary of statistics merged over all tiles
+
+        Return
+          Dictionary with name, keywords and style_info of impact layer
+        """
+
+        # Identify hazard and exposure layers
+        my_hazard = get_hazard_layer(layers)    # Categorised Hazard
+        my_exposure = get_exposure_layer(layers)  # Population Raster
+
+        question = get_question(my_hazard.get_name(),
+                                my_exposure.get_name(),
+                                self)
+
         # Count totals
-        total = int(numpy.sum(P))
-        high = int(numpy.sum(H))
-        medium = int(numpy.sum(M)) - int(numpy.sum(H))
-        low = int(numpy.sum(L)) - int(numpy.sum(M))
+        total = int(statistics['total'])
+        high = int(statistics['high'])
+        medium = int(statistics['medium']) - int(statistics['high'])
+        low = int(statistics['low']) - int(statistics['medium'])
         total_impact = high + medium + low
 
         # Don't show digits less than a 1000
@@ -140,8 +195,8 @@ class CategorisedHazardPopulationImpactFunction(FunctionProvider):
         # 8 is the number of classes in the predefined flood population style
         # as imported
         # noinspection PyTypeChecker
-        classes = numpy.linspace(numpy.nanmin(M.flat[:]),
-                                 numpy.nanmax(M.flat[:]), 8)
+        classes = numpy.linspace(statistics['impact_min'],
+                                 statistics['impact_max'], 8)
 
         # Modify labels in existing flood style to show quantities
         style_classes = style_info['style_classes']
@@ -152,13 +207,8 @@ class CategorisedHazardPopulationImpactFunction(FunctionProvider):
 
         style_info['legend_title'] = tr('Population Density')
 
-        # Create raster object and return
-        R = Raster(M,
-                   projection=my_hazard.get_projection(),
-                   geotransform=my_hazard.get_geotransform(),
-                   name=tr('Population which %s') % get_function_title(self),
-                   keywords={'impact_summary': impact_summary,
-                             'impact_table': impact_table,
-                             'map_title': map_title},
-                   style_info=style_info)
-        return R
+        return dict(name=tr('Population which %s') % get_function_title(self),
+                    keywords={'impact_summary': impact_summary,
+                              'impact_table': impact_table,
+                              'map_title': map_title},
+                    style_info=style_info)
@@ -5,7 +5,8 @@ from safe.impact_functions.core import (
     get_hazard_layer,
     get_exposure_layer,
     get_question,
-    get_function_title)
+    get_function_title,
+    binned_sum)
 from safe.storage.raster import Raster
 from safe.common.utilities import (
     ugettext as tr,
@@ -92,6 +93,12 @@ class FloodEvacuationFunction(FunctionProvider):
             ('Toilets', 0.05)]))
     ])
 
+    # Statistics of tiles (see run_tile)
+    tile_reductions = {'counts': 'sum',
+                       'total': 'sum',
+                       'impact_min': 'min',
+                       'impact_max': 'max'}
+
     def run(self, layers):
         """Risk plugin for flood population evacuation
 
@@ -109,14 +116,35 @@ class FloodEvacuationFunction(FunctionProvider):
           Table with number of people evacuated and supplies required
         """
 
+        my_hazard = get_hazard_layer(layers)
+        my_impact, statistics = self.run_tile(layers, None)
+        summary = self.summarise_tiles(layers, statistics)
+
+        # Create raster object and return
+        R = Raster(my_impact,
+                   projection=my_hazard.get_projection(),
+                   geotransform=my_hazard.get_geotransform(),
+                   **summary)
+        return R
+
+    def run_tile(self, layers, window):
+        """Population exposed to flood levels in one tile
+
+        Input
+          layers: List of layers as for run
+          window: Tuple (xoff, yoff, xsize, ysize) of tile or None
+              for the entire grid
+
+        Return
+          Array of population exposed to flood levels exceeding the
+          largest threshold in tile and dictionary of statistics of tile
+          (see tile_reductions)
+        """
+
         # Identify hazard and exposure layers
         my_hazard = get_hazard_layer(layers)  # Flood inundation [m]
         my_exposure = get_exposure_layer(layers)
 
-        question = get_question(my_hazard.get_name(),
-                                my_exposure.get_name(),
-                                self)
-
         # Determine depths above which people are regarded affected [m]
         # Use thresholds from inundation layer if specified
         thresholds = self.parameters['thresholds [m]']
@@ -124,35 +152,57 @@ class FloodEvacuationFunction(FunctionProvider):
         verify(isinstance(thresholds, list),
                'Expected thresholds to be a list. Got %s' % str(thresholds))
 
-        # Extract data as numeric arrays
-        D = my_hazard.get_data(nan=0.0)  # Depth
+        # Extract data as numeric arrays. Depths are only compared
+        # with thresholds so single precision is enough.
+        D = my_hazard.get_data(nan=0.0, window=window,
+                               dtype=numpy.float32)  # Depth
 
         # Calculate impact as population exposed to depths > max threshold
-        P = my_exposure.get_data(nan=0.0, scaling=True)
-
-        # Calculate impact to intermediate thresholds
-        counts = []
-        # merely initialize
-        my_impact = None
-        for i, lo in enumerate(thresholds):
-            if i == len(thresholds) - 1:
-                # The last threshold
-                my_impact = M = numpy.where(D >= lo, P, 0)
-            else:
-                # Intermediate thresholds
-                hi = thresholds[i + 1]
-                M = numpy.where((D >= lo) * (D < hi), P, 0)
+        P = my_exposure.get_data(nan=0.0, scaling=True, window=window)
+
+        # Count population between consecutive thresholds and above
+        # the last one
+        edges = thresholds + [numpy.inf]
+        counts, classes = binned_sum(D, P, edges, classes=True)
+
+        # Impact is population in the bin above the last threshold
+        my_impact = numpy.where(classes == len(thresholds) - 1, P, 0)
 
-            # Count
-            val = int(numpy.sum(M))
+        statistics = {'counts': counts,
+                      'total': numpy.sum(P),
+                      'impact_min': numpy.nanmin(my_impact),
+                      'impact_max': numpy.nanmax(my_impact)}
+        return my_impact, statistics
 
-            # Don't show digits less than a 1000
-            val = round_thousand(val)
-            counts.append(val)
+    def summarise_tiles(self, layers, statistics):
+        """Impact report and style from statistics of all tiles
+
+        Input
+          layers: List of layers as for run
+          statistics: Dictionary of statistics merged over all tiles
+
+        Return
+          Dictionary with name, keywords and style_info of impact layer
+        """
+
+        # Identify hazard and exposure layers
+        my_hazard = get_hazard_layer(layers)  # Flood inundation [m]
+        my_exposure = get_exposure_layer(layers)
+
+        question = get_question(my_hazard.get_name(),
+                                my_exposure.get_name(),
+                                self)
+
+        # Determine depths above which people are regarded affected [m]
+        # Use thresholds from inundation layer if specified
+        thresholds = self.parameters['thresholds [m]']
+
+        # Don't show digits less than a 1000
+        counts = [round_thousand(int(val)) for val in statistics['counts']]
 
         # Count totals
         evacuated = counts[-1]
-        total = int(numpy.sum(P))
+        total = int(statistics['total'])
         # Don't show digits less than a 1000
         total = round_thousand(total)
 
@@ -223,7 +273,9 @@ class FloodEvacuationFunction(FunctionProvider):
         impact_table = impact_summary
 
         # check for zero impact
-        if numpy.nanmax(my_impact) == 0 == numpy.nanmin(my_impact):
+        impact_min = statistics['impact_min']
+        impact_max = statistics['impact_max']
+        if impact_max == 0 == impact_min:
             table_body = [
                 question,
                 TableRow([(tr('People in %.1f m of water') % thresholds[-1]),
@@ -235,7 +287,7 @@ class FloodEvacuationFunction(FunctionProvider):
         # Create style
         colours = ['#FFFFFF', '#38A800', '#79C900', '#CEED00',
                    '#FFCC00', '#FF6600', '#FF0000', '#7A0000']
-        classes = create_classes(my_impact.flat[:], len(colours))
+        classes = create_classes([impact_min, impact_max], len(colours))
         interval_classes = humanize_class(classes)
         style_classes = []
 
@@ -270,16 +322,11 @@ class FloodEvacuationFunction(FunctionProvider):
         legend_units = tr('(people per cell)')
         legend_title = tr('Population density')
 
-        # Create raster object and return
-        R = Raster(my_impact,
-                   projection=my_hazard.get_projection(),
-                   geotransform=my_hazard.get_geotransform(),
-                   name=tr('Population which %s') % get_function_title(self),
-                   keywords={'impact_summary': impact_summary,
-                             'impact_table': impact_table,
-                             'map_title': map_title,
-                             'legend_notes': legend_notes,
-                             'legend_units': legend_units,
-                             'legend_title': legend_title},
-                   style_info=style_info)
-        return R
+        return dict(name=tr('Population which %s') % get_function_title(self),
+                    keywords={'impact_summary': impact_summary,
+                              'impact_table': impact_table,
+                              'map_title': map_title,
+                              'legend_notes': legend_notes,
+                              'legend_units': legend_units,
+                              'legend_title': legend_title},
+                    style_info=style_info)
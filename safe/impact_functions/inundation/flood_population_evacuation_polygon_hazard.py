@@ -198,7 +198,10 @@ class FloodEvacuationFunctionVectorHazard(FunctionProvider):
                      self.parameters['evacuation_percentage']
                      / 100.0)
 
-        total = int(numpy.sum(my_exposure.get_data(nan=0, scaling=False)))
+        # Read population in single precision but sum in double
+        population = my_exposure.get_data(nan=0, scaling=False,
+                                          dtype=numpy.float32)
+        total = int(numpy.sum(population, dtype=numpy.float64))
 
         # Don't show digits less than a 1000
         total = round_thousand(total)
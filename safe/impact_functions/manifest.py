@@ -0,0 +1,274 @@
+"""Manifest of impact functions for lazy plugin loading
+
+Importing every impact function module (and everything they import) is
+slow. The manifest records what is needed to discover impact functions
+and check their requirements: Name, module, docstring and descriptive
+attributes such as title and synopsis. When it is up to date,
+load_plugins registers a LazyFunctionProvider for each impact function
+and its module is only imported when the function is actually run.
+
+The manifest is invalidated by modification times of the source files
+of the impact functions and by the language setting (as titles are
+translated when modules are imported).
+
+Parameters are not recorded. Their defaults are taken from the settings
+(see get_defaults) when the module is imported and may have changed
+since the manifest was written.
+"""
+
+import os
+import sys
+import cPickle as pickle
+import logging
+
+from safe.common.utilities import temp_dir
+from safe.impact_functions.core import FunctionProvider, LAZY_PLUGINS
+
+LOGGER = logging.getLogger('InaSAFE')
+
+# Version of manifest layout
+MANIFEST_VERSION = 2
+
+# Name of manifest file in temporary plugin directory
+MANIFEST_FILENAME = 'impact_functions_manifest.pickle'
+
+# Attributes of impact functions recorded in manifest
+# Parameters are left out as they depend on the current settings
+MANIFEST_ATTRIBUTES = ['title', 'plugin_name', 'synopsis', 'actions',
+                       'citations', 'detailed_description',
+                       'hazard_input', 'exposure_input', 'output',
+                       'limitation']
+
+
+class LazyFunctionProvider(object):
+    """Stand-in for impact function which has not been imported yet
+
+    Args:
+        * entry: Dictionary describing impact function as recorded
+            in the manifest (see get_manifest_entry)
+
+    Note:
+        Name, docstring and the manifest attributes are served from the
+        manifest. Calling the object, or using any other attribute,
+        imports the module of the impact function and delegates to it.
+        This includes parameters, as their defaults depend on settings.
+        Assigning attributes (e.g. parameters) also sets them on the
+        impact function.
+
+        This is a new style class so that special methods
+        (e.g. for hashing) do not trigger the import.
+    """
+
+    def __init__(self, entry):
+        self.__dict__['__name__'] = entry['name']
+        self.__dict__['__module__'] = entry['module']
+        self.__dict__['__doc__'] = entry['doc']
+        self.__dict__['attributes'] = entry['attributes']
+        self.__dict__['deferred'] = entry['deferred']
+        self.__dict__['function'] = None
+
+    def __repr__(self):
+        return '<Lazy impact function %s.%s>' % (self.__module__,
+                                                 self.__name__)
+
+    def is_loaded(self):
+        """True if module of impact function has been imported
+        """
+
+        return self.function is not None
+
+    def load(self):
+        """Import module of impact function
+
+        Returns:
+            * Class of impact function
+        """
+
+        if self.function is None:
+            __import__(self.__module__)
+            module = sys.modules[self.__module__]
+            self.__dict__['function'] = getattr(module, self.__name__)
+        return self.function
+
+    def __call__(self, *args, **kwargs):
+        """Instantiate impact function
+        """
+
+        return self.load()(*args, **kwargs)
+
+    def __getattr__(self, name):
+        if self.function is None:
+            if name in self.attributes:
+                return self.attributes[name]
+            elif name in MANIFEST_ATTRIBUTES and name not in self.deferred:
+                # Impact function does not have this attribute
+                raise AttributeError(name)
+
+        return getattr(self.load(), name)
+
+    def __setattr__(self, name, value):
+        setattr(self.load(), name, value)
+
+
+def get_source_files():
+    """Get modification times of source files of impact functions
+
+    Returns:
+        * Dictionary of file names (relative to this package) and
+          their modification times
+    """
+
+    dirname = os.path.dirname(os.path.abspath(__file__))
+    files = {}
+    for root, _, filenames in os.walk(dirname):
+        for filename in filenames:
+            if filename.endswith('.py'):
+                path = os.path.join(root, filename)
+                files[os.path.relpath(path, dirname)] = \
+                    os.path.getmtime(path)
+    return files
+
+
+def get_manifest_filename():
+    """Get default name of manifest file
+    """
+
+    return os.path.join(temp_dir('plugins'), MANIFEST_FILENAME)
+
+
+def get_manifest_entry(func):
+    """Describe impact function for manifest
+
+    Args:
+        * func: Impact function class
+
+    Returns:
+        * Dictionary with name, module, docstring, attributes and
+          deferred. Attributes is a dictionary of those of
+          MANIFEST_ATTRIBUTES that func has. Deferred lists attributes
+          that could not be recorded and must be taken from func itself.
+    """
+
+    attributes = {}
+    deferred = []
+    for name in MANIFEST_ATTRIBUTES:
+        if hasattr(func, name):
+            value = getattr(func, name)
+            try:
+                pickle.dumps(value, pickle.HIGHEST_PROTOCOL)
+            except Exception:
+                deferred.append(name)
+            else:
+                attributes[name] = value
+
+    return {'name': func.__name__,
+            'module': func.__module__,
+            'doc': func.__doc__,
+            'attributes': attributes,
+            'deferred': deferred}
+
+
+def is_packaged_plugin(func):
+    """True if impact function lives in a subpackage of impact_functions
+
+    Only such impact functions are imported by load_plugins and can be
+    recorded in the manifest.
+    """
+
+    parts = func.__module__.split('.')
+    return len(parts) == 4 and parts[:2] == ['safe', 'impact_functions']
+
+
+def write_manifest(filename=None):
+    """Write manifest of all packaged impact functions imported so far
+
+    Args:
+        * filename: Optional name of manifest file.
+            Default is given by get_manifest_filename.
+    """
+
+    if filename is None:
+        filename = get_manifest_filename()
+
+    entries = []
+    for func in FunctionProvider.plugins:
+        if is_packaged_plugin(func):
+            entries.append(get_manifest_entry(func))
+
+    manifest = {'version': MANIFEST_VERSION,
+                'lang': os.environ.get('LANG'),
+                'files': get_source_files(),
+                'plugins': entries}
+
+    # Write to temporary file first so that readers never see
+    # a partially written manifest
+    tmp_filename = '%s.%i' % (filename, os.getpid())
+    fid = open(tmp_filename, 'wb')
+    try:
+        pickle.dump(manifest, fid, pickle.HIGHEST_PROTOCOL)
+    finally:
+        fid.close()
+
+    if os.path.exists(filename):
+        # Rename does not overwrite on Windows
+        os.remove(filename)
+    os.rename(tmp_filename, filename)
+
+
+def read_manifest(filename=None):
+    """Read manifest if it is up to date
+
+    Args:
+        * filename: Optional name of manifest file.
+            Default is given by get_manifest_filename.
+
+    Returns:
+        * List of manifest entries (see get_manifest_entry) or None if
+          the manifest does not exist or is out of date.
+    """
+
+    if filename is None:
+        filename = get_manifest_filename()
+
+    if not os.path.isfile(filename):
+        return None
+
+    # Only trust manifests written by ourselves
+    if hasattr(os, 'getuid') and os.stat(filename).st_uid != os.getuid():
+        LOGGER.debug('Ignoring manifest %s owned by another user'
+                     % filename)
+        return None
+
+    fid = open(filename, 'rb')
+    try:
+        manifest = pickle.load(fid)
+    except Exception, e:
+        LOGGER.debug('Could not read manifest %s: %s' % (filename, e))
+        return None
+    finally:
+        fid.close()
+
+    if (not isinstance(manifest, dict) or
+            manifest.get('version') != MANIFEST_VERSION or
+            manifest.get('lang') != os.environ.get('LANG') or
+            manifest.get('files') != get_source_files()):
+        return None
+
+    return manifest['plugins']
+
+
+def register_manifest(entries):
+    """Register impact functions from manifest without importing them
+
+    Args:
+        * entries: List of manifest entries as returned by read_manifest
+
+    Note:
+        Impact functions that are already registered keep their
+        LazyFunctionProvider so it remains a valid dictionary key.
+    """
+
+    for entry in entries:
+        key = (entry['module'], entry['name'])
+        if key not in LAZY_PLUGINS:
+            LAZY_PLUGINS[key] = LazyFunctionProvider(entry)
@@ -1,18 +1,26 @@
 import unittest
 import logging
 import os
+import numpy
 
 from core import FunctionProvider
 from core import requirements_collect
 from core import requirement_check
 from core import requirements_met
+from core import RequirementRegistry, REQUIREMENT_REGISTRY
+from core import unload_plugins
+from core import get_plugins, LAZY_PLUGINS
+from manifest import LazyFunctionProvider, get_manifest_entry
+from manifest import read_manifest, write_manifest, is_packaged_plugin
 from core import get_admissible_plugins
 from core import get_function_title
 from core import get_plugins_as_table
 from core import parse_single_requirement
 from core import get_documentation
+from core import binned_sum
 from utilities import pretty_string
-from safe.common.utilities import format_int
+from safe.common.utilities import format_int, unique_filename
+from safe.common.utilities import VerificationError
 # from safe.impact_functions.core import get_dict_doc_func
 
 LOGGER = logging.getLogger('InaSAFE')
@@ -159,6 +167,122 @@ class Test_plugin_core(unittest.TestCase):
         msg = 'Reserved keyword in statement (logged)'
         assert not requirement_check(params, line), msg
 
+    def test_requirement_registry(self):
+        """Requirements are compiled once and results remembered
+        """
+
+        registry = RequirementRegistry()
+        requirelines = registry.get_requirements(F4)
+        assert requirelines == requirements_collect(F4)
+        assert F4 in registry.requirements
+
+        params = {'category': 'hazard', 'subcategory': 'flood',
+                  'title': 'Quoted "title"', 'impact_summary': 'None'}
+        assert registry.check(params, requirelines[0]) is True
+        assert registry.check(params, requirelines[1]) is False
+        assert len(registry.expressions) == 2
+        assert len(registry.results) == 2
+
+        # Same keywords in different order are remembered
+        same_params = dict(reversed(params.items()))
+        assert registry.check(same_params, requirelines[0]) is True
+        assert len(registry.results) == 2
+
+        # Malformed and irrelevant requirements are false
+        assert registry.check(params, "unit='MMI'") is False
+        assert registry.get_expression("unit='MMI'") is None
+        assert registry.check(params, "unit=='MMI'") is False
+        assert registry.check({'class': 'myclass'}, "unit=='MMI'") is False
+
+        # Results agree with the registry of the module
+        for line in requirelines:
+            assert (registry.check(params, line) ==
+                    requirement_check(params, line))
+
+        # Results are forgotten when capacity is exceeded
+        registry = RequirementRegistry(capacity=2)
+        for category in ['hazard', 'exposure', 'test_cat1']:
+            registry.check({'category': category}, requirelines[0])
+        assert len(registry.results) == 1
+
+        registry.clear()
+        assert len(registry.requirements) == 0
+        assert len(registry.results) == 0
+
+        # Registry of module is cleared when plugins are unloaded
+        get_admissible_plugins([{'category': 'hazard'}])
+        assert len(REQUIREMENT_REGISTRY.requirements) > 0
+        unload_plugins()
+        assert len(REQUIREMENT_REGISTRY.requirements) == 0
+        assert len(REQUIREMENT_REGISTRY.results) == 0
+
+    def test_manifest(self):
+        """Manifest of impact functions is written and invalidated
+        """
+
+        filename = unique_filename(suffix='.pickle')
+        write_manifest(filename)
+        entries = read_manifest(filename)
+        assert entries is not None
+
+        names = [entry['name'] for entry in entries]
+        for func in FunctionProvider.plugins:
+            if is_packaged_plugin(func):
+                assert func.__name__ in names
+            else:
+                assert func.__name__ not in names
+
+        # Manifest is out of date if the language changes
+        lang = os.environ.get('LANG')
+        os.environ['LANG'] = 'xx'
+        try:
+            assert read_manifest(filename) is None
+        finally:
+            if lang is None:
+                del os.environ['LANG']
+            else:
+                os.environ['LANG'] = lang
+        assert read_manifest(filename) is not None
+
+        os.remove(filename)
+        assert read_manifest(filename) is None
+
+    def test_lazy_plugins(self):
+        """Impact functions from manifest are imported only when needed
+        """
+
+        P = LazyFunctionProvider(get_manifest_entry(F1))
+        assert not P.is_loaded()
+
+        # Discovery works from the manifest
+        assert P.__name__ == 'F1'
+        assert P.__doc__ == F1.__doc__
+        assert get_function_title(P) == 'Title for F1'
+        assert requirements_collect(P) == requirements_collect(F1)
+        params = dict(category='test_cat1', subcategory='flood',
+                      layertype='raster', unit='m')
+        assert requirements_met(requirements_collect(P), params)
+        assert not hasattr(P, 'plugin_name')
+        assert not P.is_loaded()
+
+        # Parameters depend on settings and are never taken from manifest
+        assert 'parameters' not in get_manifest_entry(F1)['attributes']
+        assert not P.is_loaded()
+
+        # Other attributes and calls use the impact function
+        assert P.target_field == F1.target_field
+        assert P.is_loaded()
+        assert isinstance(P(), F1)
+
+        # Impact functions imported since registration are used directly
+        entry = get_manifest_entry(F1)
+        key = (entry['module'], entry['name'])
+        LAZY_PLUGINS[key] = LazyFunctionProvider(entry)
+        try:
+            assert get_plugins()['F1'] is F1
+        finally:
+            del LAZY_PLUGINS[key]
+
     def test_filtering_of_impact_functions(self):
         """Impact functions are filtered correctly
         """
@@ -243,6 +367,44 @@ class Test_plugin_core(unittest.TestCase):
             print key + ':\t' + str(value)
         assert dict_doc['title'] == 'Basic Function', myMsg
 
+    def test_binned_sum(self):
+        """Exposure is summed over bins of hazard values
+        """
+
+        hazard = numpy.array([[0.5, 1.0, 1.5],
+                              [2.0, numpy.nan, 3.0]])
+        exposure = numpy.array([[1, 2, 4],
+                                [8, 16, numpy.nan]])
+
+        # Bins [1, 2) and [2, 3)
+        sums, classes = binned_sum(hazard, exposure, [1, 2, 3],
+                                   classes=True)
+        assert numpy.allclose(sums, [6, 8])
+        assert numpy.all(classes == [[-1, 0, 0], [1, -1, -1]])
+
+        # Bins (1, 2] and (2, 3]. NaN exposure is ignored.
+        sums, classes = binned_sum(hazard, exposure, [1, 2, 3],
+                                   right=True, classes=True)
+        assert numpy.allclose(sums, [12, 0])
+        assert numpy.all(classes == [[-1, -1, 0], [0, -1, 1]])
+
+        # Same as one sum per bin
+        hazard = numpy.random.random((20, 30)) * 10
+        exposure = numpy.random.random((20, 30))
+        edges = [0.5, 2.5, 3.0, 7.5, numpy.inf]
+        sums = binned_sum(hazard, exposure, edges)
+        for i, lo in enumerate(edges[:-1]):
+            hi = edges[i + 1]
+            expected = numpy.sum(numpy.where((hazard >= lo) * (hazard < hi),
+                                             exposure, 0))
+            assert numpy.allclose(sums[i], expected)
+
+        # Edges must increase and arrays must agree
+        self.assertRaises(VerificationError, binned_sum,
+                          hazard, exposure, [2, 1])
+        self.assertRaises(VerificationError, binned_sum,
+                          hazard, exposure[:10], edges)
+
     def test_format_int(self):
         """Test formatting integer
         """
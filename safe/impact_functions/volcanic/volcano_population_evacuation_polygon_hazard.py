@@ -166,7 +166,9 @@ class VolcanoPolygonHazardPopulation(FunctionProvider):
             categories[cat] += pop
 
         # Count totals
-        total = int(numpy.sum(my_exposure.get_data(nan=0)))
+        # Read population in single precision but sum in double
+        population = my_exposure.get_data(nan=0, dtype=numpy.float32)
+        total = int(numpy.sum(population, dtype=numpy.float64))
 
         # Don't show digits less than a 1000
         total = round_thousand(total)
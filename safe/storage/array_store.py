@@ -0,0 +1,244 @@
+"""Memory mapped storage of raster and vector layers
+
+A layer is stored in a directory (conventionally with extension .npys)
+holding one .npy file for each array of the layer and a small JSON
+header with its metadata. Arrays are memory mapped when the store is
+opened so no data is copied until it is actually used.
+
+This is meant for intermediate results such as impact layers which may
+never need to be exported to GeoTIFF or Shapefile.
+"""
+
+import os
+import json
+import numpy
+
+from vector import Vector
+from raster import Raster
+from geometry import PolygonArray
+from safe.common.utilities import verify
+from safe.common.exceptions import ReadLayerError, WriteLayerError
+from third_party.odict import OrderedDict
+
+# Name of JSON header inside store directory
+HEADER_FILENAME = 'header.json'
+
+# Version of store layout
+STORE_VERSION = 1
+
+
+def _to_json(value):
+    """Convert numpy values that json does not know about
+    """
+
+    if isinstance(value, numpy.ndarray):
+        return value.tolist()
+    elif isinstance(value, numpy.generic):
+        return value.item()
+    else:
+        raise TypeError('Value %s of type %s is not JSON serializable'
+                        % (value, type(value)))
+
+
+def _from_json(value):
+    """Convert unicode strings in value returned by json to str
+    """
+
+    if isinstance(value, unicode):
+        return value.encode('utf-8')
+    elif isinstance(value, list):
+        return [_from_json(x) for x in value]
+    elif isinstance(value, dict):
+        D = {}
+        for key in value:
+            D[_from_json(key)] = _from_json(value[key])
+        return D
+    else:
+        return value
+
+
+def _save_array(dirname, name, A):
+    """Save array to store and return name of file relative to store
+    """
+
+    filename = '%s.npy' % name
+    numpy.save(os.path.join(dirname, filename), numpy.ascontiguousarray(A))
+    return filename
+
+
+def _load_array(dirname, filename, mmap_mode):
+    """Open array from store
+    """
+
+    return numpy.load(os.path.join(dirname, filename), mmap_mode=mmap_mode)
+
+
+def write_array_store(layer, dirname):
+    """Write layer to memory mappable array store
+
+    Args:
+        * layer: Raster or Vector layer
+        * dirname: Name of store directory. It will be created if it
+            does not exist.
+
+    Note:
+        Raster data is saved as one array with its nodata value.
+        Vector geometries are saved as packed coordinate and offset
+        arrays and numeric attributes as one array each. Other
+        attributes (e.g. strings) are kept in the JSON header.
+    """
+
+    if not os.path.isdir(dirname):
+        os.makedirs(dirname)
+
+    header = {'version': STORE_VERSION,
+              'name': layer.get_name(),
+              'projection': layer.get_projection(),
+              'keywords': layer.get_keywords(),
+              'style_info': layer.get_style_info()}
+
+    if layer.is_raster:
+        header['type'] = 'raster'
+        header['geotransform'] = list(layer.get_geotransform())
+        header['nodata'] = float(layer.get_nodata_value())
+        A = layer.get_data(nan=False, scaling=False)
+        header['data'] = _save_array(dirname, 'data', A)
+    elif layer.is_vector:
+        header['type'] = 'vector'
+        header['geometry_type'] = layer.geometry_type
+
+        geometry = {}
+        if layer.is_polygon_data:
+            P = layer.get_geometry(as_geometry_objects=True)
+            arrays = [('coordinates', P.coordinates),
+                      ('ring_offsets', P.ring_offsets),
+                      ('part_offsets', P.part_offsets)]
+        elif layer.is_line_data:
+            lines = [numpy.array(x, dtype=numpy.float)
+                     for x in layer.get_geometry()]
+            offsets = numpy.zeros(len(lines) + 1, dtype=numpy.int)
+            numpy.cumsum([len(A) for A in lines], out=offsets[1:])
+            if len(lines) > 0:
+                coordinates = numpy.concatenate(lines)
+            else:
+                coordinates = numpy.zeros((0, 2), dtype=numpy.float)
+            arrays = [('coordinates', coordinates),
+                      ('ring_offsets', offsets)]
+        else:
+            coordinates = numpy.array(layer.get_geometry(),
+                                      dtype=numpy.float).reshape((-1, 2))
+            arrays = [('coordinates', coordinates)]
+
+        for name, A in arrays:
+            geometry[name] = _save_array(dirname, name, A)
+        header['geometry'] = geometry
+
+        # Attributes
+        columns = []
+        for i, name in enumerate(layer.get_attribute_names()):
+            A = layer.get_data(name, as_array=True)
+            column = {'name': name}
+            if A.dtype.kind in 'biuf':
+                column['file'] = _save_array(dirname, 'column%i' % i, A)
+            else:
+                column['values'] = A.tolist()
+            columns.append(column)
+        header['columns'] = columns
+    else:
+        msg = 'Layer %s is neither raster nor vector data' % layer
+        raise WriteLayerError(msg)
+
+    fid = open(os.path.join(dirname, HEADER_FILENAME), 'w')
+    try:
+        json.dump(header, fid, default=_to_json)
+    finally:
+        fid.close()
+
+
+def read_array_store(dirname, mmap_mode='r'):
+    """Open layer from array store
+
+    Args:
+        * dirname: Name of store directory written by write_array_store
+        * mmap_mode: Mode used to memory map arrays. Default 'r' opens
+            them read only without copying. Use None to read them into
+            memory.
+
+    Returns:
+        * Raster or Vector layer instance. Its filename is None until
+          it is written to file.
+    """
+
+    header_filename = os.path.join(dirname, HEADER_FILENAME)
+    if not os.path.isfile(header_filename):
+        msg = 'Could not find array store header %s' % header_filename
+        raise ReadLayerError(msg)
+
+    fid = open(header_filename)
+    try:
+        header = _from_json(json.load(fid))
+    finally:
+        fid.close()
+
+    msg = ('Array store %s has version %s. Expected %i'
+           % (dirname, header.get('version'), STORE_VERSION))
+    verify(header.get('version') == STORE_VERSION, msg)
+
+    if header['type'] == 'raster':
+        A = _load_array(dirname, header['data'], mmap_mode)
+        R = Raster(data=A,
+                   projection=header['projection'],
+                   geotransform=tuple(header['geotransform']),
+                   name=header['name'],
+                   keywords=header['keywords'],
+                   style_info=header['style_info'])
+        R.nodata_value = header.get('nodata', numpy.nan)
+        return R
+    elif header['type'] == 'vector':
+        arrays = {}
+        for name, filename in header['geometry'].items():
+            arrays[name] = _load_array(dirname, filename, mmap_mode)
+
+        if 'part_offsets' in arrays:
+            geometry = PolygonArray(arrays['coordinates'],
+                                    arrays['ring_offsets'],
+                                    arrays['part_offsets'])
+            geometry_type = 'polygon'
+        elif 'ring_offsets' in arrays:
+            # Lines are views into the packed coordinates
+            coordinates = arrays['coordinates']
+            offsets = arrays['ring_offsets']
+            geometry = [coordinates[offsets[i]:offsets[i + 1]]
+                        for i in range(len(offsets) - 1)]
+            geometry_type = 'line'
+        else:
+            geometry = arrays['coordinates']
+            geometry_type = 'point'
+
+        # Attributes
+        data = OrderedDict()
+        for column in header['columns']:
+            if 'file' in column:
+                A = _load_array(dirname, column['file'], mmap_mode)
+            else:
+                values = column['values']
+                A = numpy.empty(len(values), dtype=object)
+                for i, value in enumerate(values):
+                    A[i] = value
+            data[column['name']] = A
+
+        V = Vector(data=data,
+                   projection=header['projection'],
+                   geometry=geometry,
+                   geometry_type=geometry_type,
+                   name=header['name'],
+                   keywords=header['keywords'],
+                   style_info=header['style_info'])
+
+        # Keep original OGR type (e.g. ogr.wkbPoint25D)
+        V.geometry_type = header['geometry_type']
+        return V
+    else:
+        msg = ('Array store %s has unknown layer type %s'
+               % (dirname, header['type']))
+        raise ReadLayerError(msg)
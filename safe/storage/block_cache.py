@@ -0,0 +1,138 @@
+"""**Class BlockCache**
+"""
+
+import numpy
+
+from safe.common.utilities import verify
+from third_party.odict import OrderedDict
+
+# Maximal number of bytes held by the block cache of each raster layer
+BLOCK_CACHE_SIZE = 2 ** 26
+
+
+class BlockCache:
+    """Least recently used cache of blocks read from a GDAL raster band
+
+    Args:
+        * band: GDAL raster band
+        * capacity: Maximal number of bytes to keep in the cache.
+            The most recently used block is always kept.
+
+    Note:
+        Blocks follow the natural block size of the band as reported by
+        GDAL (e.g. tiles of a tiled GeoTIFF or strips of a striped one)
+        so that each block is read from disk with one efficient request.
+        Blocks are kept in the data type of the band.
+    """
+
+    def __init__(self, band, capacity=BLOCK_CACHE_SIZE):
+        """Initialise empty cache for band
+        """
+
+        self.band = band
+        self.capacity = capacity
+        self.block_width, self.block_height = band.GetBlockSize()
+        self.columns = band.XSize
+        self.rows = band.YSize
+
+        self.blocks = OrderedDict()
+        self.size = 0
+
+    def __len__(self):
+        """Number of blocks currently cached
+        """
+        return len(self.blocks)
+
+    def clear(self):
+        """Remove all blocks from cache
+        """
+
+        self.blocks = OrderedDict()
+        self.size = 0
+
+    def get_block(self, i, j):
+        """Get one block of band
+
+        Args:
+            * i: Block row
+            * j: Block column
+
+        Returns:
+            * Array with values of block. Blocks at the right and bottom
+              edges of the band may be smaller than the block size.
+        """
+
+        key = (i, j)
+        if key in self.blocks:
+            # Move block to the most recently used end
+            block = self.blocks.pop(key)
+        else:
+            xoff = j * self.block_width
+            yoff = i * self.block_height
+            xsize = min(self.block_width, self.columns - xoff)
+            ysize = min(self.block_height, self.rows - yoff)
+            block = self.band.ReadAsArray(xoff, yoff, xsize, ysize)
+
+            msg = ('Could not read block (%i, %i) of size %i x %i '
+                   'from raster band' % (i, j, ysize, xsize))
+            verify(block is not None, msg)
+            self.size += block.nbytes
+
+        self.blocks[key] = block
+
+        # Evict least recently used blocks
+        while self.size > self.capacity and len(self.blocks) > 1:
+            _, old_block = self.blocks.popitem(0)
+            self.size -= old_block.nbytes
+
+        return block
+
+    def read(self, xoff, yoff, xsize, ysize, dtype=numpy.float64,
+             nodata=None):
+        """Read window of band through the cache
+
+        Args:
+            * xoff, yoff: Column and row of upper left corner of window
+            * xsize, ysize: Number of columns and rows in window
+            * dtype: Data type of returned array
+            * nodata: Optional value representing missing data
+
+        Returns:
+            * ysize x xsize array with values of band inside window
+            * If nodata is given, also a boolean array of the same shape
+              which is True where values are nodata
+
+        Note:
+            Values are compared with nodata in the data type of the band,
+            i.e. before they are converted to dtype in which nodata may
+            not be representable (e.g. -1.797e308 becomes -inf in
+            single precision).
+        """
+
+        A = numpy.empty((ysize, xsize), dtype=dtype)
+        if nodata is not None:
+            mask = numpy.zeros((ysize, xsize), dtype=numpy.bool)
+
+        bw = self.block_width
+        bh = self.block_height
+        for i in range(yoff // bh, (yoff + ysize - 1) // bh + 1):
+            for j in range(xoff // bw, (xoff + xsize - 1) // bw + 1):
+                block = self.get_block(i, j)
+
+                # Overlap between window and block in band coordinates
+                x0 = max(xoff, j * bw)
+                x1 = min(xoff + xsize, j * bw + block.shape[1])
+                y0 = max(yoff, i * bh)
+                y1 = min(yoff + ysize, i * bh + block.shape[0])
+
+                values = block[y0 - i * bh:y1 - i * bh,
+                               x0 - j * bw:x1 - j * bw]
+                A[y0 - yoff:y1 - yoff, x0 - xoff:x1 - xoff] = values
+                if nodata is not None:
+                    mask[y0 - yoff:y1 - yoff, x0 - xoff:x1 - xoff] = \
+                        values == nodata
+
+        if nodata is None:
+            return A
+        else:
+            return A, mask
@@ -0,0 +1,86 @@
+"""**Class BlockWriter**
+"""
+
+import os
+import numpy
+from osgeo import gdal
+
+from safe.common.utilities import verify
+from safe.common.exceptions import WriteLayerError
+
+from utilities import DRIVER_MAP
+
+
+class BlockWriter:
+    """Write a single band raster file one block at a time
+
+    Args:
+        * filename: Name of raster file with extension .tif
+        * rows, columns: Dimensions of the grid
+        * projection: Geospatial reference in WKT format or an instance
+            of Projection
+        * geotransform: GDAL geotransform (6-tuple)
+        * nodata: Value representing missing data. Default is NaN.
+
+    Note:
+        The file is of the same kind as written by Raster.write_to_file
+        but the grid never has to be held in memory. Blocks may be
+        written in any order. Call close when all blocks are written.
+    """
+
+    def __init__(self, filename, rows, columns, projection, geotransform,
+                 nodata=numpy.nan):
+        """Create empty raster file
+        """
+
+        basename, extension = os.path.splitext(filename)
+
+        msg = ('Invalid file type for file %s. Only extension '
+               'tif allowed.' % filename)
+        verify(extension in ['.tif'], msg)
+        file_format = DRIVER_MAP[extension]
+
+        driver = gdal.GetDriverByName(file_format)
+        self.fid = driver.Create(filename, columns, rows, 1,
+                                 gdal.GDT_Float64)
+        if self.fid is None:
+            msg = ('Gdal could not create filename %s using '
+                   'format %s' % (filename, file_format))
+            raise WriteLayerError(msg)
+
+        self.fid.SetProjection(str(projection))
+        self.fid.SetGeoTransform(geotransform)
+        self.band = self.fid.GetRasterBand(1)
+        self.band.SetNoDataValue(nodata)
+
+        self.filename = filename
+        self.rows = rows
+        self.columns = columns
+
+    def write(self, A, yoff, xoff=0):
+        """Write block of grid
+
+        Args:
+            * A: Array with values of block
+            * yoff, xoff: Row and column of upper left corner of block
+        """
+
+        msg = 'Raster file %s has been closed' % self.filename
+        verify(self.band is not None, msg)
+
+        A = numpy.asarray(A)
+        msg = ('Block of size %i x %i at row %i and column %i does not '
+               'fit in grid of size %i x %i'
+               % (A.shape[0], A.shape[1], yoff, xoff,
+                  self.rows, self.columns))
+        verify(0 <= yoff and yoff + A.shape[0] <= self.rows, msg)
+        verify(0 <= xoff and xoff + A.shape[1] <= self.columns, msg)
+
+        self.band.WriteArray(A, xoff, yoff)
+
+    def close(self):
+        """Flush blocks to file and close it
+        """
+
+        self.band = None
+        self.fid = None
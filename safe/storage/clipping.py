@@ -1,7 +1,10 @@
 """Raster clipping by polygons
 """
 
-from safe.common.polygon import clip_grid_by_polygons
+import numpy
+
+from safe.common.polygon import grid_indices_by_polygons
+from safe.common.numerics import grid_indices2points
 #from safe.common.polygon import clip_lines_by_polygon
 
 
@@ -9,21 +12,51 @@ from safe.common.polygon import clip_grid_by_polygons
 # interpolation module.
 # Then retire this one
 # I THINK WE CAN RETIRE THIS NOW (3/9/12)
-def clip_raster_by_polygons(R, P):
+def clip_raster_by_polygons(R, P, scaling=None):
     """Separate raster grid points by polygons
 
     Args:
         * R: Raster layer
         * P: Polygon layer
+        * scaling: Optional scaling of raster data. See Raster.get_data
 
     Returns:
         * L: List of point vectors and their associated grid values.
              One item for each polygon
+
+    Note:
+        Polygons are filled directly on the grid (see
+        grid_indices_by_polygons) and only the window of the raster
+        covered by them is read. The result is the same as that of
+        clip_grid_by_polygons applied to the entire grid.
     """
 
-    res = clip_grid_by_polygons(R.get_data(),
-                                R.get_geotransform(),
-                                P.get_geometry(as_geometry_objects=True))
+    polygons = P.get_geometry(as_geometry_objects=True)
+    x, y = R.get_geometry()
+    nx = R.columns
+
+    indices = grid_indices_by_polygons((R.rows, R.columns),
+                                       R.get_geotransform(),
+                                       polygons)
+
+    # Window of raster covered by polygons
+    covered = numpy.concatenate(indices + [numpy.zeros(0, dtype=numpy.int)])
+    if len(covered) > 0:
+        rows = covered // nx
+        cols = covered % nx
+        xoff = numpy.min(cols)
+        yoff = numpy.min(rows)
+        window = (xoff, yoff,
+                  numpy.max(cols) - xoff + 1, numpy.max(rows) - yoff + 1)
+        A = R.get_data(scaling=scaling, window=window)
+
+    res = []
+    for idx in indices:
+        if len(idx) > 0:
+            values = A[idx // nx - yoff, idx % nx - xoff]
+        else:
+            values = numpy.zeros(0, dtype=numpy.float)
+        res.append((grid_indices2points(idx, x, y), values))
 
     # Return
     return res
@@ -8,6 +8,7 @@ import os
 
 from vector import Vector
 from raster import Raster
+from array_store import read_array_store
 from safe.common.utilities import verify, VerificationError
 from safe.common.exceptions import BoundingBoxError, ReadLayerError
 
@@ -19,6 +20,7 @@ logger = logging.getLogger('inasafe')
 def read_layer(filename):
     """Read spatial layer from file.
     This can be either raster or vector data.
+    Array stores (.npys directories, see array_store.py) are memory mapped.
     """
 
     _, ext = os.path.splitext(filename)
@@ -26,6 +28,8 @@ def read_layer(filename):
         return Raster(filename)
     elif ext in ['.shp', '.sqlite']:
         return Vector(filename)
+    elif ext == '.npys':
+        return read_array_store(filename)
     else:
         msg = ('Could not read %s. '
                'Extension "%s" has not been implemented' % (filename, ext))
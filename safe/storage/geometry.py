@@ -1,5 +1,7 @@
 # Geometry types
 
+import numpy
+
 
 class Geometry:
     """Common class for geometries
@@ -28,3 +30,150 @@ class Polygon(Geometry):
         s = 'Polygon(%s, inner_rings=%s' % (self.outer_ring,
                                             self.inner_rings)
         return s
+
+
+class PolygonView(Polygon):
+    """Polygon geometry viewing one feature of a PolygonArray
+
+    Rings are views into the coordinates of the PolygonArray so no
+    vertices are copied.
+    """
+
+    def __init__(self, polygons, index):
+        self.polygons = polygons
+        self.index = index
+
+    @property
+    def outer_ring(self):
+        return self.polygons.get_ring(self.polygons.part_offsets[self.index])
+
+    @property
+    def inner_rings(self):
+        start = self.polygons.part_offsets[self.index]
+        end = self.polygons.part_offsets[self.index + 1]
+        return [self.polygons.get_ring(k) for k in range(start + 1, end)]
+
+
+class PolygonArray:
+    """Packed polygon geometries of a vector layer
+
+    Args:
+        * coordinates: Nx2 array of vertex coordinates (lon, lat) of all
+          rings of all polygons
+        * ring_offsets: Array of R + 1 offsets into coordinates delimiting
+          the R rings
+        * part_offsets: Array of G + 1 offsets into rings delimiting the G
+          polygons. The first ring of each polygon is its outer ring and
+          any other rings are its inner rings.
+
+    Note:
+        The container behaves as a list of Polygon instances where each
+        polygon is a light weight PolygonView created on demand.
+        Bounding boxes of the outer rings are precomputed in the array
+        bboxes with one row [minx, maxx, miny, maxy] per polygon (NaN for
+        polygons without vertices).
+    """
+
+    def __init__(self, coordinates, ring_offsets, part_offsets):
+        self.coordinates = numpy.asarray(coordinates,
+                                         dtype=numpy.float).reshape((-1, 2))
+        self.ring_offsets = numpy.asarray(ring_offsets, dtype=numpy.int)
+        self.part_offsets = numpy.asarray(part_offsets, dtype=numpy.int)
+
+        # Bounding boxes of outer rings
+        N = len(self.part_offsets) - 1
+        outer_rings = self.part_offsets[:-1]
+        starts = self.ring_offsets[outer_rings]
+        ends = self.ring_offsets[outer_rings + 1]
+
+        self.bboxes = numpy.zeros((N, 4), dtype=numpy.float)
+        self.bboxes[:] = numpy.nan
+        nonempty = ends > starts
+        if numpy.any(nonempty):
+            # Each reduction runs from the start of one outer ring to the
+            # start of the next, so holes are cut off by ignoring
+            # everything beyond the end of the outer ring
+            bounds = numpy.zeros(2 * numpy.sum(nonempty), dtype=numpy.int)
+            bounds[0::2] = starts[nonempty]
+            bounds[1::2] = ends[nonempty]
+            P = self.coordinates
+            if bounds[-1] == len(P):
+                # Append dummy vertex to close last reduction
+                P = numpy.concatenate((P, P[-1:]))
+            mins = numpy.minimum.reduceat(P, bounds, axis=0)[0::2]
+            maxs = numpy.maximum.reduceat(P, bounds, axis=0)[0::2]
+            self.bboxes[nonempty, 0] = mins[:, 0]
+            self.bboxes[nonempty, 1] = maxs[:, 0]
+            self.bboxes[nonempty, 2] = mins[:, 1]
+            self.bboxes[nonempty, 3] = maxs[:, 1]
+
+    def __len__(self):
+        """Number of polygons
+        """
+        return len(self.part_offsets) - 1
+
+    def __getitem__(self, index):
+        """Get polygon or list of polygons for slice
+        """
+
+        if isinstance(index, slice):
+            return [self[i] for i in range(*index.indices(len(self)))]
+
+        N = len(self)
+        if index < 0:
+            index += N
+        if not 0 <= index < N:
+            raise IndexError('Polygon index %i out of range' % index)
+
+        return PolygonView(self, index)
+
+    def __iter__(self):
+        for i in range(len(self)):
+            yield PolygonView(self, i)
+
+    def get_ring(self, k):
+        """Get vertex coordinates of ring k as Nx2 array view
+        """
+        return self.coordinates[self.ring_offsets[k]:self.ring_offsets[k + 1]]
+
+    def get_outer_rings(self):
+        """Get list of outer rings of all polygons
+        """
+        return [self.get_ring(k) for k in self.part_offsets[:-1]]
+
+
+def pack_polygons(polygons):
+    """Pack list of polygons into a PolygonArray
+
+    Args:
+        * polygons: List of Polygon instances or PolygonArray
+
+    Returns:
+        * PolygonArray with copies of all rings
+    """
+
+    if isinstance(polygons, PolygonArray):
+        return polygons
+
+    rings = []
+    ring_sizes = []
+    part_sizes = []
+    for polygon in polygons:
+        parts = [polygon.outer_ring] + list(polygon.inner_rings)
+        for ring in parts:
+            A = numpy.array(ring, dtype=numpy.float).reshape((-1, 2))
+            rings.append(A)
+            ring_sizes.append(len(A))
+        part_sizes.append(len(parts))
+
+    if len(rings) > 0:
+        coordinates = numpy.concatenate(rings)
+    else:
+        coordinates = numpy.zeros((0, 2), dtype=numpy.float)
+
+    ring_offsets = numpy.zeros(len(ring_sizes) + 1, dtype=numpy.int)
+    numpy.cumsum(ring_sizes, out=ring_offsets[1:])
+    part_offsets = numpy.zeros(len(part_sizes) + 1, dtype=numpy.int)
+    numpy.cumsum(part_sizes, out=part_offsets[1:])
+
+    return PolygonArray(coordinates, ring_offsets, part_offsets)
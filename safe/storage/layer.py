@@ -1,7 +1,7 @@
 """**Class Layer**
 """
 
-from safe.common.utilities import verify
+from safe.common.utilities import verify, unique_filename
 from projection import Projection
 
 
@@ -49,6 +49,10 @@ class Layer:
         self.filename = None
         self.data = None
 
+        # Extension of file to write layer to when its filename is
+        # first requested (see get_filename)
+        self.export_extension = None
+
     def __ne__(self, other):
         """Override '!=' to allow comparison with other projection objecs
         """
@@ -61,8 +65,30 @@ class Layer:
         self.name = name
 
     def get_filename(self):
+        """Return filename of layer
+
+        Note:
+            If an export extension has been set (see set_lazy_export) and
+            the layer has not been written to file yet, it is written to
+            a unique file with that extension first.
+        """
+
+        if self.filename is None and self.export_extension is not None:
+            filename = unique_filename(suffix=self.export_extension)
+            self.write_to_file(filename)
+            self.filename = filename
+
         return self.filename
 
+    def set_lazy_export(self, extension):
+        """Defer writing of layer to file until its filename is needed
+
+        Args:
+            * extension: Extension of file to write e.g. '.tif' or '.shp'
+        """
+
+        self.export_extension = extension
+
     def get_projection(self, proj4=False):
         """Return projection of this layer as a string
         """
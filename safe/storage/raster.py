@@ -10,12 +10,14 @@ from osgeo import gdal
 from safe.common.utilities import (verify,
                                    ugettext as safe_tr)
 from safe.common.numerics import nanallclose, geotransform2axes, grid2points
+from safe.common.numerics import order_statistics
 from safe.common.exceptions import ReadLayerError, WriteLayerError
 from safe.common.exceptions import GetDataError, InaSAFEError
 
 from layer import Layer
 from vector import Vector
 from projection import Projection
+from block_cache import BlockCache
 
 from utilities import DRIVER_MAP
 from utilities import read_keywords
@@ -23,6 +25,10 @@ from utilities import write_keywords
 from utilities import (geotransform2bbox, geotransform2resolution,
                        check_geotransform)
 
+# Maximal number of bytes of each block of rows read when computing
+# statistics of raster data (see get_value_blocks)
+STATISTICS_BLOCK_SIZE = 2 ** 24
+
 
 class Raster(Layer):
     """InaSAFE representation of raster data
@@ -78,6 +84,12 @@ class Raster(Layer):
                        keywords=keywords,
                        style_info=style_info)
 
+        # Processed data kept by get_data if requested
+        self.cached_data = None
+
+        # Statistics of data kept by get_extrema and get_bins
+        self.statistics = None
+
         # Input checks
         if data is None:
             # Instantiate empty object
@@ -120,7 +132,7 @@ class Raster(Layer):
     def __len__(self):
         """Size of data set defined as total number of grid points
         """
-        return len(self.get_data().flat)
+        return self.rows * self.columns
 
     def __eq__(self, other, rtol=1.0e-5, atol=1.0e-8):
         """Override '==' to allow comparison with other raster objecs
@@ -230,6 +242,11 @@ class Raster(Layer):
             msg = 'Could not read raster band from %s' % filename
             raise ReadLayerError(msg)
 
+        # Cache for windowed reads
+        self.block_cache = BlockCache(band)
+        self.cached_data = None
+        self.statistics = None
+
         # FIXME (Ole): I think internal data array should be populated at
         #              this point - then refactor get_data()
 
@@ -281,7 +298,8 @@ class Raster(Layer):
         # Write keywords if any
         write_keywords(self.keywords, basename + '.keywords')
 
-    def get_data(self, nan=True, scaling=None, copy=False):
+    def get_data(self, nan=True, scaling=None, copy=False, window=None,
+                 dtype=numpy.float64, masked=False, cache=False):
         """Get raster data as numeric array
 
         Args:
@@ -314,65 +332,153 @@ class Raster(Layer):
 
             * copy (optional): If present and True return copy
 
+            * window (optional): Tuple (xoff, yoff, xsize, ysize) with
+                       column and row of the upper left corner and number
+                       of columns and rows of a part of the grid to return.
+                       See method get_window. If None (default) the
+                       entire grid is returned.
+
+            * dtype (optional): Floating point type of returned array.
+                       Default is numpy.float64 (issue #75). Use numpy.float32
+                       to halve the memory needed for large grids.
+
+            * masked (optional): If True, return a numpy.ma masked array
+                       with nodata values (and NaN's) masked. The data
+                       values are then left as they are and nan is ignored.
+
+            * cache (optional): If True, keep the returned array on the
+                       layer and return the same array if called again with
+                       the same arguments. The array must then not be
+                       modified by the caller. Only the most recent array
+                       is kept.
+
         Note:
             Scaling does not currently work with projected layers.
             See issue #123
-        """
-
-        if hasattr(self, 'data') and self.data is not None:
-            # Return internal data grid
-            if copy:
 
-                A = copy_module.deepcopy(self.data)
-            else:
-                A = self.data
-            verify(A.shape[0] == self.rows and A.shape[1] == self.columns)
+            File based rasters are read block by block through a cache
+            so only the blocks overlapping a window are read and repeated
+            reads of the same area are fast. Blocks are copied directly
+            into one array of the requested type and nodata values are
+            found in the type of the file.
 
-        else:
-            # Force garbage collection to free up any memory we can (TS)
-            gc.collect()
-
-            # Read from raster file
-            # FIXME: This can be slow so should be moved to read_from_file
-            A = self.band.ReadAsArray()
+            Nodata replacement and scaling are done in place on that
+            array so no other full size temporary arrays of values are
+            allocated.
+        """
 
-            # Convert to double precision (issue #75)
-            A = numpy.array(A, dtype=numpy.float64)
+        try:
+            dtype = numpy.dtype(dtype)
+        except TypeError, e:
+            msg = ('Argument dtype must be a numpy floating point type. '
+                   'I got "dtype=%s": %s' % (str(dtype), str(e)))
+            raise GetDataError(msg)
 
-            # Self check
-            M, N = A.shape
-            msg = ('Dimensions of raster array do not match those of '
-                   'raster file %s' % self.filename)
-            verify(M == self.rows, msg)
-            verify(N == self.columns, msg)
+        if dtype.kind != 'f':
+            msg = ('Argument dtype must be a numpy floating point type. '
+                   'I got "dtype=%s"' % str(dtype))
+            raise GetDataError(msg)
 
-        # Handle no data value
+        # Must explicit comparison to False and True as nan can be a number
+        # so 0 would evaluate to False and e.g. 1 to True.
+        if nan is False or masked:
+            # No change
+            NAN = None
+        elif nan is True:
+            NAN = numpy.nan  # Use numpy's nan value
+        else:
+            try:
+                # Use user specified number
+                NAN = float(nan)
+            except (ValueError, TypeError):
+                msg = ('Argument nan must be either True, False or a '
+                       'number. I got "nan=%s"' % str(nan))
+                raise InaSAFEError(msg)
+
+        sigma = self.get_scaling(scaling)
+
+        if window is not None:
+            window = self.check_window(window)
+
+        # Return previously processed data if requested
+        # Note that nan is part of key as a string as nan != nan
+        key = (str(NAN), sigma, window, dtype.str, bool(masked))
+        if cache and self.cached_data is not None:
+            cached_key, A = self.cached_data
+            if cached_key == key:
+                if copy:
+                    A = A.copy()
+                return A
+
+        # Nodata values are found before data is converted to the
+        # requested type in which nodata may not be representable.
         # FIXME (Ole): This only pertains to data read from file
         # and should be moved to read_from_file.
         nodata = self.get_nodata_value()
+        if masked or NAN is not None:
+            find_nodata = True
+        else:
+            find_nodata = False
+
+        in_memory = hasattr(self, 'data') and self.data is not None
+        if in_memory:
+            if window is None:
+                # Use internal data grid
+                B = self.data
+                verify(B.shape[0] == self.rows and
+                       B.shape[1] == self.columns)
+            else:
+                xoff, yoff, xsize, ysize = window
+                B = self.data[yoff:yoff + ysize, xoff:xoff + xsize]
 
-        # Must explicit comparison to False and True as nan can be a number
-        # so 0 would evaluate to False and e.g. 1 to True.
-        if nan is False:
-            # No change
-            pass
+            if find_nodata:
+                mask = B == nodata
+
+            # Internal data is always copied so that it can be modified
+            # in place below
+            A = numpy.array(B, dtype=dtype)
         else:
-            # Nan value should be changed
-            if nan is True:
-                NAN = numpy.nan  # Use numpy's nan value
+            if window is None:
+                # Force garbage collection to free up any memory we can (TS)
+                gc.collect()
+                window = (0, 0, self.columns, self.rows)
+
+            # Read from raster file block by block directly into an
+            # array of the requested type
+            xoff, yoff, xsize, ysize = window
+            if find_nodata:
+                A, mask = self.block_cache.read(xoff, yoff, xsize, ysize,
+                                                dtype=dtype, nodata=nodata)
             else:
-                try:
-                    # Use user specified number
-                    NAN = float(nan)
-                except (ValueError, TypeError):
-                    msg = ('Argument nan must be either True, False or a '
-                           'number. I got "nan=%s"' % str(nan))
-                    raise InaSAFEError(msg)
-
-            # Replace NODATA_VALUE with NaN array
-            #print 'Replacing', nodata, 'with', NAN
-            NaN = numpy.ones(A.shape, A.dtype) * NAN
-            A = numpy.where(A == nodata, NaN, A)
+                A = self.block_cache.read(xoff, yoff, xsize, ysize,
+                                          dtype=dtype)
+
+        if masked:
+            mask = numpy.logical_or(mask, numpy.isnan(A))
+            A = numpy.ma.masked_array(A, mask=mask, copy=False)
+        elif NAN is not None:
+            # Replace NODATA_VALUE with NaN (or specified value) in place
+            A[mask] = NAN
+
+        # Take care of possible scaling
+        if sigma != 1:
+            A *= sigma
+
+        if cache:
+            self.cached_data = (key, A)
+
+        # Return possibly scaled data
+        return A
+
+    def get_scaling(self, scaling=None):
+        """Get factor to scale data by
+
+        Args:
+            * scaling: Scaling flag as described in get_data
+
+        Returns:
+            * sigma: Number data is multiplied by in get_data
+        """
 
         # Take care of possible scaling
         if scaling is None:
@@ -406,8 +512,7 @@ class Raster(Layer):
                        'number: %s' % (scaling, str(e)))
                 raise GetDataError(msg)
 
-        # Return possibly scaled data
-        return sigma * A
+        return sigma
 
     def get_geotransform(self, copy=False):
         """Return geotransform for this raster layer
@@ -428,9 +533,13 @@ class Raster(Layer):
         else:
             return self.geotransform
 
-    def get_geometry(self):
+    def get_geometry(self, window=None):
         """Return longitudes and latitudes (the axes) for grid.
 
+        Args:
+            * window (optional): Tuple (xoff, yoff, xsize, ysize). If given,
+                only the axes of this part of the grid are returned.
+
         Note:
             Return two vectors (longitudes and latitudes) corresponding to
             grid. The values are offset by half a pixel size to correspond to
@@ -452,9 +561,76 @@ class Raster(Layer):
         # Compute x and y axes
         x, y = geotransform2axes(g, nx, ny)
 
+        if window is not None:
+            # Latitudes are south to north whereas rows are north to south
+            xoff, yoff, xsize, ysize = self.check_window(window)
+            x = x[xoff:xoff + xsize]
+            y = y[ny - yoff - ysize:ny - yoff]
+
         # Return them
         return x, y
 
+    def get_window(self, bbox):
+        """Get window of grid covering bounding box
+
+        Args:
+            * bbox: Bounding box [West, South, East, North]
+
+        Returns:
+            * window: Tuple (xoff, yoff, xsize, ysize) with column and row
+              of the upper left corner and number of columns and rows of
+              the smallest part of the grid containing all grid points
+              (cell centres) inside bbox plus one on either side.
+              This is what is needed for interpolation to points in bbox.
+              The window is clipped to the grid.
+        """
+
+        x, y = self.get_geometry()
+        nx = self.columns
+        ny = self.rows
+
+        # Columns (west to east)
+        col0 = numpy.searchsorted(x, bbox[0]) - 1
+        col1 = numpy.searchsorted(x, bbox[2], side='right') + 1
+        col0 = min(max(col0, 0), nx - 1)
+        col1 = max(min(col1, nx), col0 + 1)
+
+        # Rows (north to south)
+        row0 = ny - numpy.searchsorted(y, bbox[3], side='right') - 1
+        row1 = ny - numpy.searchsorted(y, bbox[1]) + 1
+        row0 = min(max(row0, 0), ny - 1)
+        row1 = max(min(row1, ny), row0 + 1)
+
+        return (int(col0), int(row0), int(col1 - col0), int(row1 - row0))
+
+    def check_window(self, window):
+        """Check that window is valid for this raster
+
+        Args:
+            * window: Tuple (xoff, yoff, xsize, ysize)
+
+        Returns:
+            * window as tuple of integers
+
+        Raises:
+            * GetDataError if window is not inside the grid
+        """
+
+        msg = ('Window must be a tuple (xoff, yoff, xsize, ysize) of '
+               'non-negative integers inside the %i x %i grid of layer %s. '
+               'I got %s' % (self.rows, self.columns, self.get_name(),
+                             str(window)))
+        try:
+            xoff, yoff, xsize, ysize = [int(w) for w in window]
+        except (ValueError, TypeError):
+            raise GetDataError(msg)
+
+        if not (0 <= xoff and 0 <= yoff and 0 < xsize and 0 < ysize and
+                xoff + xsize <= self.columns and yoff + ysize <= self.rows):
+            raise GetDataError(msg)
+
+        return xoff, yoff, xsize, ysize
+
     def copy(self):
         """Return copy of raster layer
 
@@ -472,21 +648,141 @@ class Raster(Layer):
     def __add__(self, other):
         return self.get_data() + other.get_data()
 
+    def get_statistics(self):
+        """Get statistics of data computed so far
+
+        Returns:
+            * Dictionary of statistics such as extrema and bins kept
+              for this layer. It is emptied when the data array, file or
+              scaling of the layer changes.
+
+        Note:
+            Call clear_statistics if data is modified in place.
+        """
+
+        if getattr(self, 'data', None) is not None:
+            source = self.data
+        else:
+            source = getattr(self, 'filename', None)
+        sigma = self.get_scaling()
+
+        statistics = getattr(self, 'statistics', None)
+        if (statistics is None or statistics[0] is not source or
+                statistics[1] != sigma):
+            self.statistics = statistics = (source, sigma, {})
+
+        return statistics[2]
+
+    def clear_statistics(self):
+        """Forget statistics of data computed so far
+        """
+
+        self.statistics = None
+
+    def get_value_blocks(self, block_size=STATISTICS_BLOCK_SIZE):
+        """Iterate over values of raster in blocks of rows
+
+        Args:
+            * block_size: Maximal number of bytes of each block
+
+        Returns:
+            * Iterator over 1D arrays of the values of each block as
+              returned by get_data. NaN's (and so nodata values) are
+              omitted.
+
+        Note:
+            Only one block is held in memory at a time.
+        """
+
+        rows = max(1, block_size // (8 * max(self.columns, 1)))
+        for yoff in range(0, self.rows, rows):
+            window = (0, yoff, self.columns, min(rows, self.rows - yoff))
+            A = self.get_data(nan=True, window=window).ravel()
+            yield A.compress(numpy.logical_not(numpy.isnan(A)))
+
+    def get_value_summary(self):
+        """Get number, min and max of values of raster
+
+        Returns:
+            * count, min, max. NaN's and nodata values are ignored.
+              If there are no values, min and max are NaN.
+
+        Note:
+            Values are read in one pass block by block and the result
+            is kept until the data changes (see get_statistics).
+        """
+
+        statistics = self.get_statistics()
+        if 'summary' not in statistics:
+            count = 0
+            Amin = numpy.inf
+            Amax = -numpy.inf
+            for A in self.get_value_blocks():
+                if len(A) > 0:
+                    count += len(A)
+                    Amin = min(Amin, numpy.min(A))
+                    Amax = max(Amax, numpy.max(A))
+
+            if count == 0:
+                Amin = Amax = numpy.nan
+
+            statistics['summary'] = (count, Amin, Amax)
+
+        return statistics['summary']
+
+    def get_stored_extrema(self):
+        """Get min and max stored in raster file by GDAL
+
+        Returns:
+            * min, max or None if not available
+
+        Note:
+            Only exact statistics stored by GDAL (e.g. by gdalinfo -stats)
+            are used and only if the file has a nodata value so that
+            GDAL ignores the same values as get_data.
+        """
+
+        band = getattr(self, 'band', None)
+        if band is None or band.GetNoDataValue() is None:
+            return None
+
+        metadata = band.GetMetadata()
+        if metadata.get('STATISTICS_APPROXIMATE', '').upper() == 'YES':
+            return None
+
+        try:
+            Amin = float(metadata['STATISTICS_MINIMUM'])
+            Amax = float(metadata['STATISTICS_MAXIMUM'])
+        except (KeyError, ValueError):
+            return None
+
+        sigma = self.get_scaling()
+        return Amin * sigma, Amax * sigma
+
     def get_extrema(self):
         """Get min and max from raster
 
         Note:
           If raster has a nominated no_data value, this is ignored.
 
+          Extrema stored in the raster file are used if available (see
+          get_stored_extrema). Otherwise the data is read block by block
+          (see get_value_summary). The result is kept until the data
+          changes (see get_statistics).
+
         Returns:
           min, max
         """
 
-        A = self.get_data(nan=True)
-        Amin = numpy.nanmin(A.flat[:])
-        Amax = numpy.nanmax(A.flat[:])
+        statistics = self.get_statistics()
+        if 'extrema' not in statistics:
+            extrema = self.get_stored_extrema()
+            if extrema is None:
+                _, Amin, Amax = self.get_value_summary()
+                extrema = (Amin, Amax)
+            statistics['extrema'] = extrema
 
-        return Amin, Amax
+        return statistics['extrema']
 
     def get_nodata_value(self):
         """Get the internal representation of NODATA
@@ -513,8 +809,17 @@ class Raster(Layer):
         the last is max. Intermediate values depend on the keyword quantiles:
         If quantiles is True, they represent boundaries between quantiles.
         If quantiles is False, they represent equidistant interval boundaries.
+
+        Quantiles are found without sorting or holding all values in
+        memory (see safe.common.numerics.order_statistics). Bins are kept
+        until the data changes (see get_statistics).
         """
 
+        statistics = self.get_statistics()
+        key = ('bins', N, bool(quantiles))
+        if key in statistics:
+            return list(statistics[key])
+
         rmin, rmax = self.get_extrema()
 
         levels = []
@@ -529,22 +834,17 @@ class Raster(Layer):
             # FIXME (Ole): Not 100% sure about this algorithm,
             # but it is close enough
 
-            A = self.get_data(nan=True).flat[:]
-
-            mask = numpy.logical_not(numpy.isnan(A))  # Omit NaN's
-            A = A.compress(mask)
-
-            A.sort()
-
-            verify(len(A) == A.shape[0])
-
-            d = float(len(A) + 0.5) / N
-            for i in range(N):
-                levels.append(A[int(i * d)])
+            # Values of the same ranks as in the sorted values
+            count, vmin, vmax = self.get_value_summary()
+            d = float(count + 0.5) / N
+            ranks = [int(i * d) for i in range(N)]
+            levels = order_statistics(self.get_value_blocks, ranks,
+                                      vmin, vmax)
 
         levels.append(rmax)
+        statistics[key] = levels
 
-        return levels
+        return list(levels)
 
     def get_bounding_box(self):
         """Get bounding box coordinates for raster layer
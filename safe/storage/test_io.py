@@ -8,6 +8,7 @@ from osgeo import gdal
 from raster import Raster
 from vector import Vector
 from vector import convert_polygons_to_centroids
+from vector import calculate_polygon_centroids, calculate_polygon_areas
 from projection import Projection
 from projection import DEFAULT_PROJECTION
 from core import read_layer
@@ -20,6 +21,8 @@ from utilities import buffered_bounding_box
 from utilities import array2wkt
 from utilities import calculate_polygon_area
 from utilities import calculate_polygon_centroid
+from utilities import calculate_ring_areas
+from utilities import calculate_ring_centroids
 from utilities import points_along_line
 from utilities import geotransform2bbox
 from utilities import geotransform2resolution
@@ -28,7 +31,9 @@ from core import get_bounding_box
 from core import bboxlist2string, bboxstring2list
 from core import check_bbox_string
 from utilities_test import same_API
-from geometry import Polygon
+from geometry import Polygon, PolygonArray
+from array_store import write_array_store
+from block_writer import BlockWriter
 from safe.common.numerics import nanallclose
 from safe.common.testing import TESTDATA, HAZDATA, DATADIR
 from safe.common.testing import FEATURE_COUNTS
@@ -37,6 +42,7 @@ from safe.common.utilities import ugettext as tr, unique_filename
 from safe.common.polygon import is_inside_polygon
 from safe.common.exceptions import BoundingBoxError, ReadLayerError
 from safe.common.exceptions import VerificationError, InaSAFEError
+from safe.common.exceptions import GetDataError
 
 
 # Auxiliary function for raster test
@@ -285,6 +291,43 @@ class Test_IO(unittest.TestCase):
         # Check
         assert R == L, msg
 
+    def test_bulk_reading_of_vector_data(self):
+        """Vector data read in bulk is the same as read feature by feature
+        """
+
+        # Points, lines, polygons with holes, 3D polygons and multipart
+        # polygons
+        for filename in ['%s/test_buildings.shp' % TESTDATA,
+                         '%s/tsunami_building_exposure.shp' % TESTDATA,
+                         '%s/indonesia_highway_sample.shp' % TESTDATA,
+                         '%s/donut.shp' % TESTDATA,
+                         '%s/25dpolygon.shp' % TESTDATA,
+                         '%s/kecamatan_jakarta_osm.shp' % TESTDATA,
+                         '%s/boundaries/rw_jakarta.shp' % DATADIR]:
+
+            V = Vector()
+            V.read_from_file(filename, bulk=True)
+
+            V_ref = Vector()
+            V_ref.read_from_file(filename, bulk=False)
+
+            msg = 'Bulk reading of %s gave a different layer' % filename
+            assert V.geometry_type == V_ref.geometry_type, msg
+            assert V == V_ref, msg
+
+            # Compare geometries exactly
+            if V.is_polygon_data:
+                geometry = V.get_geometry(as_geometry_objects=True)
+                geometry_ref = V_ref.get_geometry(as_geometry_objects=True)
+                for P, P_ref in zip(geometry, geometry_ref):
+                    assert numpy.array_equal(P.outer_ring, P_ref.outer_ring)
+                    assert len(P.inner_rings) == len(P_ref.inner_rings)
+                    for A, A_ref in zip(P.inner_rings, P_ref.inner_rings):
+                        assert numpy.array_equal(A, A_ref)
+            else:
+                for G, G_ref in zip(V.get_geometry(), V_ref.get_geometry()):
+                    assert numpy.array_equal(G, G_ref)
+
     def test_analysis_of_vector_data_top_N(self):
         """Analysis of vector data - get top N of an attribute
         """
@@ -754,6 +797,118 @@ class Test_IO(unittest.TestCase):
         assert V_tmp == V_new
         assert not V_tmp != V_new
 
+    def test_attribute_columns(self):
+        """Vector attributes are stored as typed columns
+        """
+
+        # Columns read from file agree with the list of rows
+        filename = '%s/%s' % (TESTDATA, 'test_buildings.shp')
+        V = read_layer(filename)
+        assert V.columns is not None
+
+        names = V.get_attribute_names()
+        columns = {}
+        for name in names:
+            A = V.get_data(name, as_array=True)
+            assert isinstance(A, numpy.ndarray)
+            assert len(A) == len(V)
+            assert A.dtype in [numpy.int, numpy.float, object]
+            assert V.get_data(name) == A.tolist()
+            assert V.get_data(name, index=3) == A[3]
+            columns[name] = A.copy()
+
+        # Rows are generated from columns on demand
+        data = V.get_data()
+        assert V.columns is None
+        assert len(data) == len(V)
+        for name in names:
+            assert [x[name] for x in data] == columns[name].tolist()
+
+        # Create layer from columns and check that types survive
+        # writing and reading
+        geometry = V.get_geometry()
+        N = len(geometry)
+        columns = {'ID': numpy.arange(N),
+                   'VALUE': numpy.linspace(0, 1, N),
+                   'NAME': numpy.array(['b%i' % i for i in range(N)],
+                                       dtype=object)}
+        V_new = Vector(data=columns, projection=V.get_projection(),
+                       geometry=geometry)
+        assert V_new.get_data('ID', as_array=True) is columns['ID']
+        assert V_new.get_data('ID', as_array=True, copy=True) is not \
+            columns['ID']
+        assert V_new == V_new.copy()
+
+        tmp_filename = unique_filename(suffix='.shp')
+        V_new.write_to_file(tmp_filename)
+        V_tmp = read_layer(tmp_filename)
+
+        A = V_tmp.get_data('ID', as_array=True)
+        assert A.dtype == numpy.int
+        assert numpy.all(A == columns['ID'])
+
+        A = V_tmp.get_data('VALUE', as_array=True)
+        assert A.dtype == numpy.float
+        assert numpy.allclose(A, columns['VALUE'])
+
+        A = V_tmp.get_data('NAME', as_array=True)
+        assert A.dtype == object
+        assert A.tolist() == columns['NAME'].tolist()
+
+        assert V_tmp == V_new
+
+        # Arrays of attributes held as rows keep the types of values
+        data = [{'MIXED': 1, 'BOOL': True, 'NUMBER': 1, 'REAL': 0.5},
+                {'MIXED': 'x', 'BOOL': 2, 'NUMBER': 2.5, 'REAL': 1.5}]
+        V = Vector(data=data, geometry=geometry[:2])
+        for name in ['MIXED', 'BOOL', 'NUMBER']:
+            A = V.get_data(name, as_array=True)
+            assert A.dtype == object
+            assert A.tolist() == [x[name] for x in data]
+            assert [type(x) for x in A] == [type(x[name]) for x in data]
+        A = V.get_data('REAL', as_array=True)
+        assert A.dtype == numpy.float
+        assert A.tolist() == [0.5, 1.5]
+        data[1]['NUMBER'] = 2
+        A = Vector(data=data, geometry=geometry[:2]).get_data('NUMBER',
+                                                              as_array=True)
+        assert A.dtype == numpy.int
+
+    def test_writing_of_vector_data_in_transactions(self):
+        """Vector data is written the same for any transaction size
+        """
+
+        # Polygons with holes, lines and points
+        layers = [read_layer('%s/%s' % (TESTDATA, 'donut.shp')),
+                  read_layer('%s/%s' % (TESTDATA,
+                                        'indonesia_highway_sample.shp')),
+                  read_layer('%s/%s' % (TESTDATA, 'test_buildings.shp'))]
+        for V in layers:
+            for transaction_size in [1, 7, 100000]:
+                tmp_filename = unique_filename(suffix='.shp')
+                V.write_to_file(tmp_filename,
+                                transaction_size=transaction_size)
+                V_tmp = read_layer(tmp_filename)
+                assert len(V_tmp) == len(V)
+                assert V_tmp == V
+
+        # Field types are inferred from all values of an attribute
+        geometry = [[106.1, -6.1], [106.2, -6.2], [106.3, -6.3]]
+        data = [{'MIXED': 1, 'MISSING': None, 'NAME': None},
+                {'MIXED': 2.5, 'MISSING': 3, 'NAME': 'b'},
+                {'MIXED': numpy.int64(3), 'MISSING': None, 'NAME': 'c'}]
+        V = Vector(data=data, geometry=geometry)
+
+        tmp_filename = unique_filename(suffix='.shp')
+        V.write_to_file(tmp_filename, transaction_size=2)
+        V_tmp = read_layer(tmp_filename)
+
+        assert V_tmp.get_data('MIXED') == [1.0, 2.5, 3.0]
+        assert V_tmp.get_data('MIXED', as_array=True).dtype == numpy.float
+        assert V_tmp.get_data('MISSING') == [None, 3, None]
+        assert V_tmp.get_data('NAME')[1:] == ['b', 'c']
+        assert numpy.allclose(V_tmp.get_geometry(), geometry)
+
     def test_reading_and_writing_of_vector_polygon_data(self):
         """Vector polygon data can be read and written correctly
         """
@@ -917,6 +1072,150 @@ class Test_IO(unittest.TestCase):
 
     test_centroids_from_polygon_data.slow = True
 
+    def test_packed_polygon_geometry(self):
+        """Polygon geometry is packed into one array with views per feature
+        """
+
+        # Polygons with and without holes
+        filename = '%s/%s' % (TESTDATA, 'donut.shp')
+        V = read_layer(filename)
+
+        filename = '%s/%s' % (TESTDATA, 'kecamatan_jakarta_osm.shp')
+        V_ref = Vector()
+        V_ref.read_from_file(filename, bulk=False)
+
+        for layer in [V, V_ref, read_layer(filename)]:
+            polygons = layer.get_geometry(as_geometry_objects=True)
+            assert isinstance(polygons, PolygonArray)
+            assert len(polygons) == len(layer)
+            assert len(polygons.ring_offsets) - 1 == numpy.sum(
+                [1 + len(P.inner_rings) for P in polygons])
+
+            # Views agree with the packed coordinates and bounding boxes
+            outer_rings = layer.get_geometry()
+            for i, P in enumerate(polygons):
+                assert isinstance(P, Polygon)
+                assert numpy.array_equal(P.outer_ring, outer_rings[i])
+                assert numpy.allclose(polygons.bboxes[i],
+                                      [min(P.outer_ring[:, 0]),
+                                       max(P.outer_ring[:, 0]),
+                                       min(P.outer_ring[:, 1]),
+                                       max(P.outer_ring[:, 1])],
+                                      rtol=0, atol=0)
+
+            # Batched centroids and areas agree with one by one
+            C = calculate_ring_centroids(polygons.coordinates,
+                                         polygons.ring_offsets)
+            A = calculate_ring_areas(polygons.coordinates,
+                                     polygons.ring_offsets)
+            for k in range(len(polygons.ring_offsets) - 1):
+                ring = polygons.get_ring(k)
+                assert numpy.allclose(C[k], calculate_polygon_centroid(ring),
+                                      rtol=1.0e-8, atol=1.0e-12)
+                assert numpy.allclose(A[k], calculate_polygon_area(ring),
+                                      rtol=1.0e-6)
+
+        # Geometry objects passed to Vector are packed too
+        geometry = V.get_geometry(as_geometry_objects=True)
+        V_new = Vector(geometry=list(geometry), data=V.get_data(),
+                       projection=V.get_projection(),
+                       keywords=V.get_keywords())
+        assert isinstance(V_new.geometry, PolygonArray)
+        assert V_new.geometry is not geometry
+        assert V_new == V
+        assert numpy.allclose(V_new.get_bounding_box(),
+                              V.get_bounding_box())
+
+    def test_polygon_centroids_and_areas_of_layer(self):
+        """Centroids and areas of all polygons in a layer are computed at once
+        """
+
+        # Synthetic polygons with holes
+        outer = numpy.array([[0, 0], [4, 0], [4, 4], [0, 4], [0, 0]])
+        hole = numpy.array([[1, 1], [2, 1], [2, 2], [1, 2], [1, 1]])
+        triangle = numpy.array([[10, 10], [13, 10], [10, 13], [10, 10]])
+        V = Vector(geometry=[Polygon(outer, [hole, hole + 1]),
+                             Polygon(triangle),
+                             Polygon(outer[::-1] + 100, [hole[::-1] + 100])])
+
+        C = calculate_polygon_centroids(V)
+        assert numpy.allclose(C, [[2, 2], [11, 11], [102, 102]])
+
+        A = calculate_polygon_areas(V)
+        assert numpy.allclose(A, [14, 4.5, 15])
+
+        # Real polygons against one by one computations
+        for vectorname in ['kecamatan_jakarta_osm.shp',
+                           'OSM_subset.shp']:
+            filename = '%s/%s' % (TESTDATA, vectorname)
+            V = read_layer(filename)
+            polygons = V.get_geometry(as_geometry_objects=True)
+
+            C = calculate_polygon_centroids(V)
+            A = calculate_polygon_areas(V)
+            assert C.shape == (len(V), 2)
+            assert A.shape == (len(V),)
+
+            for i, P in enumerate(polygons):
+                c = calculate_polygon_centroid(P.outer_ring)
+                assert numpy.allclose(C[i], c, rtol=1.0e-8, atol=1.0e-12)
+
+                a = calculate_polygon_area(P.outer_ring)
+                for ring in P.inner_rings:
+                    a -= calculate_polygon_area(ring)
+                assert numpy.allclose(A[i], a, rtol=1.0e-6)
+
+    def test_array_store(self):
+        """Layers can be stored as memory mapped arrays and exported lazily
+        """
+
+        for filename in ['Population_2010_clip.tif',
+                         'test_buildings.shp',
+                         'indonesia_highway_sample.shp',
+                         'kecamatan_jakarta_osm.shp',
+                         'donut.shp']:
+            L = read_layer('%s/%s' % (TESTDATA, filename))
+            extension = os.path.splitext(filename)[1]
+
+            store_name = unique_filename(suffix='.npys')
+            write_array_store(L, store_name)
+            L_new = read_layer(store_name)
+
+            # Arrays are mapped from the store rather than copied
+            if L.is_raster:
+                assert not L_new.data.flags.owndata
+                assert nanallclose(L_new.get_nodata_value(),
+                                   L.get_nodata_value())
+                assert nanallclose(L_new.get_data(), L.get_data())
+            else:
+                if L.is_polygon_data:
+                    P = L_new.get_geometry(as_geometry_objects=True)
+                    assert not P.coordinates.flags.owndata
+
+                for name in L.get_attribute_names():
+                    A = L.get_data(name, as_array=True)
+                    B = L_new.get_data(name, as_array=True)
+                    assert A.dtype == B.dtype
+                    if A.dtype.kind in 'biuf':
+                        assert not L_new.columns[name].flags.owndata
+                        assert nanallclose(A, B)
+                    else:
+                        assert A.tolist() == B.tolist()
+
+            assert L_new == L
+            assert L_new.get_keywords() == L.get_keywords()
+            assert L_new.get_style_info() == L.get_style_info()
+
+            # Nothing is exported until the filename is requested
+            L_new.set_lazy_export(extension)
+            assert L_new.filename is None
+
+            filename = L_new.get_filename()
+            assert filename.endswith(extension)
+            assert os.path.isfile(filename)
+            assert L_new.get_filename() == filename
+            assert read_layer(filename) == L
+
     def test_rasters_and_arrays(self):
         """Consistency of rasters and associated arrays
         """
@@ -1438,6 +1737,144 @@ class Test_IO(unittest.TestCase):
 
     test_raster_extrema.slow = True
 
+    def test_raster_windows(self):
+        """Windows of raster data agree with the entire grid
+        """
+
+        for rastername in ['Earthquake_Ground_Shaking_clip.tif',
+                           'Population_2010_clip.tif',
+                           'population_padang_1.asc']:
+
+            filename = '%s/%s' % (TESTDATA, rastername)
+            R = read_layer(filename)
+            A = R.get_data(nan=0.0)
+            x, y = R.get_geometry()
+
+            # Arrays held in memory must give the same windows as files
+            M = Raster(data=A, projection=R.get_projection(),
+                       geotransform=R.get_geotransform())
+
+            for window in [(0, 0, R.columns, R.rows),
+                           (0, 0, 1, 1),
+                           (R.columns - 3, R.rows - 2, 3, 2),
+                           (R.columns // 3, R.rows // 4,
+                            R.columns // 2, R.rows // 3)]:
+                xoff, yoff, xsize, ysize = window
+                W = A[yoff:yoff + ysize, xoff:xoff + xsize]
+
+                # Twice to exercise the block cache
+                for i in range(2):
+                    assert numpy.all(R.get_data(nan=0.0, window=window) == W)
+                assert numpy.all(M.get_data(nan=0.0, window=window) == W)
+
+                # Axes of the window
+                xw, yw = R.get_geometry(window=window)
+                assert numpy.all(xw == x[xoff:xoff + xsize])
+                assert numpy.all(yw == y[::-1][yoff:yoff + ysize][::-1])
+
+            # Window covering a bounding box includes one point either side
+            bbox = [x[2], y[3], x[5], y[-3]]
+            assert R.get_window(bbox) == (1, 1, 6, R.rows - 3)
+
+            # Windows are clipped to the grid
+            bbox = R.get_bounding_box()
+            assert R.get_window(bbox) == (0, 0, R.columns, R.rows)
+
+            # Invalid windows are caught
+            for window in [(-1, 0, 2, 2), (0, 0, R.columns + 1, 1),
+                           (0, 0, 0, 1), (0, 0, 1)]:
+                try:
+                    R.get_data(window=window)
+                except GetDataError:
+                    pass
+                else:
+                    msg = 'Invalid window %s should have failed' % str(window)
+                    raise Exception(msg)
+
+    test_raster_windows.slow = True
+
+    def test_raster_data_types_and_masks(self):
+        """Raster data can be single precision, masked and cached
+        """
+
+        for rastername in ['Population_2010_clip.tif',
+                           'population_padang_1.asc']:
+
+            filename = '%s/%s' % (TESTDATA, rastername)
+            R = read_layer(filename)
+            nodata = R.get_nodata_value()
+            A = R.get_data(nan=False)
+            B = R.get_data()
+            assert A.dtype == numpy.float64
+
+            # Single precision
+            C = R.get_data(dtype=numpy.float32)
+            assert C.dtype == numpy.float32
+            assert nanallclose(B, C, rtol=1.0e-6)
+            assert numpy.all(numpy.isnan(C) == numpy.isnan(B))
+
+            C = R.get_data(nan=0.0, dtype=numpy.float32, scaling=2)
+            assert numpy.all(C[A == nodata] == 0.0)
+            assert numpy.allclose(C[A != nodata], 2 * A[A != nodata])
+
+            # Masked array
+            C = R.get_data(masked=True)
+            assert numpy.all(C.mask == numpy.isnan(B))
+            assert numpy.all(C.data == A)
+            assert numpy.allclose(numpy.sum(C), numpy.nansum(B))
+
+            # Cached data is only reused for identical arguments
+            C = R.get_data(cache=True)
+            assert R.get_data(cache=True) is C
+            assert R.get_data(cache=True, copy=True) is not C
+            assert R.get_data() is not C
+            D = R.get_data(nan=0.0, cache=True)
+            assert D is not C
+            assert numpy.all(D[A == nodata] == 0.0)
+            assert nanallclose(R.get_data(cache=True), B)
+
+            # In memory rasters are never modified
+            M = Raster(data=A, projection=R.get_projection(),
+                       geotransform=R.get_geotransform())
+            M.nodata_value = nodata
+            C = M.get_data(scaling=3)
+            assert numpy.all(M.get_data(nan=False) == A)
+            assert numpy.all(numpy.isnan(C) == numpy.isnan(B))
+
+            # Non floating point types are caught
+            try:
+                R.get_data(dtype=numpy.int16)
+            except GetDataError:
+                pass
+            else:
+                msg = 'Integer dtype should have raised exception'
+                raise Exception(msg)
+
+        # Nodata values not representable in single precision
+        nodata = -numpy.finfo(numpy.float64).max
+        A = numpy.arange(12.0).reshape((3, 4))
+        A[1, 2] = nodata
+        geotransform = (106.0, 0.1, 0, -6.0, 0, -0.1)
+        M = Raster(data=A, projection=DEFAULT_PROJECTION,
+                   geotransform=geotransform)
+        M.nodata_value = nodata
+
+        filename = unique_filename(suffix='.tif')
+        writer = BlockWriter(filename, 3, 4, DEFAULT_PROJECTION,
+                             geotransform, nodata=nodata)
+        writer.write(A, 0)
+        writer.close()
+
+        for R in [M, read_layer(filename)]:
+            C = R.get_data(dtype=numpy.float32)
+            assert numpy.isnan(C[1, 2])
+            assert numpy.sum(numpy.isnan(C)) == 1
+            C = R.get_data(nan=0.0, dtype=numpy.float32)
+            assert numpy.sum(C) == numpy.sum(numpy.arange(12)) - 6
+            C = R.get_data(masked=True, dtype=numpy.float32)
+            assert C.mask[1, 2]
+            assert numpy.sum(C.mask) == 1
+
     def test_bins(self):
         """Linear and quantile bins are correct
         """
@@ -1497,6 +1934,57 @@ class Test_IO(unittest.TestCase):
 
     test_bins.slow = True
 
+    def test_raster_statistics_are_kept(self):
+        """Extrema and bins are kept until raster data changes
+        """
+
+        numpy.random.seed(13)
+        A = numpy.random.lognormal(0, 2, (30, 40))
+        A[::5, ::3] = numpy.nan
+        A[3:6, :] = 0.0
+        R = Raster(data=A, projection=DEFAULT_PROJECTION,
+                   geotransform=(100.0, 0.1, 0, 10.0, 0, -0.1))
+
+        # Quantiles are those of the sorted values
+        B = numpy.sort(A[numpy.logical_not(numpy.isnan(A))])
+        for N in [2, 5, 16]:
+            d = float(len(B) + 0.5) / N
+            expected = [B[int(i * d)] for i in range(N)] + [B[-1]]
+
+            quantiles = R.get_bins(N=N, quantiles=True)
+            assert quantiles == expected
+
+        assert R.get_value_summary() == (len(B), B[0], B[-1])
+        assert R.get_extrema() == (B[0], B[-1])
+
+        # Results are kept
+        statistics = R.get_statistics()
+        assert ('bins', 16, True) in statistics
+        statistics[('bins', 16, True)] = [1, 2]
+        assert R.get_bins(N=16, quantiles=True) == [1, 2]
+
+        # and forgotten when data changes
+        R.data = A * 2
+        assert R.get_extrema() == (2 * B[0], 2 * B[-1])
+        assert R.get_bins(N=16, quantiles=True)[-1] == 2 * B[-1]
+
+        R.data[0, 0] = -1
+        assert R.get_extrema() == (2 * B[0], 2 * B[-1])
+        R.clear_statistics()
+        assert R.get_extrema() == (-1, 2 * B[-1])
+
+        # Extrema stored in files by GDAL are used
+        filename = unique_filename(suffix='.tif')
+        R.write_to_file(filename)
+        fid = gdal.Open(filename, gdal.GA_Update)
+        fid.GetRasterBand(1).SetStatistics(-5.0, 5.0, 0.0, 1.0)
+        fid = None
+
+        R = read_layer(filename)
+        assert R.get_stored_extrema() == (-5.0, 5.0)
+        assert R.get_extrema() == (-5.0, 5.0)
+        assert R.get_value_summary()[1] == -1
+
     def test_raster_to_vector_points(self):
         """Raster layers can be converted to vector point layers
         """
@@ -6,6 +6,7 @@ import re
 import copy
 import numpy
 import math
+import struct
 from ast import literal_eval
 from osgeo import ogr
 
@@ -14,11 +15,16 @@ from geometry import Polygon
 from safe.common.numerics import ensure_numeric
 from safe.common.utilities import verify
 from safe.common.exceptions import BoundingBoxError, InaSAFEError
+from safe.common.exceptions import ReadLayerError
 
 
 # Default attribute to assign to vector layers
 DEFAULT_ATTRIBUTE = 'inapolygon'
 
+# Default attribute holding the fraction of polygons covered by hazard
+# polygons in polygon overlays
+DEFAULT_FRACTION_ATTRIBUTE = 'inafrac'
+
 # Spatial layer file extensions that are recognised in Risiko
 # FIXME: Perhaps add '.gml', '.zip', ...
 LAYER_TYPES = ['.shp', '.asc', '.tif', '.tiff', '.geotif', '.geotiff']
@@ -40,6 +46,18 @@ TYPE_MAP = {type(None): ogr.OFTString,  # What else should this be?
             type(numpy.array([0.0])[0]): ogr.OFTReal,  # numpy.float64
             type(numpy.array([[0.0]])[0]): ogr.OFTReal}  # numpy.ndarray
 
+# Map between OGR field types and types of attribute columns
+COLUMN_TYPE_MAP = {ogr.OFTInteger: numpy.int,
+                   ogr.OFTReal: numpy.float}
+
+# Map between WKB geometry codes (with flag for z) and OGR geometry types
+WKB_TYPE_MAP = {(1, False): ogr.wkbPoint,
+                (1, True): ogr.wkbPoint25D,
+                (2, False): ogr.wkbLineString,
+                (2, True): ogr.wkbLineString25D,
+                (3, False): ogr.wkbPolygon,
+                (3, True): ogr.wkbPolygon25D}
+
 # Map between verbose types and OGR geometry types
 INVERSE_GEOMETRY_TYPE_MAP = {'point': ogr.wkbPoint,
                              'line': ogr.wkbLineString,
@@ -978,6 +996,110 @@ def calculate_polygon_centroid(polygon):
     return C
 
 
+def _ring_moments(coordinates, ring_offsets):
+    """Calculate signed areas and first moments of packed rings
+
+    Args:
+        * coordinates: Nx2 array of vertex coordinates of all rings
+        * ring_offsets: Array of R + 1 offsets into coordinates delimiting
+          the R rings
+
+    Returns:
+        * A: Signed area of each ring
+        * Mx, My: Sums (x_i + x_{i+1})(x_i y_{i+1} - x_{i+1} y_i) and
+          (y_i + y_{i+1})(x_i y_{i+1} - x_{i+1} y_i) for each ring computed
+          relative to origin
+        * origin: Rx2 array of lower left corner of each ring
+
+    Note:
+        Coordinates are normalised ring by ring as in
+        calculate_polygon_centroid.
+    """
+
+    P = ensure_numeric(coordinates, numpy.float)
+    offsets = ensure_numeric(ring_offsets, numpy.int)
+
+    sizes = offsets[1:] - offsets[:-1]
+    R = len(sizes)
+    P = P[:offsets[-1]]
+
+    # Lower left corner of each ring
+    origin = numpy.zeros((R, 2), dtype=numpy.float)
+    nonempty = sizes > 0
+    if numpy.any(nonempty):
+        origin[nonempty] = numpy.minimum.reduceat(P, offsets[:-1][nonempty],
+                                                  axis=0)
+
+    # Normalise and pair every vertex with its successor in the same ring
+    ring_ids = numpy.repeat(numpy.arange(R), sizes)
+    P = P - origin[ring_ids]
+    same = ring_ids[:-1] == ring_ids[1:]
+    owner = ring_ids[:-1][same]
+    x0 = P[:-1, 0][same]
+    y0 = P[:-1, 1][same]
+    x1 = P[1:, 0][same]
+    y1 = P[1:, 1][same]
+
+    # Segmented sums over each ring
+    d = x0 * y1 - x1 * y0
+    A = numpy.bincount(owner, weights=d, minlength=R) / 2.
+    Mx = numpy.bincount(owner, weights=(x0 + x1) * d, minlength=R)
+    My = numpy.bincount(owner, weights=(y0 + y1) * d, minlength=R)
+
+    return A, Mx, My, origin
+
+
+def calculate_ring_areas(coordinates, ring_offsets, signed=False):
+    """Calculate areas of many packed non-self-intersecting rings at once
+
+    Args:
+        * coordinates: Nx2 array of vertex coordinates of all rings
+        * ring_offsets: Array of R + 1 offsets into coordinates delimiting
+          the R rings. Each ring is assumed to be closed.
+        * signed: Optional flag deciding whether returned areas retain
+          their sign as in calculate_polygon_area
+
+    Returns:
+        * Array of R areas
+    """
+
+    A = _ring_moments(coordinates, ring_offsets)[0]
+
+    if signed:
+        return A
+    else:
+        return numpy.abs(A)
+
+
+def calculate_ring_centroids(coordinates, ring_offsets):
+    """Calculate centroids of many packed non-self-intersecting rings at once
+
+    Args:
+        * coordinates: Nx2 array of vertex coordinates of all rings
+        * ring_offsets: Array of R + 1 offsets into coordinates delimiting
+          the R rings. Each ring is assumed to be closed.
+
+    Returns:
+        * Rx2 array of centroids. Rings without area get NaN.
+
+    Note:
+        This is equivalent to calling calculate_polygon_centroid for each
+        ring but all rings are done with the same handful of array
+        operations.
+    """
+
+    A, Mx, My, origin = _ring_moments(coordinates, ring_offsets)
+
+    C = numpy.zeros(origin.shape, dtype=numpy.float)
+    C[:] = numpy.nan
+    ok = A != 0
+    C[ok, 0] = Mx[ok] / (6. * A[ok])
+    C[ok, 1] = My[ok] / (6. * A[ok])
+
+    # Translate back to real location
+    return C + origin
+
+
 def points_between_points(point1, point2, delta):
     """Creates an array of points between two points given a delta
 
@@ -1094,3 +1216,231 @@ def get_polygondata(G):
     # Return Polygon instance
     return Polygon(outer_ring=outer_ring,
                    inner_rings=inner_rings)
+
+
+def _read_wkb_header(wkb, offset):
+    """Read byte order and geometry type from WKB buffer
+
+    Args:
+        * wkb: WKB buffer
+        * offset: Position of geometry in buffer
+
+    Returns:
+        * order: Byte order as struct/numpy prefix ('<' or '>')
+        * code: Geometry code without dimension, e.g. 3 for polygons
+        * has_z: True if vertices have a z coordinate
+        * offset: Position just after the header
+
+    Note:
+        Both the OGC (25D bit) and the ISO (1000 + code) encodings of
+        z coordinates are understood. Geometries with measures are not.
+    """
+
+    if struct.unpack_from('B', wkb, offset)[0] == 1:
+        order = '<'
+    else:
+        order = '>'
+    code = struct.unpack_from(order + 'I', wkb, offset + 1)[0]
+
+    if code & 0x80000000:
+        has_z = True
+        code &= 0x7fffffff
+    elif 1000 < code < 2000:
+        has_z = True
+        code -= 1000
+    elif code > 2000:
+        msg = 'WKB geometries with measures are not supported'
+        raise ReadLayerError(msg)
+    else:
+        has_z = False
+
+    return order, code, has_z, offset + 5
+
+
+def _read_wkb_points(wkb, offset, order, has_z):
+    """Read counted sequence of vertices from WKB buffer
+
+    Args:
+        * wkb: WKB buffer
+        * offset: Position of the number of vertices in buffer
+        * order: Byte order as struct/numpy prefix ('<' or '>')
+        * has_z: True if vertices have a z coordinate
+
+    Returns:
+        * Nx2 array of vertex coordinates (lon, lat) viewing the buffer
+        * offset: Position just after the vertices
+    """
+
+    N = struct.unpack_from(order + 'I', wkb, offset)[0]
+    dims = 3 if has_z else 2
+    A = numpy.frombuffer(wkb, dtype=order + 'f8', count=N * dims,
+                         offset=offset + 4)
+
+    return A.reshape((N, dims))[:, :2], offset + 4 + 8 * N * dims
+
+
+def decode_wkb(buffers):
+    """Decode WKB geometries into flat arrays of coordinates
+
+    Args:
+        * buffers: List of WKB buffers, one for each feature, as returned
+          by the ExportToWkb method of OGR geometries
+
+    Returns:
+        * geometry_type: OGR geometry type of all features or None if
+          there are no features
+        * coordinates: Nx2 array of vertex coordinates (lon, lat) of all
+          rings. Any z coordinates are dismissed.
+        * ring_offsets: Array of R + 1 offsets into coordinates delimiting
+          the R rings
+        * geometry_offsets: Array of G + 1 offsets into rings delimiting
+          the G geometries
+
+    Raises:
+        * ReadLayerError if geometries are of mixed or unsupported types
+
+    Note:
+        Points and lines are one ring each. The first ring of a polygon is
+        its outer ring, any other rings are holes.
+        Multipolygons are read as single polygons with all rings of all
+        parts in the same way as ogr.ForceToPolygon does.
+    """
+
+    geometry_key = None
+    rings = []
+    ring_sizes = []
+    geometry_sizes = []
+    for wkb in buffers:
+        order, code, has_z, offset = _read_wkb_header(wkb, 0)
+
+        if code == 1:
+            # Point has no vertex count
+            dims = 3 if has_z else 2
+            A = numpy.frombuffer(wkb, dtype=order + 'f8', count=dims,
+                                 offset=offset)
+            parts = [A.reshape((1, dims))[:, :2]]
+        elif code == 2:
+            A, offset = _read_wkb_points(wkb, offset, order, has_z)
+            parts = [A]
+        elif code == 3 or (code == 6 and not has_z):
+            if code == 3:
+                number_of_parts = 1
+                headers = False
+            else:
+                number_of_parts = struct.unpack_from(order + 'I',
+                                                     wkb, offset)[0]
+                offset += 4
+                headers = True
+                code = 3
+
+            parts = []
+            for i in range(number_of_parts):
+                if headers:
+                    order, part_code, _, offset = _read_wkb_header(wkb,
+                                                                   offset)
+                    if part_code != 3:
+                        msg = ('Multipolygon had part of geometry type '
+                               '%i' % part_code)
+                        raise ReadLayerError(msg)
+
+                number_of_rings = struct.unpack_from(order + 'I',
+                                                     wkb, offset)[0]
+                offset += 4
+                for j in range(number_of_rings):
+                    A, offset = _read_wkb_points(wkb, offset, order, has_z)
+                    parts.append(A)
+
+            if len(parts) == 0:
+                msg = 'Polygon without rings cannot be read'
+                raise ReadLayerError(msg)
+        else:
+            msg = 'WKB geometry type %i is not supported' % code
+            raise ReadLayerError(msg)
+
+        key = (code, has_z)
+        if geometry_key is None:
+            geometry_key = key
+        elif key != geometry_key:
+            msg = ('Geometries of different types %s and %s cannot be read '
+                   'into the same layer' % (geometry_key, key))
+            raise ReadLayerError(msg)
+
+        rings.extend(parts)
+        ring_sizes.extend([len(A) for A in parts])
+        geometry_sizes.append(len(parts))
+
+    if len(rings) > 0:
+        coordinates = numpy.concatenate(rings).astype(numpy.float)
+    else:
+        coordinates = numpy.zeros((0, 2), dtype=numpy.float)
+
+    ring_offsets = numpy.zeros(len(ring_sizes) + 1, dtype=numpy.int)
+    numpy.cumsum(ring_sizes, out=ring_offsets[1:])
+    geometry_offsets = numpy.zeros(len(geometry_sizes) + 1, dtype=numpy.int)
+    numpy.cumsum(geometry_sizes, out=geometry_offsets[1:])
+
+    if geometry_key is None:
+        geometry_type = None
+    else:
+        geometry_type = WKB_TYPE_MAP[geometry_key]
+
+    return geometry_type, coordinates, ring_offsets, geometry_offsets
+
+
+def encode_wkb(code, coordinates, ring_offsets, geometry_offsets):
+    """Encode flat arrays of coordinates as WKB geometries
+
+    Args:
+        * code: WKB geometry code, i.e. 1 for points, 2 for lines and
+          3 for polygons
+        * coordinates: Nx2 array of vertex coordinates (lon, lat) of all
+          rings
+        * ring_offsets: Array of R + 1 offsets into coordinates delimiting
+          the R rings
+        * geometry_offsets: Array of G + 1 offsets into rings delimiting
+          the G geometries
+
+    Returns:
+        * List of G little endian WKB buffers suitable for
+          ogr.CreateGeometryFromWkb
+
+    Note:
+        This is the inverse of decode_wkb. Vertices are serialised in one
+        operation and each geometry is assembled from slices of the
+        result so no geometry is built vertex by vertex through OGR.
+    """
+
+    msg = 'WKB geometry code must be 1, 2 or 3. I got %s' % code
+    verify(code in [1, 2, 3], msg)
+
+    A = numpy.ascontiguousarray(coordinates, dtype='<f8')
+    msg = ('Coordinates must be an array with two columns. I got shape %s'
+           % str(A.shape))
+    verify(len(A.shape) == 2 and A.shape[1] == 2, msg)
+    vertices = A.tostring()
+
+    ring_offsets = [int(x) for x in ring_offsets]
+    geometry_offsets = [int(x) for x in geometry_offsets]
+
+    buffers = []
+    for i in range(len(geometry_offsets) - 1):
+        start = geometry_offsets[i]
+        end = geometry_offsets[i + 1]
+        if code == 1:
+            k = ring_offsets[start]
+            wkb = struct.pack('<BI', 1, 1) + vertices[16 * k:16 * k + 16]
+        elif code == 2:
+            a = ring_offsets[start]
+            b = ring_offsets[start + 1]
+            wkb = struct.pack('<BII', 1, 2, b - a) + vertices[16 * a:16 * b]
+        else:
+            parts = [struct.pack('<BII', 1, 3, end - start)]
+            for k in range(start, end):
+                a = ring_offsets[k]
+                b = ring_offsets[k + 1]
+                parts.append(struct.pack('<I', b - a))
+                parts.append(vertices[16 * a:16 * b])
+            wkb = b''.join(parts)
+        buffers.append(wkb)
+
+    return buffers
@@ -31,22 +31,170 @@ from safe.common.exceptions import GetDataError, InaSAFEError
 
 from layer import Layer
 from projection import Projection
-from geometry import Polygon
-from utilities import DRIVER_MAP, TYPE_MAP
+from geometry import Polygon, PolygonArray, pack_polygons
+from utilities import DRIVER_MAP, TYPE_MAP, COLUMN_TYPE_MAP
 from utilities import read_keywords
 from utilities import write_keywords
 from utilities import get_geometry_type
 from utilities import is_sequence
-from utilities import array2line
-from utilities import calculate_polygon_centroid
+from utilities import calculate_ring_areas, calculate_ring_centroids
 from utilities import points_along_line
 from utilities import geometrytype2string
 from utilities import get_ringdata, get_polygondata
+from utilities import decode_wkb, encode_wkb
 from utilities import rings_equal
+from third_party.odict import OrderedDict
 
 LOGGER = logging.getLogger('InaSAFE')
 _pseudo_inf = float(99999999)
 
+# Number of features written to file per transaction
+WRITE_TRANSACTION_SIZE = 10000
+
+
+def _values_to_column(values, field_type):
+    """Convert attribute values of one field to a typed column
+
+    Args:
+        * values: List of values as returned by OGR for each feature
+        * field_type: OGR field type, e.g. ogr.OFTInteger
+
+    Returns:
+        * Numpy array of values. Integer and real fields become integer
+          and float arrays unless they have missing values in which case
+          they, like all other fields, are stored as object arrays.
+
+    Note:
+        Values equal to _pseudo_inf are converted back to NaN.
+        We do this because there is NaN problem on windows
+        NaN value must be converted to _pseudo_in to solve the
+        problem. But, when InaSAFE read the file, it'll be
+        converted back to NaN value, so that NaN in InaSAFE is a
+        numpy.nan
+        please check https://github.com/AIFDR/inasafe/issues/269
+        for more information
+    """
+
+    dtype = COLUMN_TYPE_MAP.get(field_type, object)
+    if dtype is not object and None in values:
+        dtype = object
+
+    if dtype is object:
+        A = numpy.empty(len(values), dtype=object)
+        for i, value in enumerate(values):
+            if value == _pseudo_inf:
+                value = float('nan')
+            A[i] = value
+    else:
+        A = numpy.array(values, dtype=dtype)
+        if numpy.any(A == _pseudo_inf):
+            A = A.astype(numpy.float)
+            A[A == _pseudo_inf] = numpy.nan
+
+    return A
+
+
+def _values_to_array(values):
+    """Convert attribute values of one field to an array keeping their types
+
+    Args:
+        * values: List of values, one for each feature
+
+    Returns:
+        * Numpy array of values. If all values are integers (but not
+          booleans) or all are floats, this is an integer or float array.
+          Otherwise it is an object array holding the values as they are
+          so that e.g. numbers mixed with strings are not converted.
+    """
+
+    if len(values) > 0:
+        if all([isinstance(x, (int, long)) and
+                not isinstance(x, bool) for x in values]):
+            return numpy.array(values, dtype=numpy.int)
+        if all([isinstance(x, float) for x in values]):
+            return numpy.array(values, dtype=numpy.float)
+
+    A = numpy.empty(len(values), dtype=object)
+    for i, value in enumerate(values):
+        A[i] = value
+    return A
+
+
+def _column_to_field(name, values):
+    """Establish OGR field type and values to store for one attribute
+
+    Args:
+        * name: Name of attribute
+        * values: Array or list of attribute values for all features
+
+    Returns:
+        * ogrtype: OGR field type
+        * values: List of values to store with None for values that should
+          be left unset
+    """
+
+    # Numeric columns are converted in one go
+    if isinstance(values, numpy.ndarray) and values.dtype.kind in 'biuf':
+        if values.dtype.kind == 'f':
+            A = values.astype(numpy.float)
+            A[numpy.isnan(A)] = _pseudo_inf
+            return ogr.OFTReal, A.tolist()
+        else:
+            return ogr.OFTInteger, values.tolist()
+
+    # Otherwise infer type from the types of all values
+    # Missing values (None) do not determine the type
+    ogrtypes = set()
+    for py_type in set([type(val) for val in values if val is not None]):
+        msg = ('Unknown type for storing vector '
+               'data: %s, %s' % (name, str(py_type)[1:-1]))
+        verify(py_type in TYPE_MAP or
+               issubclass(py_type, (numpy.integer, numpy.floating)), msg)
+
+        if py_type in TYPE_MAP:
+            ogrtypes.add(TYPE_MAP[py_type])
+        elif issubclass(py_type, numpy.integer):
+            ogrtypes.add(ogr.OFTInteger)
+        else:
+            ogrtypes.add(ogr.OFTReal)
+
+    if len(ogrtypes) == 0:
+        ogrtype = TYPE_MAP[type(None)]
+    elif len(ogrtypes) == 1:
+        ogrtype = ogrtypes.pop()
+    elif ogrtypes == set([ogr.OFTInteger, ogr.OFTReal]):
+        ogrtype = ogr.OFTReal
+    else:
+        ogrtype = ogr.OFTString
+
+    field_values = []
+    for val in values:
+        if type(val) == numpy.ndarray:
+            # A singleton of type <type 'numpy.ndarray'> works
+            # for gdal version 1.6 but fails for version 1.8
+            # in SetField with error: NotImplementedError:
+            # Wrong number of arguments for overloaded function
+            val = float(val)
+        elif isinstance(val, numpy.generic):
+            val = val.item()
+        elif val is None:
+            if ogrtype == ogr.OFTString:
+                val = ''
+
+        # We do this because there is NaN problem on windows
+        # NaN value must be converted to _pseudo_in to solve the
+        # problem. But, when InaSAFE read the file, it'll be
+        # converted back to NaN value, so that NaN in InaSAFE is a
+        # numpy.nan
+        # please check https://github.com/AIFDR/inasafe/issues/269
+        # for more information
+        if val != val:
+            val = _pseudo_inf
+
+        field_values.append(val)
+
+    return ogrtype, field_values
+
 
 class Vector(Layer):
     """InaSAFE representation of vector data.
@@ -57,6 +205,8 @@ class Vector(Layer):
                 * A filename of a vector file format known to GDAL.
                 * List of dictionaries of field names and attribute values
                   associated with each point coordinate.
+                * Dictionary of field names and arrays (columns) of
+                  attribute values associated with each point coordinate.
                 * None
             * projection: Geospatial reference in WKT format.
                 Only used if geometry is provided as a numeric array,
@@ -131,6 +281,11 @@ class Vector(Layer):
                        style_info=style_info,
                        sublayer=sublayer)
 
+        # Attributes are stored either as a list of rows (self.data) or
+        # as a dictionary of columns (self.columns). Rows are generated
+        # from columns when first requested (see __getattr__).
+        self.columns = None
+
         # Input checks
         if data is None and geometry is None:
             # Instantiate empty object
@@ -151,15 +306,17 @@ class Vector(Layer):
             msg = 'Geometry must be a sequence'
             verify(is_sequence(geometry), msg)
 
-            if len(geometry) > 0 and isinstance(geometry[0], Polygon):
+            if (isinstance(geometry, PolygonArray) or
+                    (len(geometry) > 0 and isinstance(geometry[0], Polygon))):
                 self.geometry_type = ogr.wkbPolygon
-                self.geometry = geometry
+                self.geometry = pack_polygons(geometry)
             else:
                 self.geometry_type = get_geometry_type(geometry, geometry_type)
 
                 if self.is_polygon_data:
                     # Convert to objects if input is a list of simple arrays
-                    self.geometry = [Polygon(outer_ring=x) for x in geometry]
+                    self.geometry = pack_polygons([Polygon(outer_ring=x)
+                                                   for x in geometry])
                 else:
                     # Convert to list if input is an array
                     if isinstance(geometry, numpy.ndarray):
@@ -174,9 +331,18 @@ class Vector(Layer):
                 for i in range(len(geometry)):
                     data.append({'ID': i})
 
-            # Check data
-            self.data = data
-            if data is not None:
+            if isinstance(data, dict):
+                # Attributes given as columns
+                columns = OrderedDict()
+                for name in data:
+                    msg = ('Column %s must have %i entries. I got %i'
+                           % (name, len(geometry), len(data[name])))
+                    verify(len(data[name]) == len(geometry), msg)
+                    columns[name] = numpy.asarray(data[name])
+                self._set_columns(columns)
+            else:
+                # Check data
+                self.data = data
                 msg = 'Data must be a sequence'
                 verify(is_sequence(data), msg)
 
@@ -208,12 +374,11 @@ class Vector(Layer):
                     maxy = max(maxy, max(A[:, 1]))
             elif self.is_polygon_data:
                 # Do outer ring only
-                for g in self.get_geometry(as_geometry_objects=False):
-                    A = numpy.array(g)
-                    minx = min(minx, min(A[:, 0]))
-                    maxx = max(maxx, max(A[:, 0]))
-                    miny = min(miny, min(A[:, 1]))
-                    maxy = max(maxy, max(A[:, 1]))
+                bboxes = self.geometry.bboxes
+                minx = numpy.nanmin(bboxes[:, 0])
+                maxx = numpy.nanmax(bboxes[:, 1])
+                miny = numpy.nanmin(bboxes[:, 2])
+                maxy = numpy.nanmax(bboxes[:, 3])
 
             self.extent = [minx, maxx, miny, maxy]
 
@@ -361,7 +526,7 @@ class Vector(Layer):
         # Vector layers are identical up to the specified tolerance
         return True
 
-    def read_from_file(self, filename):
+    def read_from_file(self, filename, bulk=True):
         """Read and unpack vector data.
 
         It is assumed that the file contains only one layer with the
@@ -373,6 +538,10 @@ class Vector(Layer):
           combinations thereof.
         * The attributes or obtained through GetField()
 
+        If bulk is True (default) geometries are decoded from their WKB
+        representation all at once (see decode_wkb). Otherwise, or if
+        that fails, they are read from OGR feature by feature.
+
         The full OGR architecture is documented at
         * http://www.gdal.org/ogr/ogr_arch.html
         * http://www.gdal.org/ogr/ogr_apitut.html
@@ -443,9 +612,60 @@ class Vector(Layer):
 
         layer.ResetReading()
 
-        # Extract coordinates and attributes for all features
+        # Field names and types are common to all features
+        layer_def = layer.GetLayerDefn()
+        number_of_fields = layer_def.GetFieldCount()
+        field_names = []
+        field_types = []
+        for j in range(number_of_fields):
+            field_def = layer_def.GetFieldDefn(j)
+            field_names.append(field_def.GetName())
+            field_types.append(field_def.GetType())
+
+        # Extract coordinates and attributes for all features. Should the
+        # bulk reader fail, features are read one by one which reports any
+        # problems with the data.
+        geometry = None
+        if bulk:
+            try:
+                geometry, values = self._read_features_bulk(layer,
+                                                            number_of_fields)
+            except ReadLayerError, e:
+                LOGGER.debug('Could not read %s in bulk: %s. Reading '
+                             'features one by one.' % (filename, e))
+                layer.ResetReading()
+
+        if geometry is None:
+            geometry, values = self._read_features(layer, number_of_fields,
+                                                   filename)
+
+        # Store geometry coordinates as a compact numeric array
+        if self.is_polygon_data:
+            geometry = pack_polygons(geometry)
+        self.geometry = geometry
+
+        # Store attributes as typed columns. The list of rows is
+        # generated from them if and when it is requested.
+        columns = OrderedDict()
+        for j, name in enumerate(field_names):
+            columns[name] = _values_to_column(values[j], field_types[j])
+        self._set_columns(columns)
+
+    def _read_features(self, layer, number_of_fields, filename):
+        """Read geometry and attributes of OGR layer feature by feature
+
+        Args:
+            * layer: OGR layer
+            * number_of_fields: Number of attribute fields in layer
+            * filename: Name of file used in error messages
+
+        Returns:
+            * geometry: List of geometries as stored in self.geometry
+            * values: List of attribute values for each field
+        """
+
         geometry = []
-        data = []
+        values = [[] for j in range(number_of_fields)]
         # Use feature iterator
         for feature in layer:
             # Record coordinates ordered as Longitude, Latitude
@@ -489,44 +709,82 @@ class Vector(Layer):
                                         self.geometry_type))
                     raise ReadLayerError(msg)
 
-            # Record attributes by name
-            number_of_fields = feature.GetFieldCount()
-            fields = {}
+            # Record attributes by field
             for j in range(number_of_fields):
-                name = feature.GetFieldDefnRef(j).GetName()
-
-                # FIXME (Ole): Ascertain the type of each field?
-                #              We need to cast each appropriately?
-                #              This is issue #66
-                #              (https://github.com/AIFDR/riab/issues/66)
-                #feature_type = feature.GetFieldDefnRef(j).GetType()
-                fields[name] = feature.GetField(j)
-
-                    # We do this because there is NaN problem on windows
-                    # NaN value must be converted to _pseudo_in to solve the
-                    # problem. But, when InaSAFE read the file, it'll be
-                    # converted back to NaN value, so that NaN in InaSAFE is a
-                    # numpy.nan
-                    # please check https://github.com/AIFDR/inasafe/issues/269
-                    # for more information
-                if fields[name] == _pseudo_inf:
-                    fields[name] = float('nan')
-                #print 'Field', name, feature_type, j, fields[name]
-
-            data.append(fields)
-        # Store geometry coordinates as a compact numeric array
-        self.geometry = geometry
-        self.data = data
+                values[j].append(feature.GetField(j))
+
+        return geometry, values
+
+    def _read_features_bulk(self, layer, number_of_fields):
+        """Read geometry and attributes of OGR layer in bulk
+
+        Args:
+            * layer: OGR layer
+            * number_of_fields: Number of attribute fields in layer
+
+        Returns:
+            * geometry: List of geometries as stored in self.geometry
+            * values: List of attribute values for each field
+
+        Raises:
+            * ReadLayerError if geometries cannot be decoded
+
+        Note:
+            Geometries are exported as WKB and decoded into one array of
+            coordinates. Polygons are kept packed in a PolygonArray and
+            lines are views into the coordinates so no geometry is
+            copied vertex by vertex through OGR.
+        """
+
+        buffers = []
+        values = [[] for j in range(number_of_fields)]
+        for feature in layer:
+            G = feature.GetGeometryRef()
+            if G is None:
+                msg = 'Geometry was None'
+                raise ReadLayerError(msg)
+            buffers.append(G.ExportToWkb())
 
-    def write_to_file(self, filename, sublayer=None):
+            for j in range(number_of_fields):
+                values[j].append(feature.GetField(j))
+
+        (geometry_type, coordinates,
+         ring_offsets, geometry_offsets) = decode_wkb(buffers)
+        self.geometry_type = geometry_type
+
+        if self.is_point_data:
+            geometry = [tuple(x) for x in coordinates.tolist()]
+        elif self.is_line_data:
+            geometry = [coordinates[ring_offsets[i]:ring_offsets[i + 1]]
+                        for i in range(len(ring_offsets) - 1)]
+        elif self.is_polygon_data:
+            geometry = PolygonArray(coordinates, ring_offsets,
+                                    geometry_offsets)
+        else:
+            geometry = []
+
+        return geometry, values
+
+    def write_to_file(self, filename, sublayer=None,
+                      transaction_size=WRITE_TRANSACTION_SIZE):
         """Save vector data to file
 
         Args:
             * filename: filename with extension .shp or .gml
             * sublayer: Optional string for writing a sublayer. Ignored
                   unless we are writing to an sqlite file.
+            * transaction_size: Number of features written per transaction
 
         Note:
+            Features are written in transactions of transaction_size
+            features and their geometries are created from WKB encoded
+            directly from the coordinate arrays.
+
+            The OGR type of each attribute is inferred from all its values.
+            Integer and real values in the same attribute give a real
+            field. Missing values (None) are left unset except in string
+            fields where they are stored as empty strings.
+
             Shp limitation, if attribute names are longer than 10
             characters they will be truncated. This is due to limitations in
             the shp file driver and has to be done here since gdal v1.7 onwards
@@ -558,14 +816,37 @@ class Vector(Layer):
         else:
             layername = sublayer
 
-        # Get vector data
-        if self.is_polygon_data:
-            geometry = self.get_geometry(as_geometry_objects=True)
+        # Encode geometry as WKB
+        buffers = self._get_wkb()
+        N = len(buffers)
+
+        # Get attributes column by column
+        if self.columns is not None:
+            columns = self.columns
         else:
-            geometry = self.get_geometry()
-        data = self.get_data()
+            data = self.get_data()
+            columns = OrderedDict()
+            if data is not None and len(data) > 0:
+                try:
+                    fields = data[0].keys()
+                except:
+                    msg = ('Input parameter "attributes" was specified '
+                           'but it does not contain list of dictionaries '
+                           'with field information as expected. The first '
+                           'element is %s' % data[0])
+                    raise WriteLayerError(msg)
 
-        N = len(geometry)
+                for name in fields:
+                    columns[name] = [x[name] for x in data]
+
+        # Establish OGR type and values to store for each field
+        fields = columns.keys()
+        ogrtypes = []
+        values = []
+        for name in fields:
+            ogrtype, field_values = _column_to_field(name, columns[name])
+            ogrtypes.append(ogrtype)
+            values.append(field_values)
 
         # Clear any previous file of this name (ogr does not overwrite)
         try:
@@ -591,137 +872,106 @@ class Vector(Layer):
             msg = 'Could not create layer %s' % layername
             raise WriteLayerError(msg)
 
-        # Define attributes if any
-        store_attributes = False
-        fields = []
-        if data is not None:
-            if len(data) > 0:
-                try:
-                    fields = data[0].keys()
-                except:
-                    msg = ('Input parameter "attributes" was specified '
-                           'but it does not contain list of dictionaries '
-                           'with field information as expected. The first '
-                           'element is %s' % data[0])
-                    raise WriteLayerError(msg)
-                else:
-                    # Establish OGR types for each element
-                    ogrtypes = {}
-                    for name in fields:
-                        att = data[0][name]
-                        py_type = type(att)
-                        msg = ('Unknown type for storing vector '
-                               'data: %s, %s' % (name, str(py_type)[1:-1]))
-                        verify(py_type in TYPE_MAP, msg)
-                        ogrtypes[name] = TYPE_MAP[py_type]
-
-            else:
-                #msg = ('Input parameter "data" was specified '
-                #       'but appears to be empty')
-                #raise InaSAFEError(msg)
-                pass
-
-            # Create attribute fields in layer
-            store_attributes = True
-            for name in fields:
-                fd = ogr.FieldDefn(name, ogrtypes[name])
-                # FIXME (Ole): Trying to address issue #16
-                #              But it doesn't work and
-                #              somehow changes the values of MMI in test
-                #width = max(128, len(name))
-                #print name, width
-                #fd.SetWidth(width)
-
-                # Silent handling of warnings like
-                # Warning 6: Normalized/laundered field name:
-                #'CONTENTS_LOSS_AUD' to 'CONTENTS_L'
-                gdal.PushErrorHandler('CPLQuietErrorHandler')
-                if lyr.CreateField(fd) != 0:
-                    msg = 'Could not create field %s' % name
-                    raise WriteLayerError(msg)
+        # Create attribute fields in layer
+        for j, name in enumerate(fields):
+            fd = ogr.FieldDefn(name, ogrtypes[j])
+            # FIXME (Ole): Trying to address issue #16
+            #              But it doesn't work and
+            #              somehow changes the values of MMI in test
+            #width = max(128, len(name))
+            #print name, width
+            #fd.SetWidth(width)
+
+            # Silent handling of warnings like
+            # Warning 6: Normalized/laundered field name:
+            #'CONTENTS_LOSS_AUD' to 'CONTENTS_L'
+            gdal.PushErrorHandler('CPLQuietErrorHandler')
+            if lyr.CreateField(fd) != 0:
+                msg = 'Could not create field %s' % name
+                raise WriteLayerError(msg)
 
-                # Restore error handler
-                gdal.PopErrorHandler()
+            # Restore error handler
+            gdal.PopErrorHandler()
 
-        # Store geometry
-        geom = ogr.Geometry(self.geometry_type)
+        # Store features in transactions of given size. This matters
+        # greatly for sqlite where each transaction is committed to disk.
         layer_def = lyr.GetLayerDefn()
+        number_of_fields = len(fields)
+        lyr.StartTransaction()
         for i in range(N):
             # Create new feature instance
             feature = ogr.Feature(layer_def)
 
             # Store geometry and check
-            if self.is_point_data:
-                x = float(geometry[i][0])
-                y = float(geometry[i][1])
-                geom.SetPoint_2D(0, x, y)
-            elif self.is_line_data:
-                geom = array2line(geometry[i],
-                                  geometry_type=ogr.wkbLineString)
-            elif self.is_polygon_data:
-                # Create polygon geometry
-                geom = ogr.Geometry(ogr.wkbPolygon)
-
-                # Add outer ring
-                linear_ring = array2line(geometry[i].outer_ring,
-                                         geometry_type=ogr.wkbLinearRing)
-                geom.AddGeometry(linear_ring)
-
-                # Add inner rings if any
-                for A in geometry[i].inner_rings:
-                    geom.AddGeometry(array2line(A,
-                                     geometry_type=ogr.wkbLinearRing))
-            else:
-                msg = 'Geometry type %s not implemented' % self.geometry_type
-                raise WriteLayerError(msg)
-
-            feature.SetGeometry(geom)
-
-            G = feature.GetGeometryRef()
+            G = ogr.CreateGeometryFromWkb(buffers[i])
             if G is None:
-                msg = 'Could not create GeometryRef for file %s' % filename
+                lyr.RollbackTransaction()
+                msg = 'Could not create geometry %i for file %s' % (i,
+                                                                    filename)
                 raise WriteLayerError(msg)
+            feature.SetGeometryDirectly(G)
 
-            # Store attributes
-            if store_attributes:
-                for j, name in enumerate(fields):
-                    actual_field_name = layer_def.GetFieldDefn(j).GetNameRef()
-
-                    val = data[i][name]
-
-                    if type(val) == numpy.ndarray:
-                        # A singleton of type <type 'numpy.ndarray'> works
-                        # for gdal version 1.6 but fails for version 1.8
-                        # in SetField with error: NotImplementedError:
-                        # Wrong number of arguments for overloaded function
-                        val = float(val)
-                    elif val is None:
-                        val = ''
-
-                    # We do this because there is NaN problem on windows
-                    # NaN value must be converted to _pseudo_in to solve the
-                    # problem. But, when InaSAFE read the file, it'll be
-                    # converted back to NaN value, so that NaN in InaSAFE is a
-                    # numpy.nan
-                    # please check https://github.com/AIFDR/inasafe/issues/269
-                    # for more information
-                    if val != val:
-                        val = _pseudo_inf
-
-                    feature.SetField(actual_field_name, val)
+            # Store attributes leaving missing values unset
+            for j in range(number_of_fields):
+                val = values[j][i]
+                if val is not None:
+                    feature.SetField(j, val)
 
             # Save this feature
             if lyr.CreateFeature(feature) != 0:
+                lyr.RollbackTransaction()
                 msg = 'Failed to create feature %i in file %s' % (i, filename)
                 raise WriteLayerError(msg)
 
             feature.Destroy()
 
+            if (i + 1) % transaction_size == 0:
+                lyr.CommitTransaction()
+                lyr.StartTransaction()
+        lyr.CommitTransaction()
+
         # Write keywords if any
         write_keywords(self.keywords, basename + '.keywords')
 
         # FIXME (Ole): Maybe store style_info
 
+    def _get_wkb(self):
+        """Encode geometry of all features as WKB
+
+        Returns:
+            * List of WKB buffers, one for each feature
+        """
+
+        if self.is_point_data:
+            A = numpy.array(self.get_geometry(), dtype=numpy.float)
+            A = A.reshape((-1, 2))
+            offsets = numpy.arange(len(A) + 1)
+            return encode_wkb(1, A, offsets, offsets)
+        elif self.is_line_data:
+            lines = []
+            for line in self.get_geometry():
+                A = numpy.array(line, dtype=numpy.float)
+                msg = ('Array must be a 2d array of vertices with two '
+                       'columns. I got %s' % (str(A.shape)))
+                verify(len(A.shape) == 2 and A.shape[1] == 2, msg)
+                lines.append(A)
+
+            ring_offsets = numpy.zeros(len(lines) + 1, dtype=numpy.int)
+            numpy.cumsum([len(A) for A in lines], out=ring_offsets[1:])
+            if len(lines) > 0:
+                coordinates = numpy.concatenate(lines)
+            else:
+                coordinates = numpy.zeros((0, 2), dtype=numpy.float)
+            return encode_wkb(2, coordinates, ring_offsets,
+                              numpy.arange(len(lines) + 1))
+        elif self.is_polygon_data:
+            P = self.get_geometry(as_geometry_objects=True)
+            return encode_wkb(3, P.coordinates, P.ring_offsets,
+                              P.part_offsets)
+        else:
+            msg = 'Geometry type %s not implemented' % self.geometry_type
+            raise WriteLayerError(msg)
+
     def copy(self):
         """Return copy of vector layer
 
@@ -733,7 +983,14 @@ class Vector(Layer):
         else:
             geometry = self.get_geometry(copy=True)
 
-        return Vector(data=self.get_data(copy=True),
+        if self.columns is not None:
+            data = OrderedDict()
+            for name in self.columns:
+                data[name] = self.columns[name].copy()
+        else:
+            data = self.get_data(copy=True)
+
+        return Vector(data=data,
                       geometry=geometry,
                       projection=self.get_projection(),
                       keywords=self.get_keywords())
@@ -744,9 +1001,13 @@ class Vector(Layer):
         These are the ones that can be used with get_data
         """
 
-        return self.data[0].keys()
+        if self.columns is not None:
+            return self.columns.keys()
+        else:
+            return self.data[0].keys()
 
-    def get_data(self, attribute=None, index=None, copy=False):
+    def get_data(self, attribute=None, index=None, copy=False,
+                 as_array=False):
         """Get vector attributes
 
         Note:
@@ -763,38 +1024,100 @@ class Vector(Layer):
             If optional argument copy is True and all attributes are requested,
             a copy will be returned. Otherwise a pointer to the data is
             returned.
+
+            If optional argument as_array is True and attribute is specified,
+            the values for that attribute are returned as a numpy array
+            rather than a list. For layers read from file this is the
+            typed column (integer, float or object) as stored internally,
+            so copy should be True if the array is to be modified.
+            Otherwise the array is typed as in _values_to_array.
+            Attributes are kept as columns until the list of rows is
+            requested for the first time, after which the rows are used.
         """
 
-        if hasattr(self, 'data'):
-            if attribute is None:
-                if copy:
-                    return copy_module.deepcopy(self.data)
+        if self.columns is not None:
+            names = self.columns.keys()
+        elif self.data is not None:
+            names = self.data[0].keys()
+        else:
+            msg = 'Vector data instance does not have any attributes'
+            raise GetDataError(msg)
+
+        if attribute is None:
+            if copy:
+                return copy_module.deepcopy(self.data)
+            else:
+                return self.data
+
+        msg = ('Specified attribute %s does not exist in '
+               'vector layer %s. Valid names are %s'
+               '' % (attribute, self, names))
+        verify(attribute in names, msg)
+
+        if index is None:
+            # Return all values for specified attribute
+            if self.columns is not None:
+                column = self.columns[attribute]
+                if not as_array:
+                    return column.tolist()
+                elif copy:
+                    return column.copy()
                 else:
-                    return self.data
+                    return column
             else:
-                msg = ('Specified attribute %s does not exist in '
-                       'vector layer %s. Valid names are %s'
-                       '' % (attribute, self, self.data[0].keys()))
-                verify(attribute in self.data[0], msg)
-
-                if index is None:
-                    # Return all values for specified attribute
-                    return [x[attribute] for x in self.data]
+                values = [x[attribute] for x in self.data]
+                if as_array:
+                    return _values_to_array(values)
                 else:
-                    # Return value for specified attribute and index
-                    msg = ('Specified index must be either None or '
-                           'an integer. I got %s' % index)
-                    verify(isinstance(index, int), msg)
+                    return values
+        else:
+            # Return value for specified attribute and index
+            msg = ('Specified index must be either None or '
+                   'an integer. I got %s' % index)
+            verify(isinstance(index, int), msg)
+
+            msg = ('Specified index must lie within the bounds '
+                   'of vector layer %s which is [%i, %i]'
+                   '' % (self, 0, len(self) - 1))
+            verify(0 <= index < len(self), msg)
+
+            if self.columns is not None:
+                return self.columns[attribute][index:index + 1].tolist()[0]
+            else:
+                return self.data[index][attribute]
 
-                    msg = ('Specified index must lie within the bounds '
-                           'of vector layer %s which is [%i, %i]'
-                           '' % (self, 0, len(self) - 1))
-                    verify(0 <= index < len(self), msg)
+    def _set_columns(self, columns):
+        """Store attributes as columns discarding any list of rows
 
-                    return self.data[index][attribute]
+        Args:
+            * columns: Dictionary of attribute names and numpy arrays
+        """
+
+        self.columns = columns
+        if 'data' in self.__dict__:
+            del self.data
+
+    def __getattr__(self, name):
+        """Generate list of attribute rows from columns when first accessed
+
+        Note:
+            Once generated, the rows replace the columns as rows handed out
+            may be modified by the caller.
+        """
+
+        if name != 'data' or self.__dict__.get('columns') is None:
+            raise AttributeError(name)
+
+        names = self.columns.keys()
+        if len(names) == 0:
+            data = [{} for i in range(len(self))]
         else:
-            msg = 'Vector data instance does not have any attributes'
-            raise GetDataError(msg)
+            values = [self.columns[x].tolist() for x in names]
+            data = [dict(zip(names, row)) for row in zip(*values)]
+
+        self.columns = None
+        self.data = data
+        return data
 
     def get_geometry_type(self):
         """Return geometry type for vector layer
@@ -821,7 +1144,9 @@ class Vector(Layer):
 
         Optional boolean argument as_geometry_objects will change the return
         value to a list of geometry objects rather than a list of arrays.
-        This currently only applies to polygon geometries
+        This currently only applies to polygon geometries which are
+        stored packed in a PolygonArray. The geometry objects are light
+        weight views into its coordinates.
         """
 
         if copy:
@@ -831,7 +1156,7 @@ class Vector(Layer):
 
         if self.is_polygon_data:
             if not as_geometry_objects:
-                geometry = [p.outer_ring for p in geometry]
+                geometry = geometry.get_outer_rings()
         else:
             if as_geometry_objects:
                 msg = ('Argument as_geometry_objects can currently '
@@ -976,14 +1301,8 @@ def convert_polygons_to_centroids(V):
     msg = 'Input data %s must be polygon vector data' % V
     verify(V.is_polygon_data, msg)
 
-    geometry = V.get_geometry()
-    N = len(V)
-
-    # Calculate points for each polygon
-    centroids = []
-    for i in range(N):
-        c = calculate_polygon_centroid(geometry[i])
-        centroids.append(c)
+    # Calculate points for all polygons at once
+    centroids = calculate_polygon_centroids(V)
 
     # Create new point vector layer with same attributes and return
     V = Vector(data=V.get_data(),
@@ -992,3 +1311,57 @@ def convert_polygons_to_centroids(V):
                name='%s_centroid_data' % V.get_name(),
                keywords=V.get_keywords())
     return V
+
+
+def calculate_polygon_centroids(V):
+    """Calculate centroids of all polygons in vector layer
+
+    Args:
+        * V: Vector layer with polygon data
+
+    Returns:
+        * Nx2 array with the centroid of each polygon
+
+    Note:
+        The centroid of a polygon is that of its outer ring as computed by
+        calculate_polygon_centroid. The shoelace sums for all polygons are
+        computed at once over the packed coordinates of the layer.
+    """
+
+    msg = 'Input data %s must be polygon vector data' % V
+    verify(V.is_polygon_data, msg)
+
+    polygons = V.get_geometry(as_geometry_objects=True)
+    C = calculate_ring_centroids(polygons.coordinates, polygons.ring_offsets)
+
+    return C[polygons.part_offsets[:-1]]
+
+
+def calculate_polygon_areas(V):
+    """Calculate areas of all polygons in vector layer
+
+    Args:
+        * V: Vector layer with polygon data
+
+    Returns:
+        * Array with the area of each polygon, i.e. the area of its outer
+          ring minus the areas of its inner rings
+
+    Note:
+        Areas are in the units of the layer's coordinates, e.g. square
+        degrees for geographic data.
+    """
+
+    msg = 'Input data %s must be polygon vector data' % V
+    verify(V.is_polygon_data, msg)
+
+    polygons = V.get_geometry(as_geometry_objects=True)
+    A = calculate_ring_areas(polygons.coordinates, polygons.ring_offsets)
+
+    # Subtract inner rings from the outer ring of each polygon
+    N = len(polygons)
+    sign = -numpy.ones(len(A))
+    sign[polygons.part_offsets[:-1]] = 1
+    owners = numpy.repeat(numpy.arange(N), numpy.diff(polygons.part_offsets))
+
+    return numpy.bincount(owners, weights=sign * A, minlength=N)
@@ -55,7 +55,9 @@ from safe_qgis.safe_interface import (
     safe_read_layer,
     ReadLayerError,
     points_in_and_outside_polygon,
-    calculate_polygon_centroid,
+    label_points_by_polygons,
+    labels_to_indices,
+    calculate_polygon_centroids,
     unique_filename,
     messaging as m)
 from safe_qgis.safe_interface import (
@@ -446,8 +448,6 @@ class Aggregator(QtCore.QObject):
                     safe_impact_layer.is_polygon_data):
                 LOGGER.debug('Doing point in polygon aggregation')
 
-                myRemainingValues = myImpactValues
-
                 if safe_impact_layer.is_polygon_data:
                     # Using centroids to do polygon in polygon aggregation
                     # this is always ok because
@@ -457,38 +457,23 @@ class Aggregator(QtCore.QObject):
                     # each impact polygon will never be contained by more than
                     # one aggregation polygon
 
-                    # Calculate points for each polygon
-                    myCentroids = []
-                    for myPolygon in myImpactGeoms:
-                        if hasattr(myPolygon, 'outer_ring'):
-                            outer_ring = myPolygon.outer_ring
-                        else:
-                            # Assume it is an array
-                            outer_ring = myPolygon
-                        c = calculate_polygon_centroid(outer_ring)
-                        myCentroids.append(c)
-                    myRemainingPoints = myCentroids
+                    # Calculate points for all polygons at once
+                    myImpactPoints = calculate_polygon_centroids(
+                        safe_impact_layer)
 
                 else:
                     #this are already points data
-                    myRemainingPoints = myImpactGeoms
+                    myImpactPoints = myImpactGeoms
 
-                #iterate over the aggregation units
-                for myPolygonIndex, myPolygon in enumerate(myAggregtionUnits):
-                    if hasattr(myPolygon, 'outer_ring'):
-                        outer_ring = myPolygon.outer_ring
-                        inner_rings = myPolygon.inner_rings
-                    else:
-                        # Assume it is an array
-                        outer_ring = myPolygon
-                        inner_rings = None
+                # Find the aggregation unit each point falls into in one pass
+                myLabels = label_points_by_polygons(myImpactPoints,
+                                                    myAggregtionUnits)
+                myIndicesInside = labels_to_indices(myLabels,
+                                                    len(myAggregtionUnits))
 
-                    inside, outside = points_in_and_outside_polygon(
-                        myRemainingPoints,
-                        outer_ring,
-                        holes=inner_rings,
-                        closed=True,
-                        check_input=True)
+                #iterate over the aggregation units
+                for myPolygonIndex in range(len(myAggregtionUnits)):
+                    inside = myIndicesInside[myPolygonIndex]
 
                     #self.impactLayerAttributes is a list of list of dict
                     #[
@@ -502,7 +487,7 @@ class Aggregator(QtCore.QObject):
                             myResults[myClass] = 0
 
                         for i in inside:
-                            myKey = myRemainingValues[i][self.targetField]
+                            myKey = myImpactValues[i][self.targetField]
                             try:
                                 myResults[myKey] += 1
                             except KeyError:
@@ -517,7 +502,7 @@ class Aggregator(QtCore.QObject):
                                 raise KeyError(myError)
 
                             self.impactLayerAttributes[myPolygonIndex].append(
-                                myRemainingValues[i])
+                                myImpactValues[i])
                         myAttrs = {}
                         for k, v in myResults.iteritems():
                             myKey = '%s_%s' % (k, self.targetField)
@@ -532,14 +517,14 @@ class Aggregator(QtCore.QObject):
                         myTotal = 0
                         for i in inside:
                             try:
-                                myTotal += myRemainingValues[i][
+                                myTotal += myImpactValues[i][
                                     self.targetField]
                             except TypeError:
                                 pass
 
                             #add all attributes to the impactLayerAttributes
                             self.impactLayerAttributes[myPolygonIndex].append(
-                                myRemainingValues[i])
+                                myImpactValues[i])
                         myAttrs = {myAggrFieldIndex: QtCore.QVariant(myTotal)}
 
                     # Add features inside this polygon
@@ -547,25 +532,6 @@ class Aggregator(QtCore.QObject):
                     myAggregationProvider.changeAttributeValues(
                         {myFID: myAttrs})
 
-                    # make outside points the input to the next iteration
-                    # this could maybe be done quicklier using directly numpy
-                    # arrays like this:
-                    # myRemainingPoints = myRemainingPoints[outside]
-                    # myRemainingValues =
-                    # [myRemainingValues[i] for i in outside]
-                    myTmpPoints = []
-                    myTmpValues = []
-                    for i in outside:
-                        myTmpPoints.append(myRemainingPoints[i])
-                        myTmpValues.append(myRemainingValues[i])
-                    myRemainingPoints = myTmpPoints
-                    myRemainingValues = myTmpValues
-
-                    # LOGGER.debug('Before: ' + str(len(myRemainingValues)))
-                    # LOGGER.debug('After: ' + str(len(myRemainingValues)))
-                    # LOGGER.debug('Inside: ' + str(len(inside)))
-                    # LOGGER.debug('Outside: ' + str(len(outside)))
-
             elif safe_impact_layer.is_line_data:
                 LOGGER.debug('Doing line in polygon aggregation')
 
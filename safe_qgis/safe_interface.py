@@ -50,7 +50,11 @@ from safe.api import (
     ReadLayerError,
     get_plugins, get_version,
     in_and_outside_polygon as points_in_and_outside_polygon,
+    label_points_by_polygons,
+    labels_to_indices,
     calculate_polygon_centroid,
+    calculate_polygon_centroids,
+    calculate_polygon_areas,
     get_postprocessors,
     get_postprocessor_human_name,
     convert_mmi_data,
@@ -29,13 +29,19 @@ if __name__ == '__main__':
     parser.add_argument('--regions', metavar='regions', type=str,
                         help=('Administrative areas to be flagged as '
                               'flooded or not'))
+    parser.add_argument('--time-of-peak', action='store_true',
+                        help=('Also write the hour at which each pixel '
+                              'reaches its maximal depth'))
 
     args = parser.parse_args()
     print args
     print
 
     tif_filename = convert_netcdf2tif(args.filename, args.hours,
-                                      verbose=True)
+                                      verbose=True,
+                                      time_of_peak=args.time_of_peak)
+    if args.time_of_peak:
+        tif_filename, peak_filename = tif_filename
 
     # Tag each polygon with Y if it contains at least one pixel
     # exceeding a specific threshold (e.g. 0.3m).